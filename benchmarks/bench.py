@@ -0,0 +1,187 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sys
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+import pybles
+import pybles.builders.iptables as iptables
+from benchmarks.generate import generate_config, INTERFACES
+
+# Run from the top of the source tree with
+#
+#   python -m benchmarks.bench --rules 1000 10000 --save baseline.json
+#   python -m benchmarks.bench --rules 1000 10000 --compare baseline.json
+#
+# Saving with one interpreter and comparing with another (python2 and
+# python3, say) shows how much faster each case runs on the second.
+#
+# Parse time is measured with a builder that accepts every block and
+# directive and produces nothing, so it is the time taken to tokenize
+# the config and dispatch the callbacks.  Build time is the extra time
+# taken when the iptables builder is attached.  Every case is run in
+# its own process so the peak memory is that of the case alone
+
+METRICS = [ "parse_seconds", "build_seconds", "total_seconds", "peak_memory_mb" ]
+
+# differences smaller than these are noise, whatever the threshold
+MINIMUM_CHANGE = { "parse_seconds": 0.01, "build_seconds": 0.01, "total_seconds": 0.01, "peak_memory_mb": 1.0, "startup_seconds": 0.005 }
+
+IPS = [ "10.0.0.1", "2001:db8::1" ]
+
+class NullBuilder(pybles.DefaultBuilder):
+    def default_build_block(self, path):
+        return self
+
+    def default_build_block_end(self, block_name):
+        pass
+
+    def default_build_directive(self, path, directive):
+        return []
+
+def case_name(case):
+    return "rules=%(rules)d depth=%(depth)d chains=%(chains)d options=%(options)d v6=%(v6)g engine=%(engine)s output=%(output)s%(parallel)s" % dict(case, parallel = " parallel" if case.get("parallel") else "")
+
+def timed(function, repeat):
+    best = None
+    result = None
+    for i in range(repeat):
+        start = time.time()
+        result = function()
+        elapsed = time.time() - start
+        if (best is None or elapsed < best):
+            best = elapsed
+    return (best, result)
+
+def compile_config(config, engine, output, parallel = False):
+    builder = iptables.Builder(ips = IPS, interfaces = INTERFACES, output = output, parallel = parallel)
+    commands = list(pybles.PybleParser(builder, engine = engine).parse_string(config))
+    if (output == "restore"):
+        for payload in builder.restore_payloads().values():
+            commands.extend(payload.splitlines())
+    return commands
+
+def measure(case, repeat):
+    config = generate_config(case["rules"], case["depth"], case["chains"], case["options"], case["v6"], case["seed"])
+    (parse, result) = timed(lambda: pybles.PybleParser(NullBuilder(), engine = case["engine"]).parse_string(config), repeat)
+    (total, commands) = timed(lambda: compile_config(config, case["engine"], case["output"], case.get("parallel", False)), repeat)
+    return {
+        "name": case_name(case),
+        "case": case,
+        "parse_seconds": parse,
+        "build_seconds": max(total - parse, 0.0),
+        "total_seconds": total,
+        "commands": len(commands),
+        "commands_per_second": len(commands) / total if total > 0 else 0.0,
+        "peak_memory_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0,
+    }
+
+def measure_child(case, repeat, queue):
+    try:
+        queue.put(measure(case, repeat))
+    except BaseException as ex:
+        queue.put({ "name": case_name(case), "error": "%s: %s" % (ex.__class__.__name__, ex) })
+
+def run_case(case, repeat = 3):
+    queue = multiprocessing.Queue()
+    process = multiprocessing.Process(target = measure_child, args = (case, repeat, queue))
+    process.start()
+    result = queue.get()
+    process.join()
+    return result
+
+def compare(results, baseline, threshold = 0.1, metrics = METRICS):
+    # returns a message for every metric that got worse by more than
+    # threshold (a fraction) compared to the same case in baseline
+    previous = dict([ (result["name"], result) for result in baseline ])
+    regressions = []
+    for result in results:
+        old = previous.get(result["name"])
+        if (old is None or "error" in result or "error" in old):
+            continue
+        for metric in metrics:
+            change = result[metric] - old[metric]
+            if (change > MINIMUM_CHANGE[metric] and change > old[metric] * threshold):
+                regressions.append("%s: %s went from %.3f to %.3f (+%.0f%%)" % (result["name"], metric, old[metric], result[metric], 100.0 * change / max(old[metric], 1e-9)))
+    return regressions
+
+def speedups(results, baseline, metric = "total_seconds"):
+    # how many times faster each case ran than the same case in baseline
+    previous = dict([ (result["name"], result) for result in baseline ])
+    lines = []
+    for result in results:
+        old = previous.get(result["name"])
+        if (old is None or "error" in result or "error" in old or result[metric] <= 0):
+            continue
+        lines.append("%s: %s went from %.3f to %.3f (%.2fx)" % (result["name"], metric, old[metric], result[metric], old[metric] / result[metric]))
+    return lines
+
+def format_result(result):
+    if ("error" in result):
+        return "%s\n    failed: %s" % (result["name"], result["error"])
+    return "%s\n    parse %.3fs  build %.3fs  total %.3fs  %d commands  %.0f commands/sec  peak %.1fMB" % (result["name"], result["parse_seconds"], result["build_seconds"], result["total_seconds"], result["commands"], result["commands_per_second"], result["peak_memory_mb"])
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Benchmark PybleParser and the iptables builder on synthetic configs")
+    parser.add_argument("--rules", type = int, nargs = "+", default = [ 1000, 10000 ])
+    parser.add_argument("--depth", type = int, default = 1, help = "nesting depth of the user defined chains")
+    parser.add_argument("--chains", type = int, default = 10, help = "number of user defined chains in the input chain")
+    parser.add_argument("--options", type = int, default = 2, help = "maximum number of options per rule")
+    parser.add_argument("--v6", type = float, default = 0.5, help = "fraction of addresses that are IPv6")
+    parser.add_argument("--seed", type = int, default = 0)
+    parser.add_argument("--engine", choices = pybles.ENGINES, nargs = "+", default = pybles.ENGINES)
+    parser.add_argument("--output", choices = [ "commands", "restore" ], nargs = "+", default = [ "commands" ])
+    parser.add_argument("--parallel", action = "store_true", help = "compile each top level chain in its own process")
+    parser.add_argument("--repeat", type = int, default = 3, help = "runs per case, the fastest is reported")
+    parser.add_argument("--save", help = "write the results to this JSON file")
+    parser.add_argument("--compare", help = "JSON file from an earlier --save to check for regressions against")
+    parser.add_argument("--threshold", type = float, default = 0.1, help = "fractional slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = []
+    for rules in args.rules:
+        for engine in args.engine:
+            for output in args.output:
+                case = { "rules": rules, "depth": args.depth, "chains": args.chains, "options": args.options, "v6": args.v6, "seed": args.seed, "engine": engine, "output": output, "parallel": args.parallel }
+                result = run_case(case, args.repeat)
+                sys.stdout.write("%s\n" % format_result(result))
+                sys.stdout.flush()
+                results.append(result)
+
+    if (args.save):
+        with open(args.save, "w") as f:
+            json.dump({ "python": sys.version.split()[0], "results": results }, f, indent = 2)
+
+    failed = len([ result for result in results if "error" in result ]) > 0
+    if (args.compare):
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        sys.stdout.write("compared with python %s\n" % baseline.get("python", "unknown"))
+        for line in speedups(results, baseline["results"]):
+            sys.stdout.write("SPEEDUP %s\n" % line)
+        regressions = compare(results, baseline["results"], args.threshold)
+        for regression in regressions:
+            sys.stdout.write("REGRESSION %s\n" % regression)
+        if (len(regressions) > 0):
+            failed = True
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,95 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sys
+import random
+import argparse
+
+INTERFACES = [ "eth0", "eth1" ]
+
+TARGETS = [ "accept", "accept", "accept", "drop", "reject", "log" ]
+
+# Synthetic filter configs for benchmarking.  The rules are spread
+# evenly over the input chain and `chains` user defined chains, each
+# of which is nested `depth` levels deep.  Every rule gets up to
+# `options` of the options below, with `v6` being the fraction of
+# rules matching IPv6 rather than IPv4 addresses
+def option_generators(r, v6):
+    def ports(rule):
+        return "%s dst-port:%d" % (r.choice([ "tcp", "udp" ]), r.randint(1, 65535))
+
+    def address(rule):
+        if (r.random() < v6):
+            return "from 2001:db8:%x::%x" % (r.randint(0, 0xffff), r.randint(1, 0xffff))
+        return "from 10.%d.%d.%d" % (r.randint(0, 255), r.randint(0, 255), r.randint(1, 254))
+
+    def interface(rule):
+        return "to dst-int:%s" % r.choice(INTERFACES)
+
+    def limit(rule):
+        return "rate-limit %d/%s" % (r.randint(1, 100), r.choice([ "sec", "min" ]))
+
+    def prefix(rule):
+        if (rule.startswith("log")):
+            return "prefix \"rule %d dropped\"" % r.randint(1, 65535)
+        return None
+
+    return [ ports, address, interface, limit, prefix ]
+
+def generate_rule(r, generators, options):
+    rule = "%s" % r.choice(TARGETS)
+    for generator in r.sample(generators, min(options, len(generators))):
+        option = generator(rule)
+        if (option is not None):
+            rule = "%s %s" % (rule, option)
+    return "%s;" % rule
+
+def generate_config(rules = 1000, depth = 1, chains = 10, options = 2, v6 = 0.5, seed = 0):
+    r = random.Random(seed)
+    generators = option_generators(r, v6)
+
+    # the input chain plus every nested chain gets a share of the rules
+    blocks = 1 + chains * depth
+    shares = [ rules // blocks + (1 if i < rules % blocks else 0) for i in range(blocks) ]
+    block_rules = [ [ generate_rule(r, generators, options) for i in range(share) ] for share in shares ]
+
+    lines = [ "filter {", "  input {" ]
+    block = 1
+    for chain in range(chains):
+        for level in range(depth):
+            indent = "  " * (level + 2)
+            lines.append("%schain%d-%d {" % (indent, chain, level))
+            lines.extend([ "%s  %s" % (indent, rule) for rule in block_rules[block] ])
+            block += 1
+        for level in reversed(range(depth)):
+            lines.append("%s}" % ("  " * (level + 2)))
+    lines.extend([ "    %s" % rule for rule in block_rules[0] ])
+    lines.extend([ "  }", "}", "" ])
+    return "\n".join(lines)
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = "Write a synthetic pybles filter config to stdout")
+    parser.add_argument("--rules", type = int, default = 1000)
+    parser.add_argument("--depth", type = int, default = 1, help = "nesting depth of the user defined chains")
+    parser.add_argument("--chains", type = int, default = 10, help = "number of user defined chains in the input chain")
+    parser.add_argument("--options", type = int, default = 2, help = "maximum number of options per rule")
+    parser.add_argument("--v6", type = float, default = 0.5, help = "fraction of addresses that are IPv6")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args(argv)
+    sys.stdout.write(generate_config(args.rules, args.depth, args.chains, args.options, args.v6, args.seed))
+
+if __name__ == "__main__":
+    main()
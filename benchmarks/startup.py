@@ -0,0 +1,100 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from benchmarks.bench import compare
+
+# Run from the top of the source tree with
+#
+#   python -m benchmarks.startup --save startup.json
+#   python -m benchmarks.startup --compare startup.json
+#
+# Each case is a fresh interpreter running a short script, which is
+# what a single firewall.py run pays before it does any real work.
+# The overhead is the time on top of starting an interpreter that
+# does nothing at all
+
+CONFIG = "filter { input { accept tcp dst-port:22; drop; } }"
+
+PARSE = """
+import pybles
+import pybles.builders.iptables as iptables
+list(pybles.PybleParser(iptables.Builder(), engine=%r).parse_string(%r))
+"""
+
+CASES = [
+    ("python", "pass"),
+    ("import pybles", "import pybles"),
+    ("import iptables", "import pybles.builders.iptables"),
+    ("parse pyparsing", PARSE % ("pyparsing", CONFIG)),
+    ("parse fast", PARSE % ("fast", CONFIG)),
+]
+
+METRICS = [ "startup_seconds" ]
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def run(code, root):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = root
+    start = time.time()
+    subprocess.check_call([ sys.executable, "-c", code ], env=env, cwd=root)
+    return time.time() - start
+
+def measure(repeat, root):
+    results = []
+    baseline = None
+    for (name, code) in CASES:
+        times = sorted([ run(code, root) for i in range(repeat) ])
+        result = { "name": name, "startup_seconds": times[0], "median_seconds": times[len(times) // 2] }
+        if (baseline is None):
+            baseline = times[0]
+        result["overhead_seconds"] = times[0] - baseline
+        results.append(result)
+    return results
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure how long short pybles runs take to start")
+    parser.add_argument("--repeat", type=int, default=10, help="runs per case, the fastest is reported")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="JSON file from an earlier --save to check for regressions against")
+    parser.add_argument("--threshold", type=float, default=0.1, help="fractional slowdown that counts as a regression")
+    args = parser.parse_args(argv)
+
+    results = measure(args.repeat, ROOT)
+    for result in results:
+        sys.stdout.write("%-16s %8.1fms  (median %.1fms, +%.1fms over python)\n" % (result["name"], result["startup_seconds"] * 1000, result["median_seconds"] * 1000, result["overhead_seconds"] * 1000))
+
+    if (args.save):
+        with open(args.save, "w") as f:
+            json.dump({ "python": sys.version.split()[0], "results": results }, f, indent=2)
+
+    if (args.compare):
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f)["results"], args.threshold, METRICS)
+        for regression in regressions:
+            sys.stdout.write("REGRESSION %s\n" % regression)
+        if (len(regressions) > 0):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
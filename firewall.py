@@ -1,43 +1,84 @@
-#!/usr/bin/python
+#!/usr/bin/env python3
 
 import os
 import pybles
+import pybles.system as system
 import pybles.builders.iptables as iptables
-
-def custom_chains(table = 'filter'):
-    chains = []
-    for line in os.popen("iptables -t %s -L -n -v | grep Chain | grep -v policy | awk '{print $2}'" % table):
-        chains.append(line.rstrip())
-    return chains
-
-def builtin_chains(table = 'filter'):
-    chains = []
-    for line in os.popen("iptables -t %s -L -n -v | grep Chain | grep policy | awk '{print $2}'" % table):
-        chains.append(line.rstrip())
-    return chains
+import pybles.builders.iptables.cache as cache
+from pybles.builders.iptables.ruleset import Ruleset, diff
+from pybles.builders.iptables.profile import Counters
 
 def reset_tables():
     # delete custom targets
+    tables = system.read_tables("v4", counters = False)
     for table in ('filter', 'nat', 'mangle'):
-        for chain in custom_chains(table):
-            print "iptables -t %s -X %s" % (table, chain)
-        for chain in builtin_chains(table):
-            print "iptables -t %s -F %s" % (table, chain)
+        if (table not in tables):
+            continue
+        for chain in tables[table].custom_chains():
+            print("iptables -t %s -X %s" % (table, chain))
+        for chain in tables[table].builtin_chains():
+            print("iptables -t %s -F %s" % (table, chain))
 
 interfaces = []
 interface_ips = []
-for line in os.popen("ip link show | grep -P \"^\d\" | awk -F: '{print $2}'"):
-    interface = line.strip()
-    interfaces.append(interface)
-    for line in os.popen("ip addr show %s| grep inet | awk '{print $1\" \"$2}'" % interface):
-        family, ip = line.rstrip().split()
-        ip, prefix = ip.split("/")
-        interface_ips.append(ip)
-
-parser = pybles.PybleParser(iptables.Builder(interfaces = interfaces, ips = interface_ips))
-commands = parser.parse_file("tests/test.conf")
+for interface in system.interfaces().values():
+    interfaces.append(interface.name)
+    interface_ips.extend(interface.addresses)
+
+# with PYBLES_STATS set to a file name, the time spent in each part
+# of the parse and in each builder callback is written there as JSON
+stats = None
+if (os.environ.get("PYBLES_STATS")):
+    stats = pybles.ParseStats()
+
+# the fast engine produces the same rules and errors as pyparsing
+# without loading it, PYBLES_ENGINE=pyparsing goes back to pyparsing
+engine = os.environ.get("PYBLES_ENGINE", "fast")
+
+if (os.environ.get("PYBLES_STATE")):
+    # only print the changes against the rules compiled on the last
+    # run rather than flushing and reloading every chain
+    # with PYBLES_PROFILE set the live packet counters are used to
+    # move the busiest rules towards the top of their chains
+    counters = None
+    if (os.environ.get("PYBLES_PROFILE")):
+        counters = Counters.read()
+    builder = iptables.Builder(interfaces = interfaces, ips = interface_ips, output = "restore", counters = counters)
+    commands = list(pybles.PybleParser(builder, engine = engine, stats = stats).parse_file("tests/test.conf"))
+    ruleset = builder.ruleset()
+    state = os.environ["PYBLES_STATE"]
+    previous = Ruleset()
+    if (os.path.exists(state)):
+        previous = Ruleset.load(state)
+    commands.extend(diff(previous, ruleset))
+    ruleset.save(state)
+elif (os.environ.get("PYBLES_APPLY")):
+    # loads the rules with ipset restore and then iptables-restore
+    # and ip6tables-restore at the same time, rather than printing
+    # commands, and prints how long each of them took
+    from pybles import apply
+    builder = iptables.Builder(interfaces = interfaces, ips = interface_ips, output = "restore", ipsets = "restore")
+    pybles.PybleParser(builder, engine = engine, stats = stats).parse_file("tests/test.conf")
+    try:
+        results = apply.apply(builder.restore_payloads())
+    except apply.ApplyError as ex:
+        results = ex.results
+    commands = []
+    for result in results:
+        commands.append("# %s: exit status %s after %.3fs" % (result.name, result.returncode, result.seconds))
+        if (not result.ok()):
+            commands.extend([ "#   %s" % line for line in result.output.splitlines() ])
+elif (os.environ.get("PYBLES_CACHE")):
+    compiled = cache.CompileCache(os.environ["PYBLES_CACHE"], engine = engine).compile_file("tests/test.conf", interfaces = interfaces, ips = interface_ips)
+    commands = compiled.commands
+else:
+    parser = pybles.PybleParser(iptables.Builder(interfaces = interfaces, ips = interface_ips), engine = engine, stats = stats)
+    commands = parser.iter_file("tests/test.conf")
+
 for command in commands:
-    print command
-#reset_tables()
+    print(command)
+
+if (stats is not None):
+    stats.dump(os.environ["PYBLES_STATS"])
 
 
@@ -14,17 +14,14 @@
 # limitations under the License.
 #
 
+import os
+import re
 import sys
-import pyparsing
-from pyparsing import OneOrMore, Word, Literal, alphas, alphanums, ParseException, ZeroOrMore, Optional, MatchFirst, Forward, Suppress, Group, Combine, dblQuotedString
-
-# redefine this function since it makes debugging
-# exceptions impossible
-def pyble_trim_arity(func, maxargs=2):
-    def wrapper(*args):
-        return func(*args)
-    return wrapper
-pyparsing._trim_arity = pyble_trim_arity
+import types
+from collections import namedtuple
+from pybles import scanner
+from pybles import include
+from pybles.stats import ParseStats
 
 class BuildException(BaseException):
     pass
@@ -41,41 +38,150 @@ class InvalidOption(BaseException):
 class ParseError(BaseException):
     pass
 
-class Options():
+# Directives (and their options) are immutable and can be kept once
+# the parse is over.  A directive's path is a tuple of the names of
+# the blocks it is in, which is shared by every directive in the same
+# block.  Names are interned (see pybles.scanner.Option)
+Option = scanner.Option
+
+class Options(object):
+    __slots__ = ( "options", )
+
+    # the options of the scanner (and of a pybles.tree) are used as
+    # they are, anything else with a name and value is copied
     def __init__(self, options):
-        self.option_names = []
-        self.options = {}
-        for option in options:
-            self.option_names.append(option.name)
-            self.options[option.name] = Option(name=option.name, value=option.value)
+        self.options = tuple([ option if isinstance(option, Option) else Option(scanner.intern(option.name), option.value) for option in options ])
 
+    # the last option with the name, like a dict would keep
     def __getitem__(self, name):
-        return self.options[name]
+        for option in reversed(self.options):
+            if (option.name == name):
+                return option
+        raise KeyError(name)
 
     def __len__(self):
-        return len(self.option_names)
+        return len(self.options)
 
     def __iter__(self):
-        for name in self.option_names:
-            yield self.options[name]
+        return iter(self.options)
 
-class Option():
-    def __init__(self, name, value):
-        self.name = name
-        self.value = value
+class Directive(namedtuple("Directive", "name path options")):
+    __slots__ = ()
 
-class Directive():
-    def __init__(self, name, path=[], options=[]):
-        self.name = name
-        self.path = path
-        self.options = options
+    def __new__(cls, name, path=(), options=()):
+        return super(Directive, cls).__new__(cls, name, path, options)
 
-class DefaultBuilder():
-    def get_builder(self, name):
-        if (hasattr(self, name)):
-            return getattr(self, name)
+# Builders are looked up by name for every block, block end and
+# directive, and option handlers for every option.  Rather than look
+# at the builder each time, every builder class has a table of its
+# handlers that is built the first time the class is used.  Only
+# declared methods are handlers, anything else in the config is
+# rejected.  The default_build_* methods always are, as are the
+# methods named in the class's HANDLERS, which handle the block or
+# directive of the same name (and name_end the end of the block).
+# Other methods are declared with handles, under their own name or
+# under the config names given:
+#
+#   @pybles.handles("rate-limit")
+#   def rate_limit(self, path, directive):
+#
+# Option handlers are declared with option, the value is checked
+# against pattern (which must match all of it) before the handler is
+# called and message, formatted with the value, is the InvalidOption
+# raised when it does not match
+def handles(*names):
+    def register(function):
+        function.pyble_names = names or (function.__name__,)
+        return function
+    return register
+
+def option(name, pattern=None, message=None):
+    def register(function):
+        if (pattern is not None):
+            function.pyble_option = (name, re.compile("(?:%s)$" % pattern), message or "Invalid value %%s for option %s" % name)
         else:
-            return None
+            function.pyble_option = (name, None, None)
+        return function
+    return register
+
+# every builder class's (handlers, options), see DefaultBuilder.dispatch_tables
+HANDLER_TABLES = {}
+
+DEFAULT_HANDLERS = ( "default_build_block", "default_build_block_end", "default_build_directive" )
+
+class DefaultBuilder(object):
+    # the names of methods that handle the block or directive of the
+    # same name, see handles
+    HANDLERS = ()
+
+    parse_stats = None
+    bound_handlers = None
+
+    # called by PybleParser when it was given a ParseStats, builders
+    # that time their own work (like option handlers) record it there
+    def attach_stats(self, stats):
+        self.parse_stats = stats
+
+    # called by PybleParser when a parse is over, whether or not it
+    # succeeded, for builders holding on to things like processes
+    def close(self):
+        pass
+
+    # the handler and option tables of the class, built once per class
+    @classmethod
+    def dispatch_tables(cls):
+        tables = HANDLER_TABLES.get(cls)
+        if (tables is None):
+            handlers = {}
+            options = {}
+            # base classes first, so subclasses override them
+            for klass in reversed(cls.__mro__):
+                if (klass in (object, DefaultBuilder)):
+                    continue
+                for (name, value) in klass.__dict__.items():
+                    if (not isinstance(value, types.FunctionType)):
+                        continue
+                    if (name in DEFAULT_HANDLERS):
+                        handlers[name] = name
+                    for config_name in getattr(value, "pyble_names", ()):
+                        handlers[config_name] = name
+                    if (hasattr(value, "pyble_option")):
+                        (option_name, pattern, message) = value.pyble_option
+                        options[option_name] = (name, pattern, message)
+            for name in cls.HANDLERS:
+                for method in (name, "%s_end" % name):
+                    if (hasattr(cls, method)):
+                        handlers[method] = method
+            # by method name, so a method overriding a handler is
+            # called without having to be declared again
+            handlers = dict([ (name, getattr(cls, method)) for (name, method) in handlers.items() ])
+            options = dict([ (name, (getattr(cls, method), pattern, message)) for (name, (method, pattern, message)) in options.items() ])
+            tables = (handlers, options)
+            HANDLER_TABLES[cls] = tables
+        return tables
+
+    # the handlers of the class bound to this builder, so looking one
+    # up is a single dict lookup
+    def bind_handlers(self):
+        self.bound_handlers = dict([ (name, function.__get__(self, self.__class__)) for (name, function) in self.dispatch_tables()[0].items() ])
+        return self.bound_handlers
+
+    def get_builder(self, name):
+        handlers = self.bound_handlers
+        if (handlers is None):
+            handlers = self.bind_handlers()
+        return handlers.get(name)
+
+    # calls the option handler for option, checking the value first
+    def process_option(self, option):
+        tables = HANDLER_TABLES.get(self.__class__) or self.dispatch_tables()
+        handler = tables[1].get(option.name)
+        if (handler is None):
+            raise InvalidOption("%s is an invalid option" % option.name)
+        (function, pattern, message) = handler
+        if (pattern is not None and pattern.match(option.value) is None):
+            raise InvalidOption(message % option.value)
+        function(self, option.value)
 
     def execute_directive(self, directive):
         raise BuildException("execute_directive was not implemented for %s" % self.__class__.__name__)
@@ -83,61 +189,294 @@ class DefaultBuilder():
     def __getitem__(self, name):
         return self.get_builder(name)
 
-class PybleParser:
-    def __init__(self, builder=None):
-        pyble_name  = Word(alphanums + "-")
-
-        option_value   = (Word(alphanums + ":-/,_") | dblQuotedString)
-        option         = Group(pyble_name.setResultsName("name") + option_value.setResultsName("value"))
-        options        = ZeroOrMore(option).setResultsName("options")
-        directive_name = pyble_name.setResultsName("directive_name")
-        directive      = directive_name + options + Literal(";")
+ENGINES = [ "pyparsing", "fast" ]
 
-        block_start    = pyble_name.setResultsName("block_start") + Suppress("{")
-        block_end      = Suppress("}").setResultsName("block_end")
-        block          = Forward()
-        block          << block_start + ZeroOrMore(block | directive) + block_end
+CHUNK_SIZE = 65536
 
-        directive.setParseAction(self.parse_directive)
-        block_start.setParseAction(self.block_start)
-        block_end.setParseAction(self.block_end)
+class PybleParser:
+    # stats is an optional ParseStats that timings and counts for
+    # every parse phase, callback and option handler are added to.
+    # processes is the size of the pool included files are parsed
+    # with, defaulting to the number of CPUs.  With an event_cache
+    # (a pybles.include.EventCache) included files are read through
+    # the cache instead, so only files that changed are parsed again
+    def __init__(self, builder=None, engine="pyparsing", stats=None, processes=None, event_cache=None):
+        # the scanner is always available since streaming parses
+        # use it regardless of the engine
+        self.scanner = scanner.Scanner(self)
+        if (engine not in ENGINES):
+            raise ValueError("Unknown parser engine %s, must be one of %s" % (engine, ", ".join(ENGINES)))
 
-        self.parser = OneOrMore(block)
+        self.engine = engine
         self.builder = builder
+        self.stats = stats
+        self.processes = processes
+        self.event_cache = event_cache
+        if (stats is not None):
+            # the timed callbacks shadow the plain ones, so parsers
+            # without stats do not pay anything for them
+            self.start_block = self.timed_start_block
+            self.end_block = self.timed_end_block
+            self.build_directive = self.timed_build_directive
+            if (hasattr(builder, "attach_stats")):
+                builder.attach_stats(stats)
         self.reset()
 
-    def reset(self):
+    # parses config with the shared pyparsing grammar, parse is
+    # either "parse_string" or "parse_file"
+    def parse_grammar(self, parse, config):
+        from pybles import grammar
+        grammar.dispatch.push(self)
+        try:
+            return getattr(grammar, parse)(grammar.GRAMMAR, config)
+        except grammar.ParseException as pe:
+            raise ParseError(grammar.describe(pe))
+        finally:
+            grammar.dispatch.pop()
+
+    def reset(self, infile=None):
         self.path = []
+        # tuple(self.path) for the directives, until the path changes
+        self.directive_path = None
         self.stack = [self.builder]
+        # the files being parsed, innermost include last
+        self.files = []
+        if (infile is not None):
+            self.files.append(os.path.abspath(infile))
 
     def parse_file(self, infile):
-        self.reset()
+        self.reset(infile)
+        if (self.engine == "fast"):
+            return list(self.iter_file(infile))
+
+        start = self.phase_start()
         try:
-            return self.parser.parseFile(infile, parseAll=True)
-        except ParseException, pe:
-            raise ParseError("%s" % pe)
+            return self.parse_grammar("parse_file", infile)
+        finally:
+            self.phase_end("parse", start)
+            self.close_builder()
 
-    def parse_string(self, config):
-        self.reset()
+    # infile is the name of the file config was read from, if any,
+    # which included paths are relative to
+    def parse_string(self, config, infile=None):
+        self.reset(infile)
+        start = self.phase_start()
+        try:
+            if (self.engine == "fast"):
+                return self.parse_fast(config)
+
+            return self.parse_grammar("parse_string", config)
+        finally:
+            self.phase_end("parse", start)
+            self.close_builder()
+
+    def parse_fast(self, config):
+        try:
+            return self.scanner.parse(config)
+        except scanner.ScanError as se:
+            raise ParseError("%s" % se)
+
+    # The iter_* methods are generators that yield the builder output
+    # for each directive as soon as the directive has been read
+    def iter_chunks(self, chunks, infile=None):
+        self.reset(infile)
+        start = self.phase_start()
+        try:
+            for result in self.scanner.iter_parse(chunks):
+                # time spent by the caller between results is not
+                # part of the parse
+                self.phase_end("parse", start)
+                start = None
+                yield result
+                if (self.stats is not None):
+                    start = self.stats.clock()
+        except scanner.ScanError as se:
+            raise ParseError("%s" % se)
+        finally:
+            self.phase_end("parse", start)
+            self.close_builder()
+
+    def iter_string(self, config):
+        return self.iter_chunks([ config ])
+
+    def iter_file(self, infile, chunk_size=CHUNK_SIZE):
+        with open(infile) as f:
+            for result in self.iter_chunks(iter(lambda: f.read(chunk_size), ""), infile):
+                yield result
+
+    # builders need not be DefaultBuilders, so close is optional
+    def close_builder(self):
+        close = getattr(self.builder, "close", None)
+        if (callable(close)):
+            close()
+
+    # the parse phase is counted when it starts, the time is added
+    # when it ends (which may be more than once for the iter_* methods)
+    def phase_start(self, phase="parse"):
+        if (self.stats is None):
+            return None
+        self.stats.record("phases", phase, 0.0)
+        return self.stats.clock()
+
+    def phase_end(self, phase, start):
+        if (start is not None):
+            self.stats.record("phases", phase, self.stats.clock() - start, 0)
+
+    def record_callback(self, category, name, start):
+        elapsed = self.stats.clock() - start
+        self.stats.record(category, name, elapsed)
+        self.stats.record("phases", "callbacks", elapsed)
+
+    def timed_start_block(self, name):
+        start = self.stats.clock()
         try:
-            return self.parser.parseString(config, parseAll=True)
-        except ParseException, pe:
-            raise ParseError("%s" % pe)
+            return PybleParser.start_block(self, name)
+        finally:
+            self.record_callback("blocks", name, start)
 
+    def timed_end_block(self):
+        if (len(self.stack) < 2):
+            return PybleParser.end_block(self)
+        name = self.path[-1]
+        start = self.stats.clock()
+        try:
+            return PybleParser.end_block(self)
+        finally:
+            self.record_callback("block_ends", name, start)
+
+    def timed_build_directive(self, name, options):
+        start = self.stats.clock()
+        try:
+            return PybleParser.build_directive(self, name, options)
+        finally:
+            self.record_callback("directives", name, start)
+
+    # pyparsing parse actions, these only unpack the tokens
+    # and hand off to the engine independent callbacks below
     def block_start(self, string, location, tokens):
+        self.start_block(scanner.intern(tokens.block_start))
+        return []
+
+    def block_end(self, string, location, tokens):
+        result = self.end_block()
+        if (isinstance(result, list)):
+            return result
+        return []
+
+    def parse_directive(self, string, location, tokens):
+        return self.build_directive(scanner.intern(tokens.directive_name), tokens.options)
+
+    def parse_include(self, string, location, tokens):
+        return self.include(tokens.include[1:-1])
+
+    # Included files are tokenized across a process pool and then
+    # replayed here, one file after another in include order, so the
+    # builder sees exactly what it would if the files were pasted in
+    # place of the include
+    def include(self, pattern):
+        base = os.getcwd()
+        if (len(self.files) > 0):
+            base = os.path.dirname(self.files[-1])
+        start = self.phase_start("include")
+        if (self.event_cache is not None):
+            paths = self.event_cache.resolve(pattern, base)
+            parsed = [ self.event_cache.parse_events(path) for path in paths ]
+        else:
+            paths = include.resolve(pattern, base)
+            processes = 1
+            if (len(paths) > 1):
+                # only imported when there is something to share out
+                import multiprocessing
+                processes = min(len(paths), self.processes or multiprocessing.cpu_count())
+            if (processes > 1):
+                pool = multiprocessing.Pool(processes)
+                try:
+                    parsed = pool.map(include.parse_events, paths)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                parsed = [ include.parse_events(path) for path in paths ]
+        self.phase_end("include", start)
+
+        results = []
+        for (path, events, error) in parsed:
+            if (error is not None):
+                raise ParseError("%s: %s" % (path, error))
+            path = os.path.abspath(path)
+            if (path in self.files):
+                raise ParseError("%s includes itself through %s" % (path, " -> ".join(self.files[self.files.index(path):])))
+            self.files.append(path)
+            results.extend(self.replay(events))
+            self.files.pop()
+        return results
+
+    def replay(self, events):
+        results = []
+        for event in events:
+            if (event[0] == "start"):
+                self.start_block(event[1])
+            elif (event[0] == "end"):
+                result = self.end_block()
+                if (isinstance(result, list)):
+                    results.extend(result)
+            elif (event[0] == "directive"):
+                result = self.build_directive(event[1], [ scanner.Option(name, value) for (name, value) in event[2] ])
+                if (isinstance(result, list)):
+                    results.extend(result)
+                elif (result is not None):
+                    results.append(result)
+            elif (event[0] == "include"):
+                results.extend(self.include(event[1]))
+        return results
+
+    # Builds a pybles.tree.Config, which was parsed (and had its
+    # includes read) once, with this parser's builder
+    def build_tree(self, config):
+        self.reset(config.path)
+        start = self.phase_start("build")
+        try:
+            return self.build_nodes(config.body)
+        finally:
+            self.phase_end("build", start)
+            self.close_builder()
+
+    def build_nodes(self, nodes):
+        from pybles import tree
+        results = []
+        for node in nodes:
+            if (isinstance(node, tree.Block)):
+                self.start_block(node.name)
+                results.extend(self.build_nodes(node.body))
+                result = self.end_block()
+                if (isinstance(result, list)):
+                    results.extend(result)
+            elif (isinstance(node, tree.Directive)):
+                result = self.build_directive(node.name, node.options)
+                if (isinstance(result, list)):
+                    results.extend(result)
+                elif (result is not None):
+                    results.append(result)
+            else:
+                self.files.append(node.path)
+                results.extend(self.build_nodes(node.body))
+                self.files.pop()
+        return results
+
+    def start_block(self, name):
         if (self.stack[-1] is not None):
-            callback = self.stack[-1][tokens.block_start]
+            callback = self.stack[-1][name]
             if (callback is None):
                 callback = self.stack[-1]["default_build_block"]
 
             if (callback):
-                self.path.append(tokens.block_start)
+                self.path.append(name)
+                self.directive_path = None
                 self.stack.append(callback(self.path))
             else:
-                raise InvalidBlock("Cannot parse block %s with builder %s" % (string, self.stack[-1].__class__.__name__))
-        return []
+                raise InvalidBlock("Cannot parse block %s with builder %s" % (name, self.stack[-1].__class__.__name__))
 
-    def block_end(self, string, location, tokens):
+    def end_block(self):
         # never never never pop off the base builder, if you do
         # then the builder loses its anchor and if the parse tree
         # ends up at the root of the object then needs to
@@ -172,21 +511,27 @@ class PybleParser:
             if (callback is None):
                 callback = self.stack[-1]["default_build_block_end"]
 
+            # a list returned by the end callback is output the
+            # same way as the results of a directive
+            result = None
             if (callback):
-                callback(self.path)
+                result = callback(self.path)
 
             self.path.pop()
-        return []
+            self.directive_path = None
+            return result
 
-    def parse_directive(self, string, location, tokens):
+    def build_directive(self, name, options):
         if (self.stack[-1]):
-            callback = self.stack[-1][tokens.directive_name]
+            callback = self.stack[-1][name]
             if (callback is None):
                 callback = self.stack[-1]["default_build_directive"]
 
             if (callback):
-                options = Options(tokens.options)
-                directive = Directive(name = tokens.directive_name, path = self.path, options = options)
+                path = self.directive_path
+                if (path is None):
+                    path = self.directive_path = tuple(self.path)
+                directive = Directive(name, path, Options(options))
                 return callback(self.path, directive)
             else:
-                raise InvalidDirective("Cannot parse directive %s:" % string)
+                raise InvalidDirective("Cannot parse directive %s" % name)
@@ -0,0 +1,85 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import time
+import asyncio
+from collections import namedtuple
+
+# Applies the payloads of FilterBuilder.restore_payloads.  The ipset
+# payload is loaded first since the rules match against its sets, the
+# iptables and ip6tables payloads do not depend on each other and are
+# restored at the same time.  Each payload is written to the stdin of
+# its command, and how long each command took is reported along with
+# its exit status and output.  This needs python 3
+
+COMMANDS = {
+    "ipset": [ "ipset", "restore" ],
+    "iptables-restore": [ "iptables-restore" ],
+    "ip6tables-restore": [ "ip6tables-restore" ],
+}
+
+# every payload in a stage is applied at once, a stage only starts
+# when everything in the stage before it succeeded
+STAGES = [ [ "ipset" ], [ "iptables-restore", "ip6tables-restore" ] ]
+
+# returncode is None when the command could not be started or was
+# not run because an earlier stage failed, output says which
+class Result(namedtuple("Result", "name command returncode seconds output")):
+    __slots__ = ()
+
+    def ok(self):
+        return self.returncode == 0
+
+class ApplyError(BaseException):
+    def __init__(self, results):
+        failed = [ result for result in results if not result.ok() ][0]
+        BaseException.__init__(self, "%s failed (%s): %s" % (failed.name, failed.returncode, failed.output.strip()))
+        self.results = results
+
+async def run_command(name, command, payload, clock):
+    start = clock()
+    try:
+        process = await asyncio.create_subprocess_exec(*command, stdin=asyncio.subprocess.PIPE, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT)
+    except OSError as ex:
+        return Result(name, command, None, clock() - start, "%s" % ex)
+    (output, unused) = await process.communicate(payload.encode("utf-8"))
+    return Result(name, command, process.returncode, clock() - start, output.decode("utf-8", "replace"))
+
+# commands replaces the command of any of the payloads
+async def run(payloads, commands={}, clock=time.time):
+    commands = dict(list(COMMANDS.items()) + list(commands.items()))
+    results = []
+    failed = None
+    for stage in STAGES:
+        names = [ name for name in stage if name in payloads ]
+        if (failed is not None):
+            results.extend([ Result(name, commands[name], None, 0.0, "not run since %s failed" % failed) for name in names ])
+            continue
+        stage_results = await asyncio.gather(*[ run_command(name, commands[name], payloads[name], clock) for name in names ])
+        results.extend(stage_results)
+        for result in stage_results:
+            if (not result.ok()):
+                failed = result.name
+                break
+    return results
+
+# Returns the Result of every payload, or raises an ApplyError holding
+# them if any of them failed
+def apply(payloads, commands={}, clock=time.time):
+    results = asyncio.run(run(payloads, commands, clock))
+    if (len([ result for result in results if not result.ok() ]) > 0):
+        raise ApplyError(results)
+    return results
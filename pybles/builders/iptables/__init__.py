@@ -14,8 +14,22 @@
 # limitations under the License.
 #
 
-import re
+import hashlib
 import pybles
+from collections import OrderedDict
+from pybles.builders.iptables.rule import Rule, FAMILIES
+from pybles.builders.iptables.ruleset import Ruleset, BUILTIN_CHAINS
+from pybles.builders.iptables.optimize import OptimizeReport, optimize_chain
+from pybles.builders.iptables.profile import reorder_chain
+from pybles.builders.iptables.dispatch import dispatch_chains
+from pybles.builders.iptables.ipset import ipset_restore, MAX_NAME as IPSET_MAX_NAME
+
+RESTORE_COMMANDS = [ ("iptables-restore", "v4"), ("ip6tables-restore", "v6") ]
+
+# option values checked before their handlers are called
+PORTS = r"(?:src|dst)-port:(?:\d+|\d+:|\d+:\d+|:\d+)"
+PORTS_MESSAGE = "Invalid port option %s, must be src-port: or dst-port: followed by a port or a range of ports"
+RATE_LIMIT = r"\d+(?:/(?:sec|min|hour|day))?"
 
 class IPTablesIP():
     def __init__(self, ip):
@@ -49,6 +63,10 @@ class Options():
         for option_name in self.option_names:
             yield self.options[option_name]
 
+    def items(self):
+        for option_name in self.option_names:
+            yield (option_name, self.options[option_name])
+
 class Directive():
     def __init__(self, command="", options = {}):
         self.command = command
@@ -57,31 +75,164 @@ class Directive():
     def strings(self):
         return [ "%s %s" % (self.command, " ".join(self.options)) ]
 
-class FilterDirective(Directive):
-    def __init__(self):
-        self.v4Options = Options()
-        self.v6Options = Options()
+# The v4 and v6 rule for a single filter directive
+class FilterDirective(object):
+    __slots__ = ( "v4", "v6", "address_families" )
+
+    def __init__(self, table = "filter", chain = None, target = None):
+        self.v4 = Rule("v4", table, chain, target = target)
+        self.v6 = Rule("v6", table, chain, target = target)
+        # the families given addresses by direction (src or dst)
+        self.address_families = {}
 
-    def v4String(self):
-        return "iptables %s" % " ".join(self.v4Options)
+    def rule(self, family):
+        if (family == "v4"):
+            return self.v4
+        return self.v6
 
-    def v6String(self):
-        return "ip6tables %s" % " ".join(self.v6Options)
+    # addresses of family were given for direction, self counts
+    # as both families
+    def cover(self, direction, family):
+        self.address_families.setdefault(direction, set()).add(family)
+
+    # The families the directive applies to.  Every direction that was
+    # given addresses has to have some of the family, otherwise that
+    # family's rule would match every address in that direction
+    def families(self):
+        return [ family for (family, command) in FAMILIES if len([ covered for covered in self.address_families.values() if family not in covered ]) == 0 ]
 
     def __str__(self):
-        return "%s\n%s" % (self.v4String(), self.v6String())
+        return "\n".join(self.strings())
+
+    def strings(self):
+        return [ self.rule(family).command() for family in self.families() ]
+
+# A user defined chain, which is created before anything can jump to it
+class ChainDeclaration(object):
+    __slots__ = ( "table", "name" )
+
+    def __init__(self, table, name):
+        self.table = table
+        self.name = name
 
     def strings(self):
-        return [ self.v4String(), self.v6String() ]
+        strings = []
+        for action in [ "-N %s" % self.name, "-P %s RETURN" % self.name ]:
+            for (family, command) in FAMILIES:
+                strings.append("%s -t %s %s" % (command, self.table, action))
+        return strings
+
+# An ipset holding the addresses of an address list or group
+class AddressSet(object):
+    __slots__ = ( "name", "family", "set_type", "members" )
+
+    def __init__(self, name, family, set_type, members):
+        self.name = name
+        self.family = family
+        self.set_type = set_type
+        self.members = members
+
+    # the set as ipset_restore takes it
+    def restore_set(self):
+        return (self.name, "%s family %s" % (self.set_type, self.family), self.members)
+
+    def strings(self):
+        strings = [ "ipset create %s %s family %s" % (self.name, self.set_type, self.family) ]
+        for member in self.members:
+            strings.append("ipset add %s %s" % (self.name, member))
+        return strings
+
+# Records everything inside a top level chain so that the chain can
+# be compiled in a worker process, see FilterBuilder.parallel
+class ChainRecorder(pybles.DefaultBuilder):
+    def __init__(self, name):
+        self.chain_events = [ ("start", name) ]
+
+    def default_build_block(self, path):
+        self.chain_events.append(("start", path[-1]))
+        return self
+
+    def default_build_block_end(self, path):
+        self.chain_events.append(("end",))
+
+    def default_build_directive(self, path, directive):
+        self.chain_events.append(("directive", directive.name, [ (option.name, option.value) for option in directive.options ]))
+        return []
+
+# Runs in a pool worker, replaying one top level chain into a fresh
+# FilterBuilder and returning everything it built.  The pybles
+# exceptions are not Exceptions, which the pool would not pass back,
+# so they are returned and raised again in the parent
+def compile_chain(events, options):
+    try:
+        builder = FilterBuilder(**options)
+        # the system address sets are only created by the parent builder
+        builder.directives = []
+        builder.worker_flushes = []
+        parser = pybles.PybleParser(builder, engine="fast")
+        parser.path = [ "filter" ]
+        parser.replay(events + [ ("end",) ])
+        return (None, (builder.worker_flushes, builder.directives, builder.rules))
+    except (KeyboardInterrupt, SystemExit):
+        raise
+    except BaseException as ex:
+        return (ex, None)
 
 class FilterBuilder(pybles.DefaultBuilder):
-    def __init__(self, interfaces = [], ips = []):
+    # worker processes collect the directives of each flush here
+    # rather than turning them into strings
+    worker_flushes = None
+
+    # with parallel set, every top level chain (input, output, forward
+    # along with the chains nested in them) is compiled in a pool of
+    # processes and the results are put back together in source order
+    # when the filter block ends.  dispatch replaces runs of jumps to
+    # chains selected by distinct ports or addresses with a single
+    # dispatch, see pybles.builders.iptables.dispatch.  With ipsets
+    # set to restore, the address sets (the system address sets too)
+    # go in the "ipset" restore payload rather than in the commands,
+    # see pybles.builders.iptables.ipset
+    def __init__(self, interfaces = [], ips = [], output = "commands", groups = {}, optimize = False, counters = None, parallel = False, processes = None, dispatch = False, ipsets = "commands"):
+        if (output not in [ "commands", "restore" ]):
+            raise pybles.BuildException("Unknown output mode %s, must be either commands or restore" % output)
+        if (optimize and output != "restore"):
+            raise pybles.BuildException("Rules can only be optimized when the output mode is restore")
+        if (counters is not None and output != "restore"):
+            raise pybles.BuildException("Rules can only be reordered by hit counts when the output mode is restore")
+        if (dispatch and output != "restore"):
+            raise pybles.BuildException("Chains can only be dispatched when the output mode is restore")
+        if (ipsets not in [ "commands", "restore" ]):
+            raise pybles.BuildException("Unknown ipset mode %s, must be either commands or restore" % ipsets)
+        if (ipsets == "restore" and output != "restore"):
+            raise pybles.BuildException("Address sets can only be restored when the output mode is restore")
         self.interfaces = interfaces 
-        self.ips = map(lambda ip: IPTablesIP(ip), ips)
+        self.ips = [ IPTablesIP(ip) for ip in ips ]
+        self.groups = groups
+        self.output_mode = output
+        self.optimize = optimize
+        self.counters = counters
+        self.dispatch = dispatch
+        self.dispatch_sets = []
+        self.parallel_chains = parallel
+        self.worker_processes = processes
+        self.worker_options = { "interfaces": interfaces, "ips": ips, "output": output, "groups": groups }
+        self.worker_pool = None
+        self.worker_results = []
+        self.chain_recorder = None
+        self.report = None
         self.chains = []
         self.directives = []
-
-        if (len(ips) > 0):
+        self.rules = []
+        self.address_sets = set()
+        # the AddressSets for the ipset payload, when ipsets is restore
+        self.restore_sets = None
+
+        if (ipsets == "restore"):
+            self.restore_sets = []
+            if (len(ips) > 0):
+                self.restore_sets.append(AddressSet("iptables-self", "inet", "hash:ip", [ str(ip) for ip in self.ips if ip.ipv4 ]))
+                self.restore_sets.append(AddressSet("iptables-self-v6", "inet6", "hash:ip", [ str(ip) for ip in self.ips if ip.ipv6 ]))
+        elif (len(ips) > 0):
             d = Directive("ipset")
             d.options["action"] = "create"
             d.options["name"] = "iptables-self"
@@ -113,55 +264,100 @@ class FilterBuilder(pybles.DefaultBuilder):
                     self.directives.append(d)
 
 
-    def new_directive(self):
-        self.currentDirective = FilterDirective()
-        self.directives.append(self.currentDirective)
-        self.append_option("table", "-t filter")
+    def add_directive(self, directive):
+        if (self.output_mode == "restore"):
+            self.rules.append(directive)
+        else:
+            self.directives.append(directive)
+
+    def new_directive(self, target):
+        self.currentDirective = FilterDirective("filter", self.chains[-1], target)
+        self.add_directive(self.currentDirective)
 
-    def append_option(self, option_name, option):
-        self.append_v4_option(option_name, option)
-        self.append_v6_option(option_name, option)
+    def set_field(self, field, value):
+        self.set_v4_field(field, value)
+        self.set_v6_field(field, value)
 
-    def append_v4_option(self, option_name, option):
-        self.currentDirective.v4Options[option_name] = option
+    def set_v4_field(self, field, value):
+        self.currentDirective.v4.set(field, value)
 
-    def append_v6_option(self, option_name, option):
-        self.currentDirective.v6Options[option_name] = option
+    def set_v6_field(self, field, value):
+        self.currentDirective.v6.set(field, value)
 
+    @pybles.option("prefix")
     def prefix_option(self, value):
         if (self.current_target == "log"):
-            self.append_option("log_prefix", "--prefix %s" % value)
+            self.set_field("log_prefix", value)
         else:
             raise pybles.InvalidOption("The prefix option can only be used with the log target")
 
+    @pybles.option("rate-limit", RATE_LIMIT, "Invalid rate limit %s, must be an integer optionally followed by /sec, /min, /hour or /day")
     def rate_limit_option(self, value):
-        rate = None
         value = value.split("/")
-        try:
-            rate = int(value[0])
-        except ValueError, ex:
-            raise pybles.InvalidOption("The rate-limit rate must be an integer")
-
         if (len(value) > 1):
-            if (value[1] in ["sec", "min", "hour", "day"]):
-                self.append_option("rate_limit", "-m limit --limit %d/%s" % (rate, value[1]))
-            else:
-                raise InvalidDOption("Invalid rate limit interval %s" % value[1])
+            self.set_field("limit", "%d/%s" % (int(value[0]), value[1]))
         else:
-            self.append_option("rate_limit", "-m limit --limit %d" % rate)
+            self.set_field("limit", "%d" % int(value[0]))
 
-    def tofrom_ip(self, ip_arg, ip):
-        direction = "to" if ip_arg == "-d" else "from"
+    def tofrom_ip(self, field, ip):
         if (ip.ipv4):
-            self.append_v4_option("%s_match_ip" % direction, "%s %s" % (ip_arg, ip))
+            self.set_v4_field(field, str(ip))
+            self.currentDirective.cover(field, "v4")
         elif (ip.ipv6):
-            self.append_v6_option("%s_match_ip" % direction, "%s %s" % (ip_arg, ip))
-
-    def tofrom_interface(self, required_direction, int_arg, value):
+            self.set_v6_field(field, str(ip))
+            self.currentDirective.cover(field, "v6")
+
+    def address_set_name(self, group, suffix, ips):
+        if (group is not None and len("pybles-%s%s" % (group, suffix)) <= IPSET_MAX_NAME):
+            return "pybles-%s%s" % (group, suffix)
+        digest = hashlib.sha1(",".join(sorted([ str(ip) for ip in ips ])).encode("utf-8")).hexdigest()
+        return "pybles-%s%s" % (digest[:12], suffix)
+
+    def create_address_set(self, name, family, ips):
+        if (name in self.address_sets):
+            return
+        self.address_sets.add(name)
+
+        set_type = "hash:ip"
+        if (len([ ip for ip in ips if str(ip).find("/") > -1 ]) > 0):
+            set_type = "hash:net"
+
+        # the set has to exist before the rule that matches against it
+        index = len(self.directives)
+        if (self.currentDirective in self.directives):
+            index = self.directives.index(self.currentDirective)
+        self.directives.insert(index, AddressSet(name, family, set_type, [ str(ip) for ip in ips ]))
+
+    # Lists of more than one address per family are matched with a
+    # single ipset lookup instead of one rule per address
+    def tofrom_addresses(self, field, addresses, group = None):
+        ips = [ IPTablesIP(address) for address in addresses ]
+        for ip in ips:
+            if (not (ip.ipv4 or ip.ipv6)):
+                raise pybles.InvalidOption("%s is not an IPv4 or IPv6 address" % ip)
+
+        v4 = [ ip for ip in ips if ip.ipv4 ]
+        v6 = [ ip for ip in ips if ip.ipv6 ]
+        for (members, suffix, family, set_family_field) in [ (v4, "", "inet", self.set_v4_field), (v6, "-v6", "inet6", self.set_v6_field) ]:
+            if (len(members) == 1):
+                self.tofrom_ip(field, members[0])
+            elif (len(members) > 1):
+                name = self.address_set_name(group, suffix, members)
+                self.create_address_set(name, family, members)
+                set_family_field("%s_set" % field, name)
+                self.currentDirective.cover(field, "v4" if family == "inet" else "v6")
+
+    def tofrom_group(self, field, value):
+        (prefix, group) = value.split(":", 1)
+        if (group not in self.groups):
+            raise pybles.InvalidOption("Unknown address group %s" % group)
+        self.tofrom_addresses(field, self.groups[group], group)
+
+    def tofrom_interface(self, required_direction, field, value):
         (inttype, interface) = value.split(":")
         if (self.direction == required_direction):
             if (interface in self.interfaces):
-                self.append_option("%s_match" % inttype, "%s %s" % (int_arg, interface))
+                self.set_field(field, interface)
             else:
                 raise pybles.InvalidOption("Interface %s is not listed as an available system interface" % interface)
         else:
@@ -171,102 +367,276 @@ class FilterBuilder(pybles.DefaultBuilder):
         if (len(self.ips) == 0):
             raise pybles.InvalidOption("Cannot specify to/from self when no system addresses have been specified")
         if (self.direction == required_direction):
-            self.append_v4_option("%s_ip_set" % dst_arg, "-m set --match-set iptables-self %s" % dst_arg)
-            self.append_v6_option("%s_ip_set" % dst_arg, "-m set --match-set iptables-self-v6 %s" % dst_arg)
+            self.set_v4_field("%s_set" % dst_arg, "iptables-self")
+            self.set_v6_field("%s_set" % dst_arg, "iptables-self-v6")
+            self.currentDirective.cover(dst_arg, "v4")
+            self.currentDirective.cover(dst_arg, "v6")
         else:
             raise pybles.InvalidOption("\"%s self\" only applies to %s traffic" % (direction, required_direction))
 
+    @pybles.option("from")
     def from_option(self, value):
         if (value == "self"):
             self.tofrom_self("from", "output", "src")
         elif (value.find("int:") > -1):
-            self.tofrom_interface("output", "-o", value)
+            self.tofrom_interface("output", "out_interface", value)
+        elif (value.startswith("group:")):
+            self.tofrom_group("src", value)
+        elif (value.find(",") > -1):
+            self.tofrom_addresses("src", value.split(","))
         else:
-            self.tofrom_ip("-s", IPTablesIP(value))
+            self.tofrom_ip("src", IPTablesIP(value))
 
+    @pybles.option("to")
     def to_option(self, value):
         if (value == "self"):
             self.tofrom_self("to", "input", "dst")
         elif (value.find("int:") > -1):
-            self.tofrom_interface("input", "-i", value)
+            self.tofrom_interface("input", "in_interface", value)
+        elif (value.startswith("group:")):
+            self.tofrom_group("dst", value)
+        elif (value.find(",") > -1):
+            self.tofrom_addresses("dst", value.split(","))
         else:
-            self.tofrom_ip("-d", IPTablesIP(value))
+            self.tofrom_ip("dst", IPTablesIP(value))
 
+    # the value has already been checked against PORTS
     def srcdst_ports(self, ports):
-        (direction, ports) = ports.split(":")
-        if (re.match(r"""^(?:\d+)|(?:\d+:)|(?:\d+:\d+)|(?::\d+)$""", ports)):
-            if (direction == "dst-port"):
-                self.append_option("dst_port", "--dport %s" % ports)
-            elif (direction == "src-port"):
-                self.append_option("src_port", "--sport %s" % ports)
-            else:
-                raise pybles.InvalidOption("Port option must be either src-port or dst-port")
+        (direction, ports) = ports.split(":", 1)
+        if (direction == "dst-port"):
+            self.set_field("dport", (ports,))
         else:
-            raise pybles.InvalidOption("The supplied port argument, %s, is not recognized." % ports)
+            self.set_field("sport", (ports,))
 
+    @pybles.option("udp", PORTS, PORTS_MESSAGE)
     def udp_option(self, value):
-        self.append_option("protocol_module", "-m udp")
-        self.append_option("protocol", "-p udp")
+        self.set_field("protocol", "udp")
         self.srcdst_ports(value)
 
+    @pybles.option("tcp", PORTS, PORTS_MESSAGE)
     def tcp_option(self, value):
-        self.append_option("protocol_module", "-m tcp")
-        self.append_option("protocol", "-p tcp")
+        self.set_field("protocol", "tcp")
         self.srcdst_ports(value)
 
     def process_options(self, directive):
         for option in directive.options:
-            option_name = option.name.replace("-", "_")
-            if (hasattr(self, "%s_option" % option_name)):
-                getattr(self, "%s_option" % option_name)(option.value)
+            if (self.parse_stats is None):
+                self.process_option(option)
             else:
-                raise pybles.InvalidOption("%s is an invalid option" % option_name)
+                start = self.parse_stats.clock()
+                self.process_option(option)
+                self.parse_stats.record("options", option.name, self.parse_stats.clock() - start)
 
     def default_build_directive(self, path, directive):
         if (directive.name in [ "log", "accept", "drop", "reject" ]):
+            if (len(self.chains) == 0):
+                raise pybles.InvalidDirective("\"%s\" must be inside input, output or forward" % directive.name)
             self.current_target = directive.name
-            self.new_directive()
-            self.append_option("chain", "-A %s" % self.chains[-1])
-            self.append_option("target", "-j %s" % directive.name.upper())
+            self.new_directive(directive.name.upper())
             self.process_options(directive)
-            directives = []
-            for directive in self.directives:
-                for string in directive.strings():
-                    directives.append(string)
-            self.current_directive = None
-            self.directives = []
-            return directives
+            if (len(self.currentDirective.families()) == 0):
+                raise pybles.InvalidOption("The addresses of \"%s\" have no family in common, so it would match nothing" % directive.name)
+            return self.flush_directives()
         else:
-            raise InvalidDirective("Valid directives are \"log\", \"accept\", \"drop\" and \"reject\"")
+            raise pybles.InvalidDirective("Valid directives are \"log\", \"accept\", \"drop\" and \"reject\"")
+
+    # Everything built so far is written out along with each directive
+    def flush_directives(self):
+        directives = self.directives
+        self.currentDirective = None
+        self.directives = []
+        if (self.worker_flushes is not None):
+            self.worker_flushes.append(directives)
+            return []
+        return self.render_directives(directives)
+
+    def render_directives(self, directives):
+        strings = []
+        for directive in directives:
+            if (self.restore_sets is not None and isinstance(directive, AddressSet)):
+                self.restore_sets.append(directive)
+            else:
+                strings.extend(directive.strings())
+        return strings
 
     def default_build_block(self, path):
         if (len(self.chains) == 0):
             if (path[-1] in [ 'input', 'output', 'forward' ]):
+                if (self.parallel_chains):
+                    self.chain_recorder = ChainRecorder(path[-1])
+                    return self.chain_recorder
                 self.direction = path[-1]
                 self.chains.append(path[-1].upper())
             else:
                 raise pybles.InvalidBlock("Unknown default filter chain %s" % path[-1])
         else:
             if (path[-1] not in [ 'input', 'output', 'forward' ]):
-                self.new_directive()
-                self.append_option("new_chain", "-N %s" % path[-1])
-                self.new_directive()
-                self.append_option("policy", "-P %s RETURN" % path[-1])
-                self.new_directive()
-                self.append_option("chain", "-A %s" % self.chains[-1])
-                self.append_option("target", "-j %s" % path[-1])
+                self.add_directive(ChainDeclaration("filter", path[-1]))
+                self.new_directive(path[-1])
                 self.chains.append(path[-1])
             else:
                 raise pybles.InvalidBlock("The system chain \"%s\" cannot be nested inside chain \"%s\"" % (path[-1], self.chains[-1]))
         return self
 
     def default_build_block_end(self, block_name):
-        self.chains.pop()
+        if (self.chain_recorder is not None):
+            self.compile_recorded()
+        else:
+            self.chains.pop()
+
+    def compile_recorded(self):
+        if (self.worker_pool is None):
+            import multiprocessing
+            self.worker_pool = multiprocessing.Pool(self.worker_processes)
+        events = self.chain_recorder.chain_events
+        self.chain_recorder = None
+        self.worker_results.append(self.worker_pool.apply_async(compile_chain, (events, self.worker_options)))
+
+    # Stops the workers of a parse that failed before the filter block
+    # ended, which would otherwise be left running
+    def close(self):
+        if (self.worker_pool is not None):
+            self.worker_pool.terminate()
+            self.worker_pool.join()
+            self.worker_pool = None
+            self.worker_results = []
+        self.chain_recorder = None
+
+    # Puts the chains compiled by the workers back together.  Anything
+    # a chain built but did not write out (like the declaration of an
+    # empty chain) goes out with the next directive, just as it would
+    # have without workers, and an address set used by more than one
+    # chain is only created by the first of them
+    def stitch_chains(self):
+        if (self.worker_pool is None):
+            return []
+        try:
+            compiled = []
+            for result in self.worker_results:
+                (error, chain) = result.get()
+                if (error is not None):
+                    raise error
+                compiled.append(chain)
+        finally:
+            self.worker_pool.close()
+            self.worker_pool.join()
+            self.worker_pool = None
+            self.worker_results = []
+
+        strings = []
+        for (flushes, leftover, rules) in compiled:
+            for flush in flushes:
+                directives = self.directives + flush
+                self.directives = []
+                for directive in directives:
+                    if (isinstance(directive, AddressSet)):
+                        if (directive.name in self.address_sets):
+                            continue
+                        self.address_sets.add(directive.name)
+                    strings.extend(self.render_directives([ directive ]))
+            self.directives.extend(leftover)
+            self.rules.extend(rules)
+        return strings
+
+    # Policies for user defined chains are left out since
+    # they only exist in the command output
+    def compiled_chains(self, family):
+        chains = OrderedDict([ (chain, []) for chain in BUILTIN_CHAINS ])
+        for directive in self.rules:
+            if (isinstance(directive, ChainDeclaration)):
+                chains.setdefault(directive.name, [])
+            elif (family in directive.families()):
+                rule = directive.rule(family)
+                chains[rule.chain].append(rule)
+        return chains
+
+    def ruleset(self):
+        if (self.output_mode != "restore"):
+            raise pybles.BuildException("Compiled rules are only collected when the output mode is restore")
+        if (self.parse_stats is not None):
+            start = self.parse_stats.clock()
+        ruleset = Ruleset("filter")
+        self.report = OptimizeReport()
+        self.dispatch_sets = []
+        for (command, family) in RESTORE_COMMANDS:
+            chains = self.compiled_chains(family)
+            for (chain, rules) in chains.items():
+                if (self.optimize):
+                    rules = optimize_chain(rules, self.report)
+                if (self.counters is not None):
+                    rules = reorder_chain(family, chain, rules, self.counters)
+                chains[chain] = rules
+            if (self.dispatch):
+                chains = dispatch_chains(family, chains, self.dispatch_sets)
+            for (chain, rules) in chains.items():
+                ruleset.add_chain(family, chain)
+                for rule in rules:
+                    ruleset.append(family, chain, rule)
+        if (self.parse_stats is not None):
+            self.parse_stats.record("phases", "ruleset", self.parse_stats.clock() - start)
+        return ruleset
+
+    # the sets used by chain dispatch (and the address sets when ipsets
+    # is restore) are in the "ipset" payload, for ipset restore, which
+    # has to be loaded before the others
+    def restore_payloads(self):
+        ruleset = self.ruleset()
+        payloads = {}
+        for (command, family) in RESTORE_COMMANDS:
+            payloads[command] = ruleset.restore(family)
+        payload = self.ipset_payload()
+        if (payload is not None):
+            payloads["ipset"] = payload
+        return payloads
+
+    # the "ipset" restore payload for the last ruleset built, or None
+    # when there are no sets to load
+    def ipset_payload(self):
+        sets = [ address_set.restore_set() for address_set in self.restore_sets or [] ] + self.dispatch_sets
+        if (len(sets) == 0):
+            return None
+        return ipset_restore(sets)
 
 class Builder(pybles.DefaultBuilder):
-    def __init__(self, ips=[], interfaces=[]):
-        self.filter_builder = FilterBuilder(ips=ips, interfaces=interfaces)
+    HANDLERS = ( "filter", )
+
+    # counters is a pybles.builders.iptables.profile.Counters snapshot,
+    # the hottest rules are moved up where that can not change the policy.
+    # parallel compiles each top level chain in a pool of processes
+    # (processes defaults to the number of CPUs), the commands for the
+    # whole filter block are then returned when the block ends.
+    # dispatch puts chains selected by distinct ports or addresses
+    # behind a single ipset guard.  ipsets set to restore puts the
+    # address sets in the "ipset" restore payload
+    def __init__(self, ips=[], interfaces=[], output="commands", groups={}, optimize=False, counters=None, parallel=False, processes=None, dispatch=False, ipsets="commands"):
+        self.filter_builder = FilterBuilder(ips=ips, interfaces=interfaces, output=output, groups=groups, optimize=optimize, counters=counters, parallel=parallel, processes=processes, dispatch=dispatch, ipsets=ipsets)
 
     def filter(self, *args):
         return self.filter_builder
 
+    def filter_end(self, *args):
+        return self.filter_builder.stitch_chains()
+
+    def attach_stats(self, stats):
+        self.parse_stats = stats
+        self.filter_builder.attach_stats(stats)
+
+    def close(self):
+        self.filter_builder.close()
+
+    # In restore mode the parser only returns the ipset commands, which
+    # must be run before the payloads are handed to the restore commands
+    def restore_payloads(self):
+        return self.filter_builder.restore_payloads()
+
+    def ruleset(self):
+        return self.filter_builder.ruleset()
+
+    def ipset_payload(self):
+        return self.filter_builder.ipset_payload()
+
+    # the OptimizeReport for the last ruleset (or restore
+    # payloads) built, counting the rules for both families
+    def optimize_report(self):
+        return self.filter_builder.report
+
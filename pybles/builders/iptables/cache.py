@@ -0,0 +1,145 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import hashlib
+import tempfile
+import pybles
+import pybles.builders.iptables as iptables
+from pybles import include
+
+# bump this whenever the layout of a cache entry changes
+CACHE_VERSION = "1"
+
+DEFAULT_MAX_SIZE = 64 * 1024 * 1024
+
+def code_fingerprint():
+    # compiled output depends on the pybles code as well as on the
+    # config, so entries written by a different version never match
+    root = os.path.dirname(pybles.__file__)
+    fingerprint = []
+    for (directory, dirnames, filenames) in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if (filename.endswith(".py")):
+                st = os.stat(os.path.join(directory, filename))
+                fingerprint.append("%s:%d:%d" % (os.path.relpath(os.path.join(directory, filename), root), st.st_size, int(st.st_mtime)))
+    return "\n".join(fingerprint)
+
+class CompiledConfig():
+    def __init__(self, commands, payloads=None):
+        self.commands = commands
+        self.payloads = payloads
+
+class CompileCache():
+    def __init__(self, directory, max_size=DEFAULT_MAX_SIZE, engine="pyparsing"):
+        self.directory = directory
+        self.max_size = max_size
+        self.engine = engine
+        self.fingerprint = code_fingerprint()
+        self.hits = 0
+        self.misses = 0
+        if (not os.path.isdir(directory)):
+            os.makedirs(directory)
+
+    # includes is a list of (path, contents) for every file
+    # the config includes, as from include.included_files
+    def key(self, config, ips=[], interfaces=[], output="commands", groups={}, includes=[]):
+        digest = hashlib.sha256()
+        groups = json.dumps(groups, sort_keys=True)
+        for part in [ CACHE_VERSION, self.fingerprint, output, "\0".join(ips), "\0".join(interfaces), groups ]:
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\1")
+        digest.update(config)
+        for (path, contents) in includes:
+            digest.update(b"\1")
+            digest.update(path.encode("utf-8"))
+            digest.update(b"\0")
+            digest.update(contents)
+        return digest.hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, "%s.json" % key)
+
+    def get(self, key):
+        path = self.path(key)
+        try:
+            with open(path) as f:
+                entry = json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+        # the modification time doubles as the LRU timestamp
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+        return CompiledConfig(entry["commands"], entry.get("payloads"))
+
+    def put(self, key, compiled):
+        (fd, tmp) = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump({ "commands": compiled.commands, "payloads": compiled.payloads }, f)
+        os.rename(tmp, self.path(key))
+        self.evict()
+
+    def entries(self):
+        entries = []
+        for filename in os.listdir(self.directory):
+            if (filename.endswith(".json")):
+                path = os.path.join(self.directory, filename)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((st.st_mtime, st.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        entries = self.entries()
+        size = sum([ entry[1] for entry in entries ])
+        for (mtime, entry_size, path) in entries:
+            if (size <= self.max_size):
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            size -= entry_size
+
+    def compile_file(self, infile, ips=[], interfaces=[], output="commands", groups={}):
+        with open(infile, "rb") as f:
+            config = f.read()
+
+        includes = include.included_files(config.decode("utf-8"), os.path.dirname(os.path.abspath(infile)))
+        key = self.key(config, ips=ips, interfaces=interfaces, output=output, groups=groups, includes=includes)
+        compiled = self.get(key)
+        if (compiled is not None):
+            self.hits += 1
+            return compiled
+
+        self.misses += 1
+        builder = iptables.Builder(ips=ips, interfaces=interfaces, output=output, groups=groups)
+        parser = pybles.PybleParser(builder, engine=self.engine)
+        commands = list(parser.parse_string(config.decode("utf-8"), infile))
+        payloads = None
+        if (output == "restore"):
+            payloads = builder.restore_payloads()
+
+        compiled = CompiledConfig(commands, payloads)
+        self.put(key, compiled)
+        return compiled
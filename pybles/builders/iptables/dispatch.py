@@ -0,0 +1,139 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+from collections import OrderedDict
+from pybles.builders.iptables.rule import Rule
+from pybles.builders.iptables.ruleset import BUILTIN_CHAINS
+from pybles.builders.iptables.optimize import MULTIPORT_MAX, PORT_FIELDS
+
+# A run of jumps to sibling chains walks every one of them in turn.
+# When every rule in each of the chains matches on the same field (a
+# destination port, say) and no two chains share a value, a packet
+# can only ever match rules in the one chain its value selects, so
+# the run can be replaced by a single dispatch on that field.
+#
+# nftables does this with a verdict map, which is one lookup however
+# many chains there are.  iptables can not jump to a chain looked up
+# from a set, so there the run becomes one guard rule matching the
+# values of every chain in an ipset and a dispatch chain holding a
+# jump per chain.  Packets matching none of the values cost one set
+# lookup instead of a walk through every chain, the ones that do
+# still go through the dispatch chain in order
+
+# fields in the order they are tried as a chain's selector
+SELECTOR_FIELDS = ( "dport", "sport", "dst", "src" )
+
+SET_FIELDS = { "dport": "dst_set", "sport": "src_set", "dst": "dst_set", "src": "src_set" }
+
+SET_FAMILIES = { "v4": ("", "inet"), "v6": ("-v6", "inet6") }
+
+# The (field, protocol, values) every rule in a chain matches on,
+# protocol is only given for ports.  Port ranges and networks are
+# never selectors so that the values are all single keys
+def selector(rules):
+    if (len(rules) == 0):
+        return None
+    for field in SELECTOR_FIELDS:
+        values = set()
+        protocols = set()
+        for rule in rules:
+            value = getattr(rule, field)
+            if (value is None):
+                break
+            if (field in PORT_FIELDS):
+                if (len([ port for port in value if port.find(":") > -1 ]) > 0):
+                    break
+                values.update(value)
+                protocols.add(rule.protocol)
+            elif (value.find("/") > -1):
+                break
+            else:
+                values.add(value)
+        else:
+            if (field in PORT_FIELDS):
+                if (len(protocols) == 1):
+                    return (field, protocols.pop(), tuple(sorted(values, key=int)))
+            else:
+                return (field, None, tuple(sorted(values)))
+    return None
+
+# jumps holds, for every rule of a chain, the chain the rule jumps to
+# unconditionally (or None).  The (start, end) slices returned are the
+# runs of two or more jumps that can be replaced by one dispatch
+def dispatch_runs(jumps, selectors):
+    runs = []
+    start = key = seen = None
+    for (index, chain) in enumerate(jumps + [ None ]):
+        chain_selector = selectors.get(chain)
+        if (chain_selector is not None and start is not None and chain_selector[:2] == key and seen.isdisjoint(chain_selector[2])):
+            seen.update(chain_selector[2])
+            continue
+        if (start is not None and index - start > 1):
+            runs.append((start, index))
+        start = None
+        if (chain_selector is not None):
+            (start, key, seen) = (index, chain_selector[:2], set(chain_selector[2]))
+    return runs
+
+def jump_target(rule, chains):
+    if (rule.target in chains and rule.target not in BUILTIN_CHAINS and len(rule.matches()) == 0):
+        return rule.target
+    return None
+
+def dispatch_rules(family, table, chain, target, field, protocol, values):
+    rules = []
+    if (field in PORT_FIELDS):
+        for start in range(0, len(values), MULTIPORT_MAX):
+            rules.append(Rule(family, table, chain, target = target, protocol = protocol, **{ field: values[start:start + MULTIPORT_MAX] }))
+    else:
+        for value in values:
+            rules.append(Rule(family, table, chain, target = target, **{ field: value }))
+    return rules
+
+# Rewrites the chains (an OrderedDict of chain name to Rule records)
+# of one family.  The sets the guards match against are appended to
+# sets as (name, set type, members), the names of IPv6 sets end in
+# -v6 so that both families can share the list
+def dispatch_chains(family, chains, sets, table = "filter"):
+    selectors = dict([ (chain, selector(rules)) for (chain, rules) in chains.items() if chain not in BUILTIN_CHAINS ])
+    dispatched = OrderedDict()
+    added = OrderedDict()
+    for (chain, rules) in chains.items():
+        runs = dispatch_runs([ jump_target(rule, chains) for rule in rules ], selectors)
+        rewritten = []
+        position = 0
+        for (start, end) in runs:
+            rewritten.extend(rules[position:start])
+            position = end
+            name = "pybles-dispatch-%d" % (len(added) + 1)
+            (suffix, set_family) = SET_FAMILIES[family]
+            (field, protocol, values) = selectors[rules[start].target]
+            if (field in PORT_FIELDS):
+                set_type = "bitmap:port range 0-65535"
+            else:
+                set_type = "hash:ip family %s" % set_family
+            members = []
+            added[name] = []
+            for rule in rules[start:end]:
+                chain_values = selectors[rule.target][2]
+                members.extend(chain_values)
+                added[name].extend(dispatch_rules(family, table, name, rule.target, field, protocol, chain_values))
+            sets.append((name + suffix, set_type, members))
+            rewritten.append(Rule(family, table, chain, target = name, protocol = protocol, **{ SET_FIELDS[field]: name + suffix }))
+        rewritten.extend(rules[position:])
+        dispatched[chain] = rewritten
+    dispatched.update(added)
+    return dispatched
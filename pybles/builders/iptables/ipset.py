@@ -0,0 +1,58 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import hashlib
+
+# Sets are written out for ipset restore, so any number of them (and
+# of members) are loaded with one process.  Every set is filled in a
+# temporary set which is then swapped with the live one, so the rules
+# matching the set never see it half filled, and every create and add
+# is done with -exist so loading the same sets again is not an error:
+#
+#   create pybles-web hash:ip family inet -exist
+#   create pybles-web-new hash:ip family inet -exist
+#   flush pybles-web-new
+#   add pybles-web-new 10.0.0.1 -exist
+#   swap pybles-web-new pybles-web
+#   destroy pybles-web-new
+#
+# The temporary set is flushed first in case an earlier load stopped
+# before destroying it
+
+# the kernel limits set names to 31 characters
+MAX_NAME = 31
+
+TEMPORARY_SUFFIX = "-new"
+
+def temporary_name(name):
+    if (len(name + TEMPORARY_SUFFIX) <= MAX_NAME):
+        return name + TEMPORARY_SUFFIX
+    return "pybles-%s%s" % (hashlib.sha1(name.encode("utf-8")).hexdigest()[:12], TEMPORARY_SUFFIX)
+
+# sets is a list of (name, set type, members), where the set type
+# includes any arguments such as the family
+def ipset_restore(sets):
+    lines = []
+    for (name, set_type, members) in sets:
+        temporary = temporary_name(name)
+        lines.append("create %s %s -exist" % (name, set_type))
+        lines.append("create %s %s -exist" % (temporary, set_type))
+        lines.append("flush %s" % temporary)
+        for member in members:
+            lines.append("add %s %s -exist" % (temporary, member))
+        lines.append("swap %s %s" % (temporary, name))
+        lines.append("destroy %s" % temporary)
+    return "\n".join(lines) + "\n"
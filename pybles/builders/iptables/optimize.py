@@ -0,0 +1,228 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import socket
+from itertools import combinations
+from pybles.builders.iptables.rule import FIELDS
+
+# The optimizer works on the rules of a single chain for a single
+# family, given as pybles.builders.iptables.rule.Rule records
+
+TERMINAL_TARGETS = [ "ACCEPT", "DROP", "REJECT" ]
+
+# fields that do not always match the same packets, rules using
+# them can never make a later rule unreachable
+STATEFUL_FIELDS = [ "limit" ]
+
+# multiport accepts at most 15 ports, where a range counts as two
+MULTIPORT_MAX = 15
+
+PORT_FIELDS = [ "dport", "sport" ]
+
+ADDRESS_FIELDS = [ "src", "dst" ]
+
+class OptimizeReport():
+    def __init__(self):
+        self.rules = 0
+        self.duplicates = 0
+        self.unreachable = 0
+        self.multiport = 0
+        self.aggregated = 0
+
+    def saved(self):
+        return self.duplicates + self.unreachable + self.multiport + self.aggregated
+
+    def __str__(self):
+        return "%d rules reduced to %d: %d duplicate, %d unreachable, %d merged into multiport matches, %d merged by address aggregation" % (self.rules, self.rules - self.saved(), self.duplicates, self.unreachable, self.multiport, self.aggregated)
+
+def rule_target(rule):
+    return rule.target
+
+def rule_matches(rule):
+    return rule.matches()
+
+def remove_unreachable(rules, report):
+    # A rule is unreachable when an earlier terminating rule matches
+    # every packet it does, which is the case when the earlier rule's
+    # matches are a subset of its own.  Every subset of a rule's
+    # matches is looked up in the set of terminating matches seen so
+    # far, which keeps this linear in the number of rules
+    terminating = {}
+    kept = []
+    for rule in rules:
+        matches = rule_matches(rule)
+        shadowed = False
+        for size in range(len(matches) + 1):
+            for subset in combinations(sorted(matches), size):
+                target = terminating.get(frozenset(subset))
+                if (target is not None):
+                    shadowed = True
+                    if (size == len(matches) and target == rule_target(rule)):
+                        report.duplicates += 1
+                    else:
+                        report.unreachable += 1
+                    break
+            if (shadowed):
+                break
+
+        if (shadowed):
+            continue
+
+        kept.append(rule)
+        if (stateless_terminal(rule)):
+            terminating[matches] = rule_target(rule)
+    return kept
+
+def stateless_terminal(rule):
+    return rule_target(rule) in TERMINAL_TARGETS and len([ field for field in STATEFUL_FIELDS if getattr(rule, field) is not None ]) == 0
+
+def differing_field(rule, other):
+    # the only field two rules disagree on, where it is set in both
+    fields = [ field for (field, a, b) in zip(FIELDS, rule.key(), other.key()) if a != b ]
+    if (len(fields) != 1 or getattr(rule, fields[0]) is None or getattr(other, fields[0]) is None):
+        return None
+    return fields[0]
+
+def runs(rules, fields):
+    # Group consecutive rules that only differ on one of fields.
+    # Only stateless rules with a terminating target are grouped, so
+    # merging them can not change how many times a packet is logged,
+    # jumps to a chain or counts against a rate limit
+    run = []
+    name = None
+    for rule in rules:
+        if (len(run) > 0 and stateless_terminal(rule) and stateless_terminal(run[-1])):
+            differs = differing_field(run[-1], rule)
+            if (differs in fields and (name is None or differs == name)):
+                name = differs
+                run.append(rule)
+                continue
+        if (len(run) > 0):
+            yield (name, run)
+        run = [ rule ]
+        name = None
+    if (len(run) > 0):
+        yield (name, run)
+
+def port_count(port):
+    return 2 if port.find(":") > -1 else 1
+
+def merge_ports(rules, report):
+    merged = []
+    for (name, run) in runs(rules, PORT_FIELDS):
+        if (name is None):
+            merged.extend(run)
+            continue
+
+        batch = []
+        count = 0
+        for rule in run + [ None ]:
+            ports = ()
+            if (rule is not None):
+                ports = getattr(rule, name)
+            size = sum([ port_count(port) for port in ports ])
+            if (rule is None or count + size > MULTIPORT_MAX):
+                if (len(batch) == 1):
+                    merged.append(batch[0])
+                elif (len(batch) > 1):
+                    merged.append(batch[0].replace(**{ name: sum([ getattr(r, name) for r in batch ], ()) }))
+                    report.multiport += len(batch) - 1
+                (batch, count) = ([], 0)
+            if (rule is not None):
+                batch.append(rule)
+                count += size
+    return merged
+
+def parse_network(address):
+    (host, prefix) = (address, None)
+    if (address.find("/") > -1):
+        (host, prefix) = address.split("/", 1)
+    family = socket.AF_INET6 if host.find(":") > -1 else socket.AF_INET
+    bits = 128 if family == socket.AF_INET6 else 32
+    try:
+        packed = bytearray(socket.inet_pton(family, host))
+        prefix = bits if prefix is None else int(prefix)
+    except (socket.error, ValueError):
+        return None
+    if (prefix < 0 or prefix > bits):
+        return None
+
+    value = 0
+    for octet in packed:
+        value = (value << 8) | octet
+    mask = ((1 << bits) - 1) ^ ((1 << (bits - prefix)) - 1)
+    return (family, bits, value & mask, prefix)
+
+def format_network(family, bits, value, prefix):
+    octets = bytearray([ (value >> shift) & 0xff for shift in range(bits - 8, -8, -8) ])
+    address = socket.inet_ntop(family, bytes(octets))
+    if (prefix == bits):
+        return address
+    return "%s/%d" % (address, prefix)
+
+def aggregate(networks):
+    (family, bits) = networks[0][0:2]
+    networks = sorted(set([ (value, prefix) for (f, b, value, prefix) in networks ]))
+
+    # drop networks contained in the one before them
+    covered = []
+    for (value, prefix) in networks:
+        if (len(covered) > 0):
+            (last, last_prefix) = covered[-1]
+            if (last_prefix <= prefix and (value >> (bits - last_prefix)) == (last >> (bits - last_prefix))):
+                continue
+        covered.append((value, prefix))
+
+    # then keep joining sibling networks into their parent
+    stack = []
+    for network in covered:
+        stack.append(network)
+        while (len(stack) > 1):
+            (value, prefix) = stack[-1]
+            (previous, previous_prefix) = stack[-2]
+            size = 1 << (bits - prefix)
+            if (prefix == previous_prefix and prefix > 0 and previous + size == value and (previous & ((size << 1) - 1)) == 0):
+                stack[-2:] = [ (previous, prefix - 1) ]
+            else:
+                break
+    return [ format_network(family, bits, value, prefix) for (value, prefix) in stack ]
+
+def aggregate_addresses(rules, report):
+    merged = []
+    for (name, run) in runs(rules, ADDRESS_FIELDS):
+        if (name is None):
+            merged.extend(run)
+            continue
+
+        networks = [ parse_network(getattr(rule, name)) for rule in run ]
+        if (None in networks or len(set([ network[0] for network in networks ])) > 1):
+            merged.extend(run)
+            continue
+
+        addresses = aggregate(networks)
+        if (len(addresses) < len(run)):
+            report.aggregated += len(run) - len(addresses)
+            merged.extend([ run[0].replace(**{ name: address }) for address in addresses ])
+        else:
+            merged.extend(run)
+    return merged
+
+def optimize_chain(rules, report):
+    report.rules += len(rules)
+    rules = remove_unreachable(rules, report)
+    rules = aggregate_addresses(rules, report)
+    rules = merge_ports(rules, report)
+    return rules
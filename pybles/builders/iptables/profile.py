@@ -0,0 +1,99 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import shlex
+from pybles.builders.iptables.optimize import rule_target, stateless_terminal
+
+# iptables-save writes some options differently from how
+# they were given on the command line
+OPTION_ALIASES = { "--log-prefix": "--prefix" }
+
+HOST_PREFIX = { "v4": "/32", "v6": "/128" }
+
+# Rules read back from the kernel put their options in a different
+# order and spell addresses out in full, so rules are compared by an
+# order independent set of their options
+def canonical(family, spec):
+    groups = []
+    for token in shlex.split(spec):
+        if (token.startswith("-") and not token[1:].isdigit()) or token == "!" or len(groups) == 0:
+            if (len(groups) > 0 and groups[-1] == ("!",)):
+                groups[-1] = ("!", OPTION_ALIASES.get(token, token))
+            else:
+                groups.append((OPTION_ALIASES.get(token, token),))
+        else:
+            groups[-1] = groups[-1] + (token,)
+
+    key = []
+    for group in groups:
+        if (group[-2:-1] in [ ("-s",), ("-d",) ] and group[-1].find("/") == -1):
+            group = group[:-1] + (group[-1] + HOST_PREFIX[family],)
+        key.append(group)
+    return frozenset(key)
+
+class Counters():
+    def __init__(self):
+        self.packets = {}
+
+    def add(self, family, chain, spec, packets):
+        key = (family, chain, canonical(family, spec))
+        self.packets[key] = self.packets.get(key, 0) + packets
+
+    def get(self, family, chain, spec):
+        return self.packets.get((family, chain, canonical(family, spec)), 0)
+
+    # tables are the parsed iptables-save output for each
+    # family, as returned by pybles.system.parse_save
+    @classmethod
+    def from_tables(cls, tables, table="filter"):
+        counters = cls()
+        for (family, family_tables) in tables.items():
+            if (table not in family_tables):
+                continue
+            for chain in family_tables[table].chains.values():
+                for rule in chain.rules:
+                    counters.add(family, chain.name, rule.spec, rule.packets)
+        return counters
+
+    @classmethod
+    def read(cls):
+        # pybles.system pulls in subprocess, which most runs never use
+        import pybles.system as system
+        return cls.from_tables({ "v4": system.read_tables("v4"), "v6": system.read_tables("v6") })
+
+# Within a run of consecutive rules that all end in the same ACCEPT,
+# DROP or REJECT target the order of the rules can not change which
+# packets get that verdict, so each such run is sorted by how many
+# packets its rules matched.  Rules with stateful matches (rate
+# limits) are never moved
+def reorder_chain(family, chain, rules, counters):
+    reordered = []
+    run = []
+    for rule in rules + [ None ]:
+        if (rule is not None and stateless_terminal(rule) and (len(run) == 0 or rule_target(run[-1]) == rule_target(rule))):
+            run.append(rule)
+            continue
+
+        hits = [ counters.get(family, chain, r.spec()) for r in run ]
+        order = sorted(range(len(run)), key=lambda i: -hits[i])
+        reordered.extend([ run[i] for i in order ])
+        run = []
+        if (rule is not None):
+            if (stateless_terminal(rule)):
+                run.append(rule)
+            else:
+                reordered.append(rule)
+    return reordered
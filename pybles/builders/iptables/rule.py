@@ -0,0 +1,119 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pybles
+
+FAMILIES = [ ("v4", "iptables"), ("v6", "ip6tables") ]
+
+COMMANDS = dict(FAMILIES)
+
+# The fields of a rule other than where it lives, in the order
+# their arguments are written out.  Addresses come after the
+# protocol and ports, so rules read "-j ACCEPT -m tcp -p tcp
+# --dport 22 -s 1.2.3.4" where pybles used to write the addresses
+# first.  The port fields hold tuples of ports (or "low:high"
+# ranges), everything else is a string
+FIELDS = ( "target", "protocol", "sport", "dport", "src", "src_set", "dst", "dst_set", "in_interface", "out_interface", "limit", "log_prefix" )
+
+PORT_FIELDS = ( "sport", "dport" )
+
+def format_ports(option, ports):
+    if (len(ports) == 1):
+        return "--%s %s" % (option, ports[0])
+    return "-m multiport --%ss %s" % (option, ",".join(ports))
+
+FORMATS = {
+    "target": lambda value: "-j %s" % value,
+    "protocol": lambda value: "-m %s -p %s" % (value, value),
+    "sport": lambda value: format_ports("sport", value),
+    "dport": lambda value: format_ports("dport", value),
+    "src": lambda value: "-s %s" % value,
+    "src_set": lambda value: "-m set --match-set %s src" % value,
+    "dst": lambda value: "-d %s" % value,
+    "dst_set": lambda value: "-m set --match-set %s dst" % value,
+    "in_interface": lambda value: "-i %s" % value,
+    "out_interface": lambda value: "-o %s" % value,
+    "limit": lambda value: "-m limit --limit %s" % value,
+    "log_prefix": lambda value: "--prefix %s" % value,
+}
+
+# A single rule for a single family.  Rules are only turned into
+# iptables arguments when they are written out, everything else
+# (comparing, optimizing, diffing) works on the fields directly
+class Rule(object):
+    __slots__ = ( "family", "table", "chain" ) + FIELDS
+
+    def __init__(self, family, table = "filter", chain = None, **fields):
+        self.family = family
+        self.table = table
+        self.chain = chain
+        for field in FIELDS:
+            setattr(self, field, fields.pop(field, None))
+        if (len(fields) > 0):
+            raise TypeError("Unknown rule fields %s" % ", ".join(sorted(fields.keys())))
+
+    def set(self, field, value):
+        current = getattr(self, field)
+        if (current is not None and current != value):
+            raise pybles.InvalidOption("Conflicting values %s and %s for %s" % (current, value, field))
+        setattr(self, field, value)
+
+    def replace(self, **fields):
+        values = dict([ (field, getattr(self, field)) for field in FIELDS ])
+        values.update(fields)
+        return Rule(self.family, self.table, self.chain, **values)
+
+    def key(self):
+        return tuple([ getattr(self, field) for field in FIELDS ])
+
+    # the (field, value) pairs a packet has to match, which
+    # is everything that is set apart from the target
+    def matches(self):
+        return frozenset([ (field, getattr(self, field)) for field in FIELDS[1:] if getattr(self, field) is not None ])
+
+    def __eq__(self, other):
+        return isinstance(other, Rule) and (self.family, self.table, self.chain) == (other.family, other.table, other.chain) and self.key() == other.key()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def __hash__(self):
+        return hash((self.family, self.chain, self.key()))
+
+    def __repr__(self):
+        return "<Rule %s %s -A %s %s>" % (self.family, self.table, self.chain, self.spec())
+
+    # the rule specification is everything but the table and the chain
+    def spec(self):
+        return " ".join([ FORMATS[field](getattr(self, field)) for field in FIELDS if getattr(self, field) is not None ])
+
+    def command(self):
+        return "%s -t %s -A %s %s" % (COMMANDS[self.family], self.table, self.chain, self.spec())
+
+    def to_dict(self):
+        data = {}
+        for field in FIELDS:
+            value = getattr(self, field)
+            if (value is not None):
+                data[field] = list(value) if field in PORT_FIELDS else value
+        return data
+
+    @classmethod
+    def from_dict(cls, family, table, chain, data):
+        fields = {}
+        for (field, value) in data.items():
+            fields[str(field)] = tuple(value) if field in PORT_FIELDS else value
+        return cls(family, table, chain, **fields)
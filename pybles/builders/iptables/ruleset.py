@@ -0,0 +1,142 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+from collections import OrderedDict
+from pybles.builders.iptables.rule import Rule, FAMILIES
+
+BUILTIN_CHAINS = [ "INPUT", "FORWARD", "OUTPUT" ]
+
+# A compiled table, for each family the chains are kept in
+# declaration order (built in chains first) along with the
+# Rule records appended to each of them
+class Ruleset():
+    def __init__(self, table="filter"):
+        self.table = table
+        self.families = {}
+        for (family, command) in FAMILIES:
+            self.families[family] = OrderedDict([ (chain, []) for chain in BUILTIN_CHAINS ])
+
+    def chains(self, family):
+        return self.families[family]
+
+    def add_chain(self, family, chain):
+        self.families[family].setdefault(chain, [])
+
+    def append(self, family, chain, rule):
+        self.families[family][chain].append(rule)
+
+    # the rule specifications ("-j ACCEPT -m tcp -p tcp --dport 22")
+    # of a chain, as they are written out
+    def specs(self, family, chain):
+        return [ rule.spec() for rule in self.families[family][chain] ]
+
+    def __eq__(self, other):
+        return isinstance(other, Ruleset) and self.to_dict() == other.to_dict()
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+    def restore(self, family):
+        lines = [ "*%s" % self.table ]
+        rules = []
+        for (chain, chain_rules) in self.families[family].items():
+            if (chain in BUILTIN_CHAINS):
+                lines.append(":%s ACCEPT [0:0]" % chain)
+            else:
+                lines.append(":%s - [0:0]" % chain)
+            for rule in chain_rules:
+                rules.append("-A %s %s" % (chain, rule.spec()))
+        return "\n".join(lines + rules + [ "COMMIT", "" ])
+
+    def to_dict(self):
+        families = {}
+        for (family, chains) in self.families.items():
+            families[family] = [ [ chain, [ rule.to_dict() for rule in rules ] ] for (chain, rules) in chains.items() ]
+        return { "table": self.table, "families": families }
+
+    @classmethod
+    def from_dict(cls, data):
+        ruleset = cls(data["table"])
+        for (family, chains) in data["families"].items():
+            for (chain, rules) in chains:
+                ruleset.add_chain(family, chain)
+                for rule in rules:
+                    ruleset.append(family, chain, Rule.from_dict(family, ruleset.table, chain, rule))
+        return ruleset
+
+    def save(self, outfile):
+        with open(outfile, "w") as f:
+            json.dump(self.to_dict(), f)
+
+    @classmethod
+    def load(cls, infile):
+        with open(infile) as f:
+            return cls.from_dict(json.load(f))
+
+def diff_chain(prefix, chain, old, new):
+    import difflib
+    commands = []
+    matcher = difflib.SequenceMatcher(None, old, new, autojunk=False)
+    for (tag, i1, i2, j1, j2) in matcher.get_opcodes():
+        if (tag == "equal"):
+            continue
+
+        # rules before this point already match the new chain, so
+        # the live chain is new[:j1] followed by old[i1:] and the
+        # rule to delete is always at position j1 + 1
+        for rule in old[i1:i2]:
+            commands.append("%s -D %s %d" % (prefix, chain, j1 + 1))
+
+        for (offset, rule) in enumerate(new[j1:j2]):
+            if (i2 == len(old)):
+                commands.append("%s -A %s %s" % (prefix, chain, rule.spec()))
+            else:
+                commands.append("%s -I %s %d %s" % (prefix, chain, j1 + offset + 1, rule.spec()))
+    return commands
+
+# Commands emptying the table of every family, for when what is
+# loaded is not known.  diff from an empty Ruleset then rebuilds it
+def reset(table="filter"):
+    commands = []
+    for (family, command) in FAMILIES:
+        commands.append("%s -t %s -F" % (command, table))
+        commands.append("%s -t %s -X" % (command, table))
+    return commands
+
+# Returns the commands that turn the old ruleset into the new one.
+# New chains are created first so that rules may jump to them, and
+# chains that are no longer used are removed last once every jump
+# to them has been deleted
+def diff(old, new):
+    commands = []
+    for (family, command) in FAMILIES:
+        prefix = "%s -t %s" % (command, new.table)
+        old_chains = old.chains(family)
+        new_chains = new.chains(family)
+
+        for chain in new_chains:
+            if (chain not in old_chains):
+                commands.append("%s -N %s" % (prefix, chain))
+
+        for (chain, rules) in new_chains.items():
+            commands.extend(diff_chain(prefix, chain, old_chains.get(chain, []), rules))
+
+        for chain in old_chains:
+            if (chain not in new_chains):
+                commands.append("%s -F %s" % (prefix, chain))
+                commands.append("%s -X %s" % (prefix, chain))
+    return commands
@@ -0,0 +1,219 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import pybles
+from collections import OrderedDict
+from pybles.builders.iptables import FilterBuilder as IPTablesFilterBuilder, ChainDeclaration, AddressSet
+from pybles.builders.iptables.ruleset import BUILTIN_CHAINS
+from pybles.builders.iptables.optimize import PORT_FIELDS
+from pybles.builders.iptables.dispatch import selector, dispatch_runs, jump_target
+
+# The options in a config are checked and turned into rules by the
+# iptables FilterBuilder, this builder only writes those rules out as
+# a single nft script.  Everything goes in one inet table, so a rule
+# that is the same for IPv4 and IPv6 is written once
+
+TABLE = "pybles"
+
+# the address sets the iptables builder matches the
+# system addresses with and the named sets they become
+SELF_SETS = { "iptables-self": ("self_v4", "ipv4_addr"), "iptables-self-v6": ("self_v6", "ipv6_addr") }
+
+# the address match for each family
+FAMILY_MATCH = { "v4": "ip", "v6": "ip6" }
+
+VERDICTS = { "ACCEPT": "accept", "DROP": "drop", "REJECT": "reject", "LOG": "log" }
+
+RATE_UNITS = { "sec": "second", "min": "minute", "hour": "hour", "day": "day" }
+
+def format_port(port):
+    if (port.startswith(":")):
+        return "0-%s" % port[1:]
+    if (port.endswith(":")):
+        return "%s-65535" % port[:-1]
+    return port.replace(":", "-")
+
+# a single value or an anonymous set of them
+def format_values(values):
+    if (len(values) == 1):
+        return values[0]
+    return "{ %s }" % ", ".join(values)
+
+def format_limit(limit):
+    (rate, unit) = (limit.split("/") + [ "sec" ])[:2]
+    return "limit rate %s/%s" % (rate, RATE_UNITS[unit])
+
+def format_prefix(prefix):
+    if (prefix.startswith("\"")):
+        return "log prefix %s" % prefix
+    return "log prefix \"%s\"" % prefix
+
+class FilterBuilder(IPTablesFilterBuilder):
+    # with dispatch, runs of jumps to chains selected by distinct ports
+    # become a single verdict map, see pybles.builders.iptables.dispatch
+    def __init__(self, interfaces = [], ips = [], groups = {}, dispatch = False):
+        IPTablesFilterBuilder.__init__(self, interfaces = interfaces, ips = ips, output = "restore", groups = groups)
+        self.dispatch = dispatch
+        self.set_members = {}
+
+    # the address sets are written into the rules that use them
+    # rather than being created with ipset
+    def flush_directives(self):
+        for directive in self.directives:
+            if (isinstance(directive, AddressSet)):
+                self.set_members[directive.name] = directive.members
+        self.currentDirective = None
+        self.directives = []
+        return []
+
+    def address_match(self, rule, field):
+        match = FAMILY_MATCH[rule.family]
+        direction = field[0] + "addr"
+        if (getattr(rule, field) is not None):
+            return "%s %s %s" % (match, direction, getattr(rule, field))
+        name = getattr(rule, "%s_set" % field)
+        if (name is None):
+            return None
+        if (name in SELF_SETS):
+            return "%s %s @%s" % (match, direction, SELF_SETS[name][0])
+        return "%s %s %s" % (match, direction, format_values(self.set_members[name]))
+
+    def format_rule(self, rule):
+        statements = []
+        if (rule.in_interface is not None):
+            statements.append("iifname \"%s\"" % rule.in_interface)
+        if (rule.out_interface is not None):
+            statements.append("oifname \"%s\"" % rule.out_interface)
+        for field in [ "src", "dst" ]:
+            match = self.address_match(rule, field)
+            if (match is not None):
+                statements.append(match)
+        if (rule.protocol is not None):
+            if (rule.sport is None and rule.dport is None):
+                statements.append("meta l4proto %s" % rule.protocol)
+            for (field, name) in [ ("sport", "sport"), ("dport", "dport") ]:
+                if (getattr(rule, field) is not None):
+                    statements.append("%s %s %s" % (rule.protocol, name, format_values([ format_port(port) for port in getattr(rule, field) ])))
+        if (rule.limit is not None):
+            statements.append(format_limit(rule.limit))
+        if (rule.log_prefix is not None):
+            statements.append(format_prefix(rule.log_prefix))
+        elif (rule.target in VERDICTS):
+            statements.append(VERDICTS[rule.target])
+        else:
+            statements.append("jump %s" % rule.target)
+        return " ".join(statements)
+
+    # The rules of a directive, which is one rule when it applies to
+    # both families the same way.  Otherwise the rule for each family
+    # it applies to matches addresses, which limits it to that family
+    def format_directive(self, directive):
+        if (directive.v4.key() == directive.v6.key()):
+            return [ self.format_rule(directive.v4) ]
+        return [ self.format_rule(directive.rule(family)) for family in directive.families() ]
+
+    def chain_directives(self):
+        chains = OrderedDict([ (chain, []) for chain in BUILTIN_CHAINS ])
+        for directive in self.rules:
+            if (isinstance(directive, ChainDeclaration)):
+                chains.setdefault(directive.name, [])
+            else:
+                chains[directive.v4.chain].append(directive)
+        return chains
+
+    # Only ports are used to dispatch on, since a chain selected by
+    # addresses is selected by different ones for each family and a
+    # verdict map only looks up one of them
+    def chain_selectors(self, chains):
+        selectors = {}
+        for (chain, directives) in chains.items():
+            if (chain in BUILTIN_CHAINS):
+                continue
+            v4 = selector([ directive.v4 for directive in directives ])
+            if (v4 is not None and v4[0] in PORT_FIELDS and v4 == selector([ directive.v6 for directive in directives ])):
+                selectors[chain] = v4
+        return selectors
+
+    def jump_target(self, directive, chains):
+        if (directive.v4.key() != directive.v6.key()):
+            return None
+        return jump_target(directive.v4, chains)
+
+    def format_vmap(self, chains, selectors):
+        (field, protocol, values) = selectors[chains[0]]
+        verdicts = [ "%s : jump %s" % (value, chain) for chain in chains for value in selectors[chain][2] ]
+        return "%s %s vmap { %s }" % (protocol, field, ", ".join(verdicts))
+
+    def chain_rules(self):
+        chains = self.chain_directives()
+        selectors = {}
+        if (self.dispatch):
+            selectors = self.chain_selectors(chains)
+        rules = OrderedDict()
+        for (chain, directives) in chains.items():
+            rules[chain] = []
+            position = 0
+            for (start, end) in dispatch_runs([ self.jump_target(directive, chains) for directive in directives ], selectors):
+                for directive in directives[position:start]:
+                    rules[chain].extend(self.format_directive(directive))
+                rules[chain].append(self.format_vmap([ directive.v4.target for directive in directives[start:end] ], selectors))
+                position = end
+            for directive in directives[position:]:
+                rules[chain].extend(self.format_directive(directive))
+        return rules
+
+    # The whole table, adding then deleting it first so that loading
+    # the script with nft -f replaces any earlier version in one go
+    def script(self):
+        lines = [ "table inet %s" % TABLE, "delete table inet %s" % TABLE, "table inet %s {" % TABLE ]
+        if (len(self.ips) > 0):
+            for (name, members) in [ ("iptables-self", [ ip for ip in self.ips if ip.ipv4 ]), ("iptables-self-v6", [ ip for ip in self.ips if not ip.ipv4 ]) ]:
+                (set_name, set_type) = SELF_SETS[name]
+                lines.append("\tset %s {" % set_name)
+                lines.append("\t\ttype %s" % set_type)
+                if (len(members) > 0):
+                    lines.append("\t\telements = { %s }" % ", ".join([ str(ip) for ip in members ]))
+                lines.append("\t}")
+        for (chain, rules) in self.chain_rules().items():
+            if (chain in BUILTIN_CHAINS):
+                lines.append("\tchain %s {" % chain.lower())
+                lines.append("\t\ttype filter hook %s priority 0; policy accept;" % chain.lower())
+            else:
+                lines.append("\tchain %s {" % chain)
+            for rule in rules:
+                lines.append("\t\t%s" % rule)
+            lines.append("\t}")
+        lines.append("}")
+        return "\n".join(lines) + "\n"
+
+class Builder(pybles.DefaultBuilder):
+    HANDLERS = ( "filter", )
+
+    # the parser returns nothing for an nftables config, the rules
+    # are all written out together by script().  dispatch turns runs
+    # of jumps to chains selected by distinct ports into verdict maps
+    def __init__(self, ips=[], interfaces=[], groups={}, dispatch=False):
+        self.filter_builder = FilterBuilder(ips=ips, interfaces=interfaces, groups=groups, dispatch=dispatch)
+
+    def filter(self, *args):
+        return self.filter_builder
+
+    def attach_stats(self, stats):
+        self.parse_stats = stats
+        self.filter_builder.attach_stats(stats)
+
+    def script(self):
+        return self.filter_builder.script()
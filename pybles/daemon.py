@@ -0,0 +1,317 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import json
+import time
+import shlex
+import select
+import socket
+import argparse
+import subprocess
+import pybles
+import pybles.system as system
+import pybles.builders.iptables as iptables
+from pybles import include
+from pybles.builders.iptables.ruleset import Ruleset, diff, reset
+
+# A long running compiler.  The config and everything it includes is
+# watched, and whenever a file changes the config is compiled again
+# and only the difference to the rules already applied is run.  Files
+# are parsed through an include.EventCache, so only changed files are
+# read again; the builder is fed from the cached events.
+#
+# Requests can also be made over a Unix socket, one JSON object per
+# line such as {"command": "apply"}, each answered by a JSON line:
+#
+#   status   what is being watched and how the last compile went
+#   compile  compile and return the commands that apply would run
+#   apply    compile and run the commands
+#
+# Every answer has "ok", failed requests have an "error" as well.
+#
+# The address sets are loaded by a single ipset restore of the
+# payload from pybles.builders.iptables.ipset, which can be run again
+# safely.  It is only run when it changed since the last apply, and
+# is kept in the state file along with the rules.  When what is
+# loaded is not known, because there is no state from an earlier run
+# or an apply failed part way, the next apply empties the filter
+# table first rather than diffing against rules that may not be there
+
+IPSET_RESTORE = "ipset restore"
+
+# inputs maps commands to what is written to their stdin
+def run_commands(commands, inputs={}):
+    for command in commands:
+        if (command in inputs):
+            process = subprocess.Popen(shlex.split(command), stdin=subprocess.PIPE)
+            process.communicate(inputs[command].encode("utf-8"))
+            if (process.returncode != 0):
+                raise subprocess.CalledProcessError(process.returncode, command)
+        else:
+            subprocess.check_call(shlex.split(command))
+
+def print_commands(commands, inputs={}):
+    for command in commands:
+        if (command in inputs):
+            sys.stdout.write("%s <<EOF\n%sEOF\n" % (command, inputs[command]))
+        else:
+            sys.stdout.write("%s\n" % command)
+
+def log(message):
+    sys.stderr.write("pybles: %s\n" % message)
+
+class Daemon():
+    # runner is called with the list of commands to apply and the
+    # inputs of the commands that read their stdin, state is
+    # the file the applied Ruleset is kept in between runs and logger
+    # is called with a message for every check that applied rules
+    def __init__(self, config, socket_path=None, state=None, interval=1.0, runner=run_commands, ips=[], interfaces=[], groups={}, optimize=False, logger=log):
+        self.config = os.path.abspath(config)
+        self.socket_path = socket_path
+        self.state = state
+        self.interval = interval
+        self.runner = runner
+        self.logger = logger
+        self.builder_options = { "ips": ips, "interfaces": interfaces, "groups": groups, "optimize": optimize }
+        self.cache = include.EventCache()
+        self.parser = pybles.PybleParser(engine="fast", event_cache=self.cache)
+        # the Ruleset and ipset payload last applied, the Ruleset is
+        # None when what is loaded is not known
+        self.applied = None
+        self.ipsets = None
+        if (state is not None and os.path.exists(state)):
+            self.load_state()
+        self.compiles = 0
+        self.compile_seconds = None
+        self.last_error = None
+        self.listener = None
+        self.clients = {}
+        self.running = False
+
+    def compile(self):
+        start = time.time()
+        builder = iptables.Builder(output="restore", ipsets="restore", **self.builder_options)
+        self.parser.builder = builder
+        self.cache.restart()
+        (path, events, error) = self.cache.parse_events(self.config, fragment=False)
+        if (error is not None):
+            raise pybles.ParseError("%s: %s" % (path, error))
+        self.parser.reset(self.config)
+        self.parser.replay(events)
+        ruleset = builder.ruleset()
+        ipsets = builder.ipset_payload()
+        self.cache.prune()
+        self.compiles += 1
+        self.compile_seconds = time.time() - start
+        return (ipsets, ruleset)
+
+    # the commands that bring the applied rules up to date, and the
+    # inputs of those that read their stdin
+    def pending(self):
+        (ipsets, ruleset) = self.compile()
+        commands = []
+        inputs = {}
+        if (ipsets is not None and ipsets != self.ipsets):
+            commands.append(IPSET_RESTORE)
+            inputs[IPSET_RESTORE] = ipsets
+        if (self.applied is None):
+            commands.extend(reset(ruleset.table))
+            commands.extend(diff(Ruleset(ruleset.table), ruleset))
+        else:
+            commands.extend(diff(self.applied, ruleset))
+        return (commands, inputs, ipsets, ruleset)
+
+    def apply(self):
+        (commands, inputs, ipsets, ruleset) = self.pending()
+        try:
+            self.runner(commands, inputs)
+        except BaseException:
+            self.applied = None
+            self.ipsets = None
+            raise
+        self.applied = ruleset
+        self.ipsets = ipsets
+        if (self.state is not None):
+            self.save_state()
+        return (commands, inputs)
+
+    # the state is the applied Ruleset's dict with the ipset payload
+    # added, so it can still be read with Ruleset.load
+    def save_state(self):
+        data = self.applied.to_dict()
+        data["ipsets"] = self.ipsets
+        with open(self.state, "w") as f:
+            json.dump(data, f)
+
+    def load_state(self):
+        with open(self.state) as f:
+            data = json.load(f)
+        self.applied = Ruleset.from_dict(data)
+        self.ipsets = data.get("ipsets")
+
+    def status(self):
+        return {
+            "config": self.config,
+            "files": sorted(self.cache.files.keys()),
+            "compiles": self.compiles,
+            "compile_seconds": self.compile_seconds,
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+            "last_error": self.last_error,
+        }
+
+    def handle(self, request):
+        command = request.get("command")
+        try:
+            if (command == "status"):
+                return { "ok": True, "status": self.status() }
+            elif (command == "compile"):
+                (commands, inputs) = self.pending()[:2]
+                return { "ok": True, "commands": commands, "inputs": inputs }
+            elif (command == "apply"):
+                (commands, inputs) = self.apply()
+                self.last_error = None
+                return { "ok": True, "commands": commands, "inputs": inputs }
+            return { "ok": False, "error": "Unknown command %s" % command }
+        except (KeyboardInterrupt, SystemExit):
+            raise
+        except BaseException as ex:
+            self.last_error = "%s: %s" % (ex.__class__.__name__, ex)
+            return { "ok": False, "error": self.last_error }
+
+    # applies the config when it has not been applied yet or
+    # any of the files it was compiled from has changed since
+    def check(self):
+        changed = self.cache.changed()
+        if (self.compiles > 0 and len(changed) == 0 and self.applied is not None):
+            return None
+        response = self.handle({ "command": "apply" })
+        if (response["ok"]):
+            self.logger("applied %d commands for %s" % (len(response["commands"]), ", ".join(changed) or self.config))
+        else:
+            self.logger("not applied: %s" % response["error"])
+        return response
+
+    def listen(self):
+        if (os.path.exists(self.socket_path)):
+            os.unlink(self.socket_path)
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(self.socket_path)
+        self.listener.listen(5)
+
+    def read_client(self, client):
+        data = client.recv(65536)
+        if (not data):
+            client.close()
+            del self.clients[client]
+            return
+
+        buffered = self.clients[client] + data
+        while (buffered.find(b"\n") > -1):
+            (line, buffered) = buffered.split(b"\n", 1)
+            try:
+                response = self.handle(json.loads(line.decode("utf-8")))
+            except ValueError:
+                response = { "ok": False, "error": "Requests must be JSON objects" }
+            client.sendall((json.dumps(response) + "\n").encode("utf-8"))
+        self.clients[client] = buffered
+
+    def serve(self):
+        if (self.socket_path is not None and self.listener is None):
+            self.listen()
+        self.running = True
+        next_check = 0
+        while (self.running):
+            sockets = list(self.clients.keys())
+            if (self.listener is not None):
+                sockets.append(self.listener)
+            (readable, writable, errors) = select.select(sockets, [], [], max(next_check - time.time(), 0))
+            for sock in readable:
+                if (sock is self.listener):
+                    (client, address) = self.listener.accept()
+                    self.clients[client] = b""
+                else:
+                    self.read_client(sock)
+            if (time.time() >= next_check):
+                self.check()
+                next_check = time.time() + self.interval
+
+    def stop(self):
+        self.running = False
+
+    def close(self):
+        for client in list(self.clients.keys()):
+            client.close()
+        self.clients = {}
+        if (self.listener is not None):
+            self.listener.close()
+            self.listener = None
+            os.unlink(self.socket_path)
+
+def request(socket_path, command):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall((json.dumps({ "command": command }) + "\n").encode("utf-8"))
+        response = b""
+        while (response.find(b"\n") == -1):
+            data = client.recv(65536)
+            if (not data):
+                break
+            response += data
+        return json.loads(response.decode("utf-8"))
+    finally:
+        client.close()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compile a pybles config whenever it changes and apply the difference")
+    parser.add_argument("config")
+    parser.add_argument("--socket", help="Unix socket to answer requests on")
+    parser.add_argument("--state", help="file the applied rules are kept in")
+    parser.add_argument("--interval", type=float, default=1.0, help="seconds between checks for changed files")
+    parser.add_argument("--optimize", action="store_true")
+    parser.add_argument("--dry-run", action="store_true", help="print the commands rather than running them")
+    parser.add_argument("--request", choices=[ "status", "compile", "apply" ], help="send a request to a running daemon on --socket")
+    args = parser.parse_args(argv)
+
+    if (args.request):
+        response = request(args.socket, args.request)
+        sys.stdout.write("%s\n" % json.dumps(response, indent=2))
+        return 0 if response.get("ok") else 1
+
+    interfaces = []
+    ips = []
+    for interface in system.interfaces().values():
+        interfaces.append(interface.name)
+        ips.extend(interface.addresses)
+
+    runner = run_commands
+    if (args.dry_run):
+        runner = print_commands
+
+    daemon = Daemon(args.config, socket_path=args.socket, state=args.state, interval=args.interval, runner=runner, ips=ips, interfaces=interfaces, optimize=args.optimize)
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
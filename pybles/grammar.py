@@ -0,0 +1,136 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import threading
+import pyparsing
+from pyparsing import OneOrMore, Word, Literal, Keyword, alphanums, ParseException, ZeroOrMore, Forward, Suppress, Group, dblQuotedString
+from pybles.scanner import WORD
+
+# Importing pyparsing and building the grammar are most of the time
+# a short run of pybles spends before it parses anything, so this
+# module is only imported by PybleParser the first time the pyparsing
+# engine is used and the grammar is built once for every parser
+
+# redefine this function since it makes debugging
+# exceptions impossible
+def pyble_trim_arity(func, maxargs=2):
+    def wrapper(*args):
+        return func(*args)
+    return wrapper
+pyparsing._trim_arity = pyble_trim_arity
+if (hasattr(pyparsing, "core")):
+    # pyparsing 3 looks the function up in its core module
+    pyparsing.core._trim_arity = pyble_trim_arity
+
+# pyparsing 3 renamed the methods used here and warns about the old
+# names, which are the only ones pyparsing 2 has
+SNAKE_CASE = hasattr(pyparsing.ParserElement, "set_name")
+
+def named(expr, name):
+    if (SNAKE_CASE):
+        return expr.set_name(name)
+    return expr.setName(name)
+
+def on_parse(expr, action):
+    if (SNAKE_CASE):
+        expr.set_parse_action(action)
+    else:
+        expr.setParseAction(action)
+
+# actions is anything with the block_start, block_end,
+# parse_directive and parse_include parse actions
+def build(actions):
+    # tokens are named the way pyparsing 2 describes them so error
+    # messages are the same whatever version of pyparsing is installed
+    pyble_name  = named(Word(alphanums + "-"), WORD)
+
+    option_value   = (named(Word(alphanums + ":-/,_."), WORD) | dblQuotedString)
+    option         = Group(pyble_name("name") + option_value("value"))
+    options        = ZeroOrMore(option)("options")
+    directive_name = pyble_name("directive_name")
+    directive      = directive_name + options + named(Literal(";"), '";"')
+
+    include_file   = Suppress(Keyword("include")) + dblQuotedString("include") + named(Suppress(";"), '";"')
+
+    block_start    = pyble_name("block_start") + named(Suppress("{"), '"{"')
+    block_end      = named(Suppress("}"), '"}"')("block_end")
+    block          = Forward()
+    block          << block_start + ZeroOrMore(block | include_file | directive) + block_end
+
+    on_parse(directive, actions.parse_directive)
+    on_parse(include_file, actions.parse_include)
+    on_parse(block_start, actions.block_start)
+    on_parse(block_end, actions.block_end)
+
+    # includes at the top level are tied to the blocks around them
+    # rather than being an alternative to a block, so that errors
+    # are still reported against the block that failed.  Tabs are
+    # left alone, as the scanner does, so error locations are the
+    # same and quoted values keep their tabs
+    grammar = ZeroOrMore(include_file) + OneOrMore(block + ZeroOrMore(include_file))
+    if (SNAKE_CASE):
+        return grammar.parse_with_tabs()
+    return grammar.parseWithTabs()
+
+# pyparsing 2's message for a ParseException, which the scanner's
+# messages copy and pyparsing 3 words differently
+def describe(pe):
+    found = ""
+    if (pe.pstr):
+        if (pe.loc >= len(pe.pstr)):
+            found = ", found end of text"
+        else:
+            found = (", found %r" % pe.pstr[pe.loc:pe.loc + 1]).replace(r"\\", "\\")
+    return "%s%s  (at char %d), (line:%d, col:%d)" % (pe.msg, found, pe.loc, pe.lineno, pe.col)
+
+def parse_string(grammar, config):
+    if (SNAKE_CASE):
+        return grammar.parse_string(config, parse_all=True)
+    return grammar.parseString(config, parseAll=True)
+
+def parse_file(grammar, infile):
+    if (SNAKE_CASE):
+        return grammar.parse_file(infile, parse_all=True)
+    return grammar.parseFile(infile, parseAll=True)
+
+# The shared grammar hands its parse actions to whichever parser is
+# running on the current thread, parsers push themselves for the
+# length of a parse
+class Dispatch(threading.local):
+    def __init__(self):
+        self.parsers = []
+
+    def push(self, parser):
+        self.parsers.append(parser)
+
+    def pop(self):
+        self.parsers.pop()
+
+    def block_start(self, string, location, tokens):
+        return self.parsers[-1].block_start(string, location, tokens)
+
+    def block_end(self, string, location, tokens):
+        return self.parsers[-1].block_end(string, location, tokens)
+
+    def parse_directive(self, string, location, tokens):
+        return self.parsers[-1].parse_directive(string, location, tokens)
+
+    def parse_include(self, string, location, tokens):
+        return self.parsers[-1].parse_include(string, location, tokens)
+
+dispatch = Dispatch()
+
+GRAMMAR = build(dispatch)
@@ -0,0 +1,160 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import re
+import glob
+from pybles import scanner
+
+# Included files are tokenized in worker processes.  Building can not
+# happen there since what an included file means depends on the block
+# it was included from, so each file is turned into a list of events
+# that PybleParser replays through its callbacks in include order:
+#
+#   ("start", name)               a block was opened
+#   ("end",)                      the innermost block was closed
+#   ("directive", name, options)  options is a list of (name, value)
+#   ("include", pattern)          a nested include, resolved on replay
+
+MAGIC = re.compile(r"[*?[]")
+
+INCLUDE = re.compile(r"""(?:^|[\s;{}])include\s+(%s)\s*;""" % scanner.QUOTED.pattern)
+
+class Recorder():
+    def __init__(self):
+        self.events = []
+
+    def start_block(self, name):
+        self.events.append(("start", name))
+
+    def end_block(self):
+        self.events.append(("end",))
+
+    def build_directive(self, name, options):
+        self.events.append(("directive", name, [ (option.name, option.value) for option in options ]))
+        return None
+
+    def include(self, pattern):
+        self.events.append(("include", pattern))
+        return []
+
+def read_events(path, fragment=True):
+    recorder = Recorder()
+    with open(path) as f:
+        for result in scanner.Scanner(recorder).iter_parse([ f.read() ], fragment=fragment):
+            pass
+    return recorder.events
+
+# The pool worker, errors are returned rather than raised since
+# ScanError can not be sent back from the worker process
+def parse_events(path, fragment=True):
+    try:
+        return (path, read_events(path, fragment), None)
+    except scanner.ScanError as se:
+        return (path, None, "%s" % se)
+    except (IOError, OSError) as ex:
+        return (path, None, "%s" % ex)
+
+def stamp(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_mtime, st.st_size, st.st_ino)
+
+# Keeps the events of every file read through it until the file
+# changes, for parsers that parse the same files over and over (see
+# pybles.daemon).  The include patterns resolved through it are kept
+# as well so that files added to or removed from a glob are noticed
+class EventCache():
+    def __init__(self):
+        self.files = {}
+        self.patterns = {}
+        self.used = set()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, pattern, base):
+        paths = resolve(pattern, base)
+        self.patterns[(pattern, base)] = paths
+        return paths
+
+    def parse_events(self, path, fragment=True):
+        path = os.path.abspath(path)
+        self.used.add(path)
+        current = stamp(path)
+        cached = self.files.get(path)
+        if (cached is not None and current is not None and cached[0] == current):
+            self.hits += 1
+            return (path, cached[1], cached[2])
+
+        # errors are kept too, so that fixing the file counts as a change
+        self.misses += 1
+        (path, events, error) = parse_events(path, fragment)
+        self.files[path] = (current, events, error)
+        return (path, events, error)
+
+    # the cached files (and include patterns) that are out of date
+    def changed(self):
+        changed = [ path for (path, cached) in self.files.items() if stamp(path) != cached[0] ]
+        for ((pattern, base), paths) in self.patterns.items():
+            if (resolve(pattern, base) != paths):
+                changed.append(os.path.join(base, pattern))
+        return sorted(changed)
+
+    # Called before each parse.  The include patterns are collected
+    # again, and prune then drops the files the parse no longer read
+    def restart(self):
+        self.patterns = {}
+        self.used = set()
+
+    def prune(self):
+        for path in list(self.files.keys()):
+            if (path not in self.used):
+                del self.files[path]
+
+# Files matching the pattern, relative paths are relative to the
+# directory of the including file.  Glob matches are sorted so the
+# include order does not depend on the file system, a pattern that
+# is not a glob is returned as is so a missing file is an error
+def resolve(pattern, base):
+    pattern = os.path.join(base, pattern)
+    if (MAGIC.search(pattern) is None):
+        return [ pattern ]
+    return sorted([ path for path in glob.glob(pattern) if os.path.isfile(path) ])
+
+# Every file a config includes, directly or not, along with its
+# contents.  This only looks for include directives in the text, so
+# it is meant for things like cache keys rather than for parsing.
+# The contents are the bytes read from each file
+def included_files(config, base, seen=None):
+    if (seen is None):
+        seen = set()
+    files = []
+    for match in INCLUDE.finditer(config):
+        for path in resolve(match.group(1)[1:-1], base):
+            path = os.path.abspath(path)
+            if (path in seen):
+                continue
+            seen.add(path)
+            try:
+                with open(path, "rb") as f:
+                    contents = f.read()
+            except (IOError, OSError):
+                continue
+            files.append((path, contents))
+            files.extend(included_files(contents.decode("utf-8"), os.path.dirname(path), seen))
+    return files
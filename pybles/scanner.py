@@ -0,0 +1,244 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import re
+from collections import namedtuple
+
+try:
+    from sys import intern
+except ImportError:
+    # a builtin on python 2, where it only takes str (and configs
+    # read as unicode are left as they are)
+    def intern(string, builtin=intern):
+        if (isinstance(string, str)):
+            return builtin(string)
+        return string
+
+# These mirror the pyparsing grammar in pybles.grammar.build,
+# names are Word(alphanums + "-") and option values are either
+# Word(alphanums + ":-/,_.") or a dblQuotedString
+WHITESPACE   = re.compile(r"[ \t\r\n]*")
+NAME         = re.compile(r"[A-Za-z0-9-]+")
+QUOTED       = re.compile(r""""(?:[^"\n\r\\]|(?:"")|(?:\\(?:[^x]|x[0-9a-fA-F]+)))*\"""")
+OPTION_VALUE = re.compile(r"""[A-Za-z0-9:\-/,_.]+|%s""" % QUOTED.pattern)
+
+# pyparsing 2's description of the Word tokens, the grammar names
+# its words with this too so both engines produce the same messages
+WORD = "W:(ABCD...)"
+
+# consumed input is dropped from the scan buffer once this much of
+# it has built up, so memory stays bounded while streaming
+COMPACT_SIZE = 65536
+
+class ScanError(BaseException):
+    def __init__(self, expected, found, location, lineno, column):
+        self.expected = expected
+        self.found = found
+        self.location = location
+        self.lineno = lineno
+        self.column = column
+
+    def __str__(self):
+        return "Expected %s%s  (at char %d), (line:%d, col:%d)" % (self.expected, self.found, self.location, self.lineno, self.column)
+
+# names are interned, so the many directives and options sharing a
+# name share the one string
+Option = namedtuple("Option", "name value")
+
+class Scanner():
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+
+    def parse(self, string):
+        return list(self.iter_parse([ string ]))
+
+    # Input is read from chunks only when a token might continue past
+    # the end of the buffer, so results are produced as soon as each
+    # directive is complete
+    def read(self):
+        for chunk in self.chunks:
+            if (chunk):
+                self.string += chunk
+                return True
+        self.eof = True
+        return False
+
+    def fill(self, location):
+        while (location >= len(self.string) and not self.eof):
+            self.read()
+        return location < len(self.string)
+
+    def match(self, pattern, location):
+        while (True):
+            match = pattern.match(self.string, location)
+            if (self.eof or (match is not None and match.end() < len(self.string))):
+                return match
+            self.read()
+
+    def advance(self, location):
+        newline = self.string.rfind("\n", self.line_pos, location)
+        if (newline > -1):
+            self.lineno += self.string.count("\n", self.line_pos, newline + 1)
+            self.line_start = self.offset + newline + 1
+        self.line_pos = location
+
+    def discard(self, location):
+        self.advance(location)
+        self.string = self.string[location:]
+        self.offset += location
+        self.line_pos = 0
+
+    # the line and column the token being handed to the callbacks
+    # starts at, for callbacks that keep track of where things are
+    def token_position(self):
+        self.advance(self.token)
+        return (self.lineno, self.offset + self.token - self.line_start + 1)
+
+    def position(self, location):
+        self.advance(location)
+        absolute = self.offset + location
+        if (self.fill(location)):
+            found = ", found %r" % self.string[location]
+        elif (absolute == 0):
+            found = ""
+        else:
+            found = ", found end of text"
+        return (found, absolute, self.lineno, absolute - self.line_start + 1)
+
+    # pyparsing backtracks out of a failed block until it reaches a
+    # repetition that can stop cleanly, so it reports errors at the
+    # start of the failing element rather than where the error really
+    # is.  Errors are reported the same way here so that both engines
+    # produce the same messages
+    def error(self, expected, location):
+        if (self.completed > 0):
+            (expected, position) = ("end of text", self.item)
+        elif (self.depth > 0):
+            (expected, position) = ('"}"', self.child)
+        else:
+            position = self.position(location)
+        return ScanError(expected, *position)
+
+    # A fragment is the contents of an included file, which may hold
+    # directives (and nothing at all) outside of any block
+    def iter_parse(self, chunks, fragment=False):
+        self.chunks = iter(chunks)
+        self.string = ""
+        self.eof = False
+        self.offset = 0
+        self.lineno = 1
+        self.line_pos = 0
+        self.line_start = 0
+        self.depth = 0
+        self.completed = 0
+        self.item = None
+        self.child = None
+        self.token = 0
+
+        location = 0
+        while (True):
+            if (location > COMPACT_SIZE):
+                self.discard(location)
+                location = 0
+
+            location = self.match(WHITESPACE, location).end()
+            if (self.depth == 0):
+                self.item = self.position(location)
+            elif (self.depth == 1):
+                self.child = self.position(location)
+
+            if (not self.fill(location)):
+                if (self.depth > 0):
+                    raise self.error('"}"', location)
+                if (self.completed == 0 and not fragment):
+                    raise self.error(WORD, location)
+                return
+
+            if (self.depth > 0 and self.string[location] == "}"):
+                self.token = location
+                location += 1
+                self.depth -= 1
+                if (self.depth == 0):
+                    self.completed += 1
+                result = self.callbacks.end_block()
+                if (isinstance(result, list)):
+                    for item in result:
+                        yield item
+                continue
+
+            match = self.match(NAME, location)
+            if (match is None):
+                raise self.error(WORD, location)
+            name = intern(match.group())
+            self.token = location
+            location = self.match(WHITESPACE, match.end()).end()
+
+            if (self.fill(location) and self.string[location] == "{"):
+                location += 1
+                self.depth += 1
+                self.callbacks.start_block(name)
+                continue
+
+            if (name == "include" and self.fill(location) and self.string[location] == '"'):
+                # a config still needs at least one block, so top
+                # level includes do not count as a completed item
+                (pattern, location) = self.parse_include(location, fragment)
+                for item in self.callbacks.include(pattern):
+                    yield item
+                continue
+
+            if (self.depth == 0 and not fragment):
+                raise self.error('"{"', location)
+
+            (options, location) = self.parse_options(location)
+            result = self.callbacks.build_directive(name, options)
+            if (isinstance(result, list)):
+                for item in result:
+                    yield item
+            elif (result is not None):
+                yield result
+
+    # pyparsing gives up on a broken include at the top level and
+    # tries it as a block instead, so it reports the missing "{"
+    # after the include keyword rather than the missing ";"
+    def parse_include(self, location, fragment=False):
+        start = location
+        match = self.match(QUOTED, location)
+        if (match is not None):
+            location = self.match(WHITESPACE, match.end()).end()
+            if (self.fill(location) and self.string[location] == ";"):
+                return (match.group()[1:-1], location + 1)
+        if (self.depth == 0 and not fragment):
+            raise self.error('"{"', start)
+        raise self.error('";"', location)
+
+    def parse_options(self, location):
+        options = []
+        while (True):
+            if (self.fill(location) and self.string[location] == ";"):
+                return (options, location + 1)
+
+            match = self.match(NAME, location)
+            if (match is None):
+                raise self.error('";"', location)
+
+            value_location = self.match(WHITESPACE, match.end()).end()
+            value = self.match(OPTION_VALUE, value_location)
+            if (value is None):
+                raise self.error(WORD, value_location)
+
+            options.append(Option(intern(match.group()), value.group()))
+            location = self.match(WHITESPACE, value.end()).end()
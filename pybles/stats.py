@@ -0,0 +1,88 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import time
+
+CATEGORIES = [ "phases", "blocks", "block_ends", "directives", "options" ]
+
+class Timing(object):
+    __slots__ = ( "count", "seconds" )
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def to_dict(self):
+        return { "count": self.count, "seconds": self.seconds }
+
+# Timings collected while parsing when a ParseStats object is handed
+# to PybleParser.  Each category maps a name to a Timing:
+#
+#   phases      whole steps, "parse" is the time spent in the parser
+#               and "callbacks" the part of that spent in builders
+#   blocks      block start callbacks by block name
+#   block_ends  block end callbacks by block name
+#   directives  directive callbacks by directive name
+#   options     builder option handlers by option name
+#
+# Option handlers run inside their directive callback so their time
+# is also part of the directive time
+class ParseStats():
+    def __init__(self, clock = time.time):
+        self.clock = clock
+        self.categories = dict([ (category, {}) for category in CATEGORIES ])
+
+    def record(self, category, name, seconds, count = 1):
+        timings = self.categories[category]
+        timing = timings.get(name)
+        if (timing is None):
+            timing = timings[name] = Timing()
+        timing.count += count
+        timing.seconds += seconds
+
+    def timing(self, category, name):
+        return self.categories[category].get(name, Timing())
+
+    def __getitem__(self, category):
+        return self.categories[category]
+
+    def callback_seconds(self):
+        return self.timing("phases", "callbacks").seconds
+
+    # time spent reading and tokenizing the config, which is
+    # everything the parser did outside of the builder callbacks
+    def tokenize_seconds(self):
+        return max(self.timing("phases", "parse").seconds - self.callback_seconds(), 0.0)
+
+    def to_dict(self):
+        data = {}
+        for (category, timings) in self.categories.items():
+            data[category] = dict([ (name, timing.to_dict()) for (name, timing) in timings.items() ])
+        data["tokenize_seconds"] = self.tokenize_seconds()
+        return data
+
+    def dump(self, outfile):
+        with open(outfile, "w") as f:
+            json.dump(self.to_dict(), f, indent = 2, sort_keys = True)
+
+    def __str__(self):
+        lines = [ "parse %.6fs (tokenize %.6fs, callbacks %.6fs)" % (self.timing("phases", "parse").seconds, self.tokenize_seconds(), self.callback_seconds()) ]
+        for category in CATEGORIES:
+            timings = sorted(self.categories[category].items(), key = lambda item: -item[1].seconds)
+            for (name, timing) in timings:
+                lines.append("%-10s %-30s %8d %12.6fs" % (category, name, timing.count, timing.seconds))
+        return "\n".join(lines)
@@ -0,0 +1,234 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import re
+import socket
+import struct
+import subprocess
+from collections import OrderedDict
+
+SAVE_COMMANDS = { "v4": "iptables-save", "v6": "ip6tables-save" }
+
+SYS_CLASS_NET = "/sys/class/net"
+PROC_IF_INET6 = "/proc/net/if_inet6"
+
+COUNTERS = re.compile(r"^\[(\d+):(\d+)\]\s*")
+
+class StateError(BaseException):
+    pass
+
+class Rule():
+    def __init__(self, chain, spec, packets=0, bytes=0):
+        self.chain = chain
+        self.spec = spec
+        self.packets = packets
+        self.bytes = bytes
+
+class Chain():
+    def __init__(self, name, policy=None, packets=0, bytes=0):
+        self.name = name
+        self.policy = policy
+        self.packets = packets
+        self.bytes = bytes
+        self.rules = []
+
+    def builtin(self):
+        return self.policy is not None
+
+class Table():
+    def __init__(self, name):
+        self.name = name
+        self.chains = OrderedDict()
+
+    def builtin_chains(self):
+        return [ chain.name for chain in self.chains.values() if chain.builtin() ]
+
+    def custom_chains(self):
+        return [ chain.name for chain in self.chains.values() if not chain.builtin() ]
+
+class Interface():
+    def __init__(self, name, index=0):
+        self.name = name
+        self.index = index
+        self.addresses = []
+
+# Parses iptables-save output, with or without the per rule
+# counters that "iptables-save -c" prefixes each rule with
+def parse_save(text):
+    tables = OrderedDict()
+    table = None
+    for (lineno, line) in enumerate(text.splitlines()):
+        line = line.strip()
+        if (line == "" or line.startswith("#")):
+            continue
+
+        if (line.startswith("*")):
+            table = Table(line[1:])
+            tables[table.name] = table
+        elif (table is None):
+            raise StateError("Line %d is outside of a table: %s" % (lineno + 1, line))
+        elif (line == "COMMIT"):
+            table = None
+        elif (line.startswith(":")):
+            fields = line[1:].split()
+            policy = None if fields[1] == "-" else fields[1]
+            (packets, octets) = (0, 0)
+            if (len(fields) > 2):
+                match = COUNTERS.match(fields[2])
+                if (match):
+                    (packets, octets) = (int(match.group(1)), int(match.group(2)))
+            table.chains[fields[0]] = Chain(fields[0], policy, packets, octets)
+        else:
+            (packets, octets) = (0, 0)
+            match = COUNTERS.match(line)
+            if (match):
+                (packets, octets) = (int(match.group(1)), int(match.group(2)))
+                line = line[match.end():]
+            fields = line.split(None, 2)
+            if (len(fields) < 2 or fields[0] != "-A"):
+                raise StateError("Unrecognized rule on line %d: %s" % (lineno + 1, line))
+            spec = fields[2] if len(fields) > 2 else ""
+            if (fields[1] not in table.chains):
+                raise StateError("Rule on line %d appends to undeclared chain %s" % (lineno + 1, fields[1]))
+            table.chains[fields[1]].rules.append(Rule(fields[1], spec, packets, octets))
+    return tables
+
+def read_tables(family="v4", counters=True):
+    command = [ SAVE_COMMANDS[family] ]
+    if (counters):
+        command.append("-c")
+    try:
+        output = subprocess.check_output(command)
+    except (OSError, subprocess.CalledProcessError) as ex:
+        raise StateError("Failed to run %s: %s" % (" ".join(command), ex))
+    return parse_save(output.decode("utf-8"))
+
+# rtnetlink constants from linux/netlink.h, linux/rtnetlink.h
+# and linux/if_addr.h
+NETLINK_ROUTE   = 0
+NLM_F_REQUEST   = 0x1
+NLM_F_DUMP      = 0x300
+NLMSG_ERROR     = 2
+NLMSG_DONE      = 3
+RTM_NEWADDR     = 20
+RTM_GETADDR     = 22
+IFA_ADDRESS     = 1
+IFA_LOCAL       = 2
+
+NLMSGHDR   = struct.Struct("=IHHII")
+IFADDRMSG  = struct.Struct("=BBBBI")
+RTATTR     = struct.Struct("=HH")
+
+def align(length):
+    return (length + 3) & ~3
+
+def parse_attributes(data, offset, end):
+    attributes = {}
+    while (offset + RTATTR.size <= end):
+        (length, kind) = RTATTR.unpack_from(data, offset)
+        if (length < RTATTR.size):
+            break
+        attributes[kind] = data[offset + RTATTR.size:offset + length]
+        offset += align(length)
+    return attributes
+
+# Returns (index, address, prefix length) tuples for every
+# RTM_NEWADDR message in a netlink dump and whether the
+# dump has finished
+def parse_addr_messages(data):
+    addresses = []
+    offset = 0
+    while (offset + NLMSGHDR.size <= len(data)):
+        (length, kind, flags, seq, pid) = NLMSGHDR.unpack_from(data, offset)
+        if (length < NLMSGHDR.size):
+            break
+        if (kind == NLMSG_DONE):
+            return (addresses, True)
+        if (kind == NLMSG_ERROR):
+            (error,) = struct.unpack_from("=i", data, offset + NLMSGHDR.size)
+            raise StateError("Netlink address dump failed with error %d" % -error)
+
+        if (kind == RTM_NEWADDR):
+            body = offset + NLMSGHDR.size
+            (family, prefixlen, flags, scope, index) = IFADDRMSG.unpack_from(data, body)
+            attributes = parse_attributes(data, body + IFADDRMSG.size, offset + length)
+            # IFA_LOCAL is the local address on point to point links
+            # where IFA_ADDRESS is the address of the peer
+            address = attributes.get(IFA_LOCAL, attributes.get(IFA_ADDRESS))
+            if (address is not None and family in (socket.AF_INET, socket.AF_INET6)):
+                addresses.append((index, socket.inet_ntop(family, address), prefixlen))
+        offset += align(length)
+    return (addresses, False)
+
+def netlink_addresses():
+    sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    try:
+        sock.bind((0, 0))
+        header = NLMSGHDR.pack(NLMSGHDR.size + IFADDRMSG.size, RTM_GETADDR, NLM_F_REQUEST | NLM_F_DUMP, 1, 0)
+        sock.send(header + IFADDRMSG.pack(socket.AF_UNSPEC, 0, 0, 0, 0))
+        addresses = []
+        done = False
+        while (not done):
+            (messages, done) = parse_addr_messages(sock.recv(65536))
+            addresses.extend(messages)
+        return addresses
+    finally:
+        sock.close()
+
+def parse_if_inet6(text):
+    addresses = []
+    for line in text.splitlines():
+        fields = line.split()
+        if (len(fields) < 6):
+            continue
+        packed = bytearray.fromhex(fields[0])
+        address = socket.inet_ntop(socket.AF_INET6, bytes(packed))
+        addresses.append((int(fields[1], 16), address, int(fields[2], 16), fields[5]))
+    return addresses
+
+def read_interfaces(sys_class_net=SYS_CLASS_NET):
+    interfaces = OrderedDict()
+    for name in sorted(os.listdir(sys_class_net)):
+        index = 0
+        try:
+            with open(os.path.join(sys_class_net, name, "ifindex")) as f:
+                index = int(f.read().strip())
+        except (IOError, ValueError):
+            pass
+        interfaces[name] = Interface(name, index)
+    return interfaces
+
+# Reads every interface and its addresses in one go, using a single
+# netlink dump where available and /proc/net/if_inet6 otherwise
+# (which only knows about IPv6 addresses)
+def interfaces(sys_class_net=SYS_CLASS_NET, proc_if_inet6=PROC_IF_INET6):
+    found = read_interfaces(sys_class_net)
+    by_index = dict([ (interface.index, interface) for interface in found.values() ])
+    try:
+        addresses = netlink_addresses()
+    except (socket.error, AttributeError):
+        addresses = []
+        try:
+            with open(proc_if_inet6) as f:
+                addresses = [ (index, address, prefix) for (index, address, prefix, name) in parse_if_inet6(f.read()) ]
+        except IOError:
+            pass
+
+    for (index, address, prefix) in addresses:
+        if (index in by_index):
+            by_index[index].addresses.append(address)
+    return found
@@ -0,0 +1,137 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+from collections import namedtuple
+import pybles
+from pybles import scanner
+from pybles import include
+
+# A config parsed once into a tree that any number of builders can be
+# built from with PybleParser.build_tree, without tokenizing it again.
+# The nodes are tuples, so a tree can be shared freely, and can be
+# written out as JSON (or pickled) and read back.  Lines and columns
+# are those of the name that starts each node, in the file the node
+# was read from.  Includes are read when the tree is parsed, each
+# included file becomes an Include node holding what was read from it
+
+Config = namedtuple("Config", "path body")
+
+Block = namedtuple("Block", "name body line column")
+
+Directive = namedtuple("Directive", "name options line column")
+
+# the scanner's options, so building from a tree does not copy them
+Option = scanner.Option
+
+Include = namedtuple("Include", "path body line column")
+
+# Builds the nodes of one file through the scanner callbacks, the
+# files are the absolute paths of the file and those including it
+class TreeBuilder():
+    def __init__(self, files):
+        self.files = files
+        self.scanner = scanner.Scanner(self)
+        self.bodies = [ [] ]
+        self.blocks = []
+
+    def parse(self, chunks, fragment):
+        for result in self.scanner.iter_parse(chunks, fragment=fragment):
+            pass
+        return tuple(self.bodies[0])
+
+    def start_block(self, name):
+        self.blocks.append((name,) + self.scanner.token_position())
+        self.bodies.append([])
+
+    def end_block(self):
+        (name, line, column) = self.blocks.pop()
+        body = tuple(self.bodies.pop())
+        self.bodies[-1].append(Block(name, body, line, column))
+
+    def build_directive(self, name, options):
+        (line, column) = self.scanner.token_position()
+        self.bodies[-1].append(Directive(name, tuple([ Option(option.name, option.value) for option in options ]), line, column))
+
+    def include(self, pattern):
+        (line, column) = self.scanner.token_position()
+        base = os.getcwd()
+        if (len(self.files) > 0):
+            base = os.path.dirname(self.files[-1])
+        for path in include.resolve(pattern, base):
+            path = os.path.abspath(path)
+            if (path in self.files):
+                raise pybles.ParseError("%s includes itself through %s" % (path, " -> ".join(self.files[self.files.index(path):])))
+            self.bodies[-1].append(Include(path, read_body(path, self.files + (path,), True), line, column))
+        return []
+
+def read_body(path, files, fragment):
+    try:
+        with open(path) as f:
+            return TreeBuilder(files).parse([ f.read() ], fragment)
+    except scanner.ScanError as se:
+        if (fragment):
+            raise pybles.ParseError("%s: %s" % (path, se))
+        raise pybles.ParseError("%s" % se)
+    except (IOError, OSError) as ex:
+        if (fragment):
+            raise pybles.ParseError("%s: %s" % (path, ex))
+        raise
+
+def parse_file(path):
+    path = os.path.abspath(path)
+    return Config(path, read_body(path, (path,), False))
+
+# path is the file config was read from, if any, which
+# included paths are relative to
+def parse_string(config, path=None):
+    files = ()
+    if (path is not None):
+        path = os.path.abspath(path)
+        files = (path,)
+    try:
+        return Config(path, TreeBuilder(files).parse([ config ], False))
+    except scanner.ScanError as se:
+        raise pybles.ParseError("%s" % se)
+
+# Nodes as JSON friendly lists, tagged with the kind of node
+def to_data(node):
+    if (isinstance(node, Config)):
+        return { "path": node.path, "body": [ to_data(child) for child in node.body ] }
+    if (isinstance(node, Block)):
+        return [ "block", node.name, node.line, node.column, [ to_data(child) for child in node.body ] ]
+    if (isinstance(node, Directive)):
+        return [ "directive", node.name, node.line, node.column, [ [ option.name, option.value ] for option in node.options ] ]
+    return [ "include", node.path, node.line, node.column, [ to_data(child) for child in node.body ] ]
+
+def from_data(data):
+    if (isinstance(data, dict)):
+        return Config(data["path"], tuple([ from_data(child) for child in data["body"] ]))
+    (kind, name, line, column, body) = data
+    if (kind == "block"):
+        return Block(scanner.intern(name), tuple([ from_data(child) for child in body ]), line, column)
+    if (kind == "directive"):
+        return Directive(scanner.intern(name), tuple([ Option(scanner.intern(option), value) for (option, value) in body ]), line, column)
+    return Include(name, tuple([ from_data(child) for child in body ]), line, column)
+
+def dump(config, outfile):
+    with open(outfile, "w") as f:
+        json.dump(to_data(config), f)
+
+def load(infile):
+    with open(infile) as f:
+        return from_data(json.load(f))
@@ -0,0 +1,119 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+
+if (sys.version_info >= (3, 7)):
+    from pybles import apply
+
+# stands in for a restore command, keeping what it was given and
+# failing when the sets were not loaded first
+STUB = """#!/bin/sh
+%(check)s
+cat > "%(directory)s/%(name)s.in"
+%(rest)s
+"""
+
+# run by each restore stub, it only succeeds when the other restore
+# starts while this one is still running
+RENDEZVOUS = """touch "%(directory)s/%(name)s.started"
+i=0
+while [ ! -f "%(directory)s/%(other)s.started" ]; do
+  i=$((i + 1))
+  [ $i -gt 100 ] && exit 4
+  sleep 0.1
+done
+"""
+
+CONFIG = "filter { input { accept to self; accept tcp dst-port:22 from 10.0.0.1,10.0.0.2; drop; }}"
+
+@unittest.skipIf(sys.version_info < (3, 7), "applying needs asyncio")
+class ApplyTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        builder = iptables.Builder(ips = [ "192.168.1.1", "2001:db8::1" ], output = "restore", ipsets = "restore")
+        pybles.PybleParser(builder).parse_string(CONFIG)
+        self.payloads = builder.restore_payloads()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def stub(self, name, rest = "", check = ""):
+        path = os.path.join(self.directory, name)
+        with open(path, "w") as f:
+            f.write(STUB % { "directory": self.directory, "name": name, "check": check, "rest": rest })
+        os.chmod(path, 0o755)
+        return [ path ]
+
+    def rendezvous(self, name, other):
+        return RENDEZVOUS % { "directory": self.directory, "name": name, "other": other }
+
+    def stubs(self, ipset = "", rules = None, check = True):
+        check = "test -f %s/ipset.in || exit 3" % self.directory if check else ""
+        return {
+            "ipset": self.stub("ipset", ipset),
+            "iptables-restore": self.stub("iptables-restore", self.rendezvous("iptables-restore", "ip6tables-restore") if rules is None else rules, check),
+            "ip6tables-restore": self.stub("ip6tables-restore", self.rendezvous("ip6tables-restore", "iptables-restore") if rules is None else rules, check),
+        }
+
+    def received(self, name):
+        with open(os.path.join(self.directory, "%s.in" % name)) as f:
+            return f.read()
+
+    def test_apply(self):
+        # the restores each wait for the other to start, so they
+        # only succeed when they run at the same time
+        results = apply.apply(self.payloads, self.stubs())
+        self.assertEqual([ "ipset", "iptables-restore", "ip6tables-restore" ], [ result.name for result in results ])
+        self.assertEqual([ 0, 0, 0 ], [ result.returncode for result in results ])
+        for name in [ "ipset", "iptables-restore", "ip6tables-restore" ]:
+            self.assertEqual(self.payloads[name], self.received(name))
+
+    def test_without_ipset(self):
+        del self.payloads["ipset"]
+        results = apply.apply(self.payloads, self.stubs(rules = "", check = False))
+        self.assertEqual([ "iptables-restore", "ip6tables-restore" ], [ result.name for result in results ])
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "ipset.in")))
+
+    def test_ipset_failure(self):
+        try:
+            apply.apply(self.payloads, self.stubs(ipset = "echo bad set; exit 1"))
+            self.fail("ApplyError was not raised")
+        except apply.ApplyError as ex:
+            self.assertEqual("ipset failed (1): bad set", "%s" % ex)
+            self.assertEqual([ 1, None, None ], [ result.returncode for result in ex.results ])
+            self.assertEqual("not run since ipset failed", ex.results[1].output)
+        self.assertFalse(os.path.exists(os.path.join(self.directory, "iptables-restore.in")))
+
+    def test_restore_failure(self):
+        commands = self.stubs(rules = "")
+        commands["ip6tables-restore"] = [ os.path.join(self.directory, "missing") ]
+        try:
+            apply.apply(self.payloads, commands)
+            self.fail("ApplyError was not raised")
+        except apply.ApplyError as ex:
+            self.assertEqual([ 0, 0, None ], [ result.returncode for result in ex.results ])
+            self.assertTrue("ip6tables-restore failed (None)" in "%s" % ex)
+        self.assertEqual(self.payloads["iptables-restore"], self.received("iptables-restore"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,69 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import sys
+import unittest
+import subprocess
+import pybles
+import pybles.builders.iptables as iptables
+from benchmarks.generate import generate_config, INTERFACES
+from benchmarks.bench import compare, speedups, run_case
+from benchmarks import startup
+
+class BenchmarkTest(unittest.TestCase):
+    def test_generated_config(self):
+        config = generate_config(rules = 101, depth = 3, chains = 4, options = 5, seed = 1)
+        self.assertEqual(101, config.count(";"))
+        builder = iptables.Builder(ips = [ "10.0.0.1" ], interfaces = INTERFACES)
+        commands = list(pybles.PybleParser(builder, engine = "fast").parse_string(config))
+        # rules matching an address are only written for its family
+        self.assertEqual(2 * (101 + 4 * 3 * 3) - config.count(" from "), len([ command for command in commands if not command.startswith("ipset") ]))
+
+    def test_seeded(self):
+        self.assertEqual(generate_config(seed = 3), generate_config(seed = 3))
+        self.assertNotEqual(generate_config(seed = 3), generate_config(seed = 4))
+
+    def test_compare(self):
+        old = [ { "name": "a", "parse_seconds": 1.0, "build_seconds": 1.0, "total_seconds": 2.0, "peak_memory_mb": 10.0 } ]
+        new = [ { "name": "a", "parse_seconds": 1.05, "build_seconds": 1.5, "total_seconds": 2.55, "peak_memory_mb": 10.5 } ]
+        regressions = compare(new, old, 0.1)
+        self.assertEqual(2, len(regressions))
+        self.assertTrue(regressions[0].startswith("a: build_seconds"))
+        self.assertEqual([], compare(new, old, 0.5))
+        self.assertEqual([], compare([ dict(new[0], name = "b") ], old, 0.1))
+
+    def test_speedups(self):
+        old = [ { "name": "a", "total_seconds": 2.0 }, { "name": "b", "error": "failed" } ]
+        new = [ { "name": "a", "total_seconds": 0.5 }, { "name": "b", "total_seconds": 1.0 } ]
+        self.assertEqual([ "a: total_seconds went from 2.000 to 0.500 (4.00x)" ], speedups(new, old))
+
+    def test_run_case(self):
+        result = run_case({ "rules": 50, "depth": 1, "chains": 2, "options": 2, "v6": 0.5, "seed": 0, "engine": "fast", "output": "restore" }, repeat = 1)
+        self.assertFalse("error" in result)
+        self.assertTrue(result["commands"] > 50)
+        self.assertTrue(result["peak_memory_mb"] > 0)
+
+    def test_startup(self):
+        results = startup.measure(1, startup.ROOT)
+        self.assertEqual([ name for (name, code) in startup.CASES ], [ result["name"] for result in results ])
+        self.assertEqual(0.0, results[0]["overhead_seconds"])
+
+    def test_lazy_imports(self):
+        code = "import sys, pybles, pybles.builders.iptables; print(' '.join([ m for m in ['pyparsing', 'multiprocessing'] if m in sys.modules ]))"
+        self.assertEqual("", subprocess.check_output([ sys.executable, "-c", code ], cwd = startup.ROOT).decode("utf-8").strip())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,115 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+import pybles.builders.iptables.cache as cache
+
+class FailingParser():
+    def __init__(self, *args, **kwargs):
+        raise AssertionError("the config should not have been parsed")
+
+class CompileCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache_dir = os.path.join(self.directory, "cache")
+        self.infile = os.path.join(self.directory, "test.conf")
+        self.write_config("filter { input { accept to self; accept tcp dst-port:22; }}")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write_config(self, config):
+        with open(self.infile, "w") as f:
+            f.write(config)
+
+    def test_hit_skips_parsing(self):
+        c = cache.CompileCache(self.cache_dir)
+        compiled = c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        expected = list(pybles.PybleParser(iptables.Builder(ips = [ "192.168.1.1" ])).parse_file(self.infile))
+        self.assertEqual(expected, compiled.commands)
+        self.assertEqual(1, c.misses)
+
+        parser = cache.pybles.PybleParser
+        cache.pybles.PybleParser = FailingParser
+        try:
+            compiled = cache.CompileCache(self.cache_dir).compile_file(self.infile, ips = [ "192.168.1.1" ])
+        finally:
+            cache.pybles.PybleParser = parser
+        self.assertEqual(expected, compiled.commands)
+
+    def test_key_inputs(self):
+        c = cache.CompileCache(self.cache_dir)
+        c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        c.compile_file(self.infile, ips = [ "192.168.1.2" ])
+        c.compile_file(self.infile, ips = [ "192.168.1.2" ], interfaces = [ "eth0" ])
+        self.assertEqual(3, c.misses)
+
+        self.write_config("filter { input { accept to self; }}")
+        c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        self.assertEqual(4, c.misses)
+        c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        self.assertEqual(1, c.hits)
+
+    def test_included_files(self):
+        c = cache.CompileCache(self.cache_dir)
+        self.write_config("filter { input { include \"ssh.conf\"; drop; }}")
+        with open(os.path.join(self.directory, "ssh.conf"), "w") as f:
+            f.write("accept tcp dst-port:22;")
+        compiled = c.compile_file(self.infile)
+        self.assertEqual("iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22", compiled.commands[0])
+
+        with open(os.path.join(self.directory, "ssh.conf"), "w") as f:
+            f.write("accept tcp dst-port:2222;")
+        compiled = c.compile_file(self.infile)
+        self.assertEqual(2, c.misses)
+        self.assertEqual("iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 2222", compiled.commands[0])
+
+    def test_restore_payloads(self):
+        c = cache.CompileCache(self.cache_dir)
+        compiled = c.compile_file(self.infile, ips = [ "192.168.1.1" ], output = "restore")
+        cached = c.compile_file(self.infile, ips = [ "192.168.1.1" ], output = "restore")
+        self.assertEqual(1, c.hits)
+        self.assertEqual(compiled.payloads, cached.payloads)
+        self.assertTrue("COMMIT" in cached.payloads["iptables-restore"])
+
+    def test_lru_eviction(self):
+        c = cache.CompileCache(self.cache_dir)
+        c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        c.compile_file(self.infile, ips = [ "192.168.1.2" ])
+        self.assertEqual(2, len(c.entries()))
+
+        # make the ages deterministic, the first entry is the oldest
+        now = time.time()
+        for (age, entry) in zip([ 30, 20 ], c.entries()):
+            os.utime(entry[2], (now - age, now - age))
+
+        c = cache.CompileCache(self.cache_dir, max_size = sum([ entry[1] for entry in c.entries() ]))
+        c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        self.assertEqual(1, c.hits)
+
+        # the 192.168.1.2 entry is now the least recently used one
+        c.compile_file(self.infile, ips = [ "192.168.1.3" ])
+        self.assertEqual(2, len(c.entries()))
+        c.compile_file(self.infile, ips = [ "192.168.1.1" ])
+        self.assertEqual(2, c.hits)
+        c.compile_file(self.infile, ips = [ "192.168.1.2" ])
+        self.assertEqual(2, c.hits)
@@ -17,9 +17,13 @@
 
 import unittest
 import pybles
+import pybles.builders.iptables as iptables
+import pybles.builders.nftables as nftables
 
 
 class CustomFilterBuilder(pybles.DefaultBuilder):
+    HANDLERS = ( "input", "output", "accept" )
+
     def __init__(self):
         self.close = []
 
@@ -61,12 +65,67 @@ class CustomFilterBuilder(pybles.DefaultBuilder):
         self.close.append(path[-1])
 
 class CustomTableBuilder(pybles.DefaultBuilder):
+    HANDLERS = ( "filter", )
+
     def __init__(self):
         self.filter_builder = CustomFilterBuilder()
 
     def filter(self, *args):
         return self.filter_builder
 
+# parses another config from inside one of its own callbacks
+class NestingBuilder(pybles.DefaultBuilder):
+    HANDLERS = ( "outer", )
+
+    def __init__(self):
+        self.inner = CustomTableBuilder()
+        self.directives = []
+
+    def outer(self, path):
+        return self
+
+    def default_build_directive(self, path, directive):
+        self.directives.append(directive.name)
+        if (directive.name == "nest"):
+            pybles.PybleParser(self.inner).parse_string("filter { input { accept; } }")
+
+# declares its handlers rather than relying on method names
+class DeclaredBuilder(pybles.DefaultBuilder):
+    def __init__(self):
+        self.limits = []
+        self.rules = []
+
+    @pybles.handles()
+    def policy(self, path):
+        return self
+
+    @pybles.handles("rate-limited")
+    def rate_limited(self, path, directive):
+        for option in directive.options:
+            self.process_option(option)
+
+    @pybles.option("limit", r"\d+")
+    def limit_option(self, value):
+        self.limits.append(int(value))
+
+class DeclaredSubclass(DeclaredBuilder):
+    def limit_option(self, value):
+        self.limits.append(-int(value))
+
+# keeps every directive it is given
+class RetainingBuilder(pybles.DefaultBuilder):
+    def __init__(self):
+        self.directives = []
+
+    def default_build_block(self, path):
+        return self
+
+    def default_build_block_end(self, path):
+        pass
+
+    def default_build_directive(self, path, directive):
+        self.directives.append(directive)
+
 class CustomBuilderTest(unittest.TestCase):
     def test_parsing_invalid_block(self):
         p = pybles.PybleParser(CustomTableBuilder())
@@ -122,3 +181,48 @@ class CustomBuilderTest(unittest.TestCase):
         p.parse_string(config)
         self.assertEqual(b.filter_builder.close, ["forward"])
 
+    def test_nested_parse(self):
+        b = NestingBuilder()
+        pybles.PybleParser(b).parse_string("outer { first; nest; last; }")
+        self.assertEqual(b.directives, ["first", "nest", "last"])
+        self.assertEqual(b.inner.filter_builder.close, ["input"])
+
+    def test_declared_handlers(self):
+        b = DeclaredBuilder()
+        pybles.PybleParser(b).parse_string("policy { rate-limited limit 10; }")
+        self.assertEqual(b.limits, [10])
+
+        # attributes that are not methods are not handlers
+        self.assertEqual(None, b["rules"])
+        self.assertRaises(pybles.InvalidDirective, pybles.PybleParser(b).parse_string, "policy { rules; }")
+        self.assertRaises(pybles.InvalidOption, pybles.PybleParser(b).parse_string, "policy { rate-limited limit 10x; }")
+        self.assertRaises(pybles.InvalidOption, pybles.PybleParser(b).parse_string, "policy { rate-limited burst 10; }")
+
+    def test_undeclared_methods(self):
+        # public builder methods that are not handlers are not blocks
+        self.assertRaises(pybles.InvalidBlock, pybles.PybleParser(iptables.Builder()).parse_string, "ruleset {}")
+        self.assertRaises(pybles.InvalidBlock, pybles.PybleParser(nftables.Builder()).parse_string, "script {}")
+        self.assertRaises(pybles.InvalidDirective, pybles.PybleParser(nftables.Builder()).parse_string, "filter { script; }")
+
+    def test_dispatch_tables_per_class(self):
+        b = DeclaredSubclass()
+        pybles.PybleParser(b).parse_string("policy { rate-limited limit 10; }")
+        self.assertEqual(b.limits, [-10])
+        self.assertTrue(DeclaredBuilder.dispatch_tables() is not DeclaredSubclass.dispatch_tables())
+        self.assertTrue(DeclaredBuilder.dispatch_tables() is DeclaredBuilder.dispatch_tables())
+
+    def test_retained_directives(self):
+        for engine in pybles.ENGINES:
+            b = RetainingBuilder()
+            pybles.PybleParser(b, engine = engine).parse_string("filter { input { accept tcp dst-port:22 tcp dst-port:80; drop; } output { accept; } }")
+            (accept, drop, output) = b.directives
+            self.assertEqual(("filter", "input"), accept.path)
+            self.assertEqual(("filter", "output"), output.path)
+            self.assertTrue(accept.path is drop.path)
+            self.assertTrue(accept.name is output.name)
+            self.assertEqual(2, len(accept.options))
+            self.assertEqual("dst-port:80", accept.options["tcp"].value)
+            self.assertEqual([ "dst-port:22", "dst-port:80" ], [ option.value for option in accept.options ])
+            self.assertRaises(KeyError, lambda: accept.options["udp"])
+            self.assertRaises(AttributeError, setattr, accept, "name", "drop")
+            self.assertRaises(AttributeError, setattr, accept.options["tcp"], "value", "dst-port:443")
@@ -0,0 +1,188 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+from pybles import daemon
+from pybles.builders.iptables.ruleset import Ruleset
+
+MAIN = """
+filter {
+  input {
+    include "services/*.conf";
+    drop;
+  }
+}
+"""
+
+class Runner():
+    def __init__(self, failures = 0):
+        self.runs = []
+        self.inputs = []
+        self.failures = failures
+
+    def __call__(self, commands, inputs):
+        self.runs.append(commands)
+        self.inputs.append(inputs)
+        if (self.failures > 0):
+            self.failures -= 1
+            raise OSError("command failed")
+
+def v4(commands):
+    return [ command for command in commands if command.startswith("iptables ") ]
+
+class DaemonTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.config = self.write("main.conf", MAIN)
+        self.write("services/ssh.conf", "accept tcp dst-port:22;\n")
+        self.write("services/web.conf", "accept tcp dst-port:80;\n")
+        self.runner = Runner()
+        self.messages = []
+        self.daemon = daemon.Daemon(self.config, state = os.path.join(self.directory, "state.json"), runner = self.runner, interval = 0.05, logger = self.log)
+
+    def tearDown(self):
+        self.daemon.close()
+        shutil.rmtree(self.directory)
+
+    def log(self, message):
+        self.messages.append(message)
+
+    def write(self, name, config):
+        path = os.path.join(self.directory, name)
+        if (not os.path.isdir(os.path.dirname(path))):
+            os.makedirs(os.path.dirname(path))
+        existed = os.path.exists(path)
+        with open(path, "w") as f:
+            f.write(config)
+        if (existed):
+            # make sure the change is seen even within the same second
+            st = os.stat(path)
+            os.utime(path, (st.st_atime, st.st_mtime + 10))
+        return path
+
+    def test_initial_apply(self):
+        # without state what is loaded is not known, so it is replaced
+        response = self.daemon.check()
+        self.assertTrue(response["ok"])
+        self.assertEqual(v4(self.runner.runs[0]), [
+            "iptables -t filter -F",
+            "iptables -t filter -X",
+            "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22",
+            "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 80",
+            "iptables -t filter -A INPUT -j DROP",
+        ])
+        self.assertEqual(None, self.daemon.check())
+        self.assertEqual(1, len(self.runner.runs))
+
+    def test_only_changed_files_reparsed(self):
+        self.daemon.check()
+        misses = self.daemon.cache.misses
+        self.write("services/web.conf", "accept tcp dst-port:443;\n")
+        self.daemon.check()
+        self.assertEqual(misses + 1, self.daemon.cache.misses)
+        self.assertEqual(v4(self.runner.runs[1]), [
+            "iptables -t filter -D INPUT 2",
+            "iptables -t filter -I INPUT 2 -j ACCEPT -m tcp -p tcp --dport 443",
+        ])
+
+    def test_new_file_in_glob(self):
+        self.daemon.check()
+        self.write("services/dns.conf", "accept udp dst-port:53;\n")
+        self.daemon.check()
+        self.assertEqual(v4(self.runner.runs[1]), [ "iptables -t filter -I INPUT 1 -j ACCEPT -m udp -p udp --dport 53" ])
+
+    def test_state_saved(self):
+        self.daemon.check()
+        self.assertEqual(self.daemon.applied, Ruleset.load(os.path.join(self.directory, "state.json")))
+        restarted = daemon.Daemon(self.config, state = os.path.join(self.directory, "state.json"), runner = self.runner, logger = self.log)
+        self.assertEqual([], restarted.handle({ "command": "compile" })["commands"])
+
+    def test_ipsets_after_restart(self):
+        state = os.path.join(self.directory, "ipsets.json")
+        first = daemon.Daemon(self.config, state = state, runner = self.runner, ips = [ "10.0.0.1" ], logger = self.log)
+        first.check()
+        self.assertEqual(1, self.runner.runs[0].count(daemon.IPSET_RESTORE))
+        self.assertEqual([ daemon.IPSET_RESTORE ], list(self.runner.inputs[0].keys()))
+        payload = self.runner.inputs[0][daemon.IPSET_RESTORE].splitlines()
+        self.assertTrue("create iptables-self hash:ip family inet -exist" in payload)
+        self.assertTrue("add iptables-self-new 10.0.0.1 -exist" in payload)
+
+        restarted = daemon.Daemon(self.config, state = state, runner = self.runner, ips = [ "10.0.0.1" ], logger = self.log)
+        self.assertEqual([], restarted.handle({ "command": "compile" })["commands"])
+        restarted = daemon.Daemon(self.config, state = state, runner = self.runner, ips = [ "10.0.0.1", "10.0.0.2" ], logger = self.log)
+        response = restarted.handle({ "command": "compile" })
+        self.assertEqual([ daemon.IPSET_RESTORE ], response["commands"])
+        self.assertTrue("add iptables-self-new 10.0.0.2 -exist" in response["inputs"][daemon.IPSET_RESTORE].splitlines())
+
+    def test_failed_apply_retried(self):
+        self.daemon.check()
+        self.runner.failures = 1
+        self.write("services/web.conf", "accept tcp dst-port:443;\n")
+        self.assertFalse(self.daemon.check()["ok"])
+
+        # nothing changed, but what is loaded is not known
+        response = self.daemon.check()
+        self.assertTrue(response["ok"])
+        self.assertEqual(v4(self.runner.runs[2]), [
+            "iptables -t filter -F",
+            "iptables -t filter -X",
+            "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22",
+            "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 443",
+            "iptables -t filter -A INPUT -j DROP",
+        ])
+        self.assertEqual(None, self.daemon.check())
+
+    def test_errors_keep_applied_rules(self):
+        self.daemon.check()
+        applied = self.daemon.applied
+        self.write("services/web.conf", "accept tcp dst-port:80\n")
+        response = self.daemon.check()
+        self.assertFalse(response["ok"])
+        self.assertTrue(response["error"].startswith("ParseError"))
+        self.assertTrue(self.messages[-1].startswith("not applied: ParseError"))
+        self.assertTrue(applied is self.daemon.applied)
+        self.assertEqual(None, self.daemon.check())
+
+        self.write("services/web.conf", "accept tcp dst-port:80;\n")
+        response = self.daemon.check()
+        self.assertTrue(response["ok"])
+        self.assertEqual([], response["commands"])
+
+    def test_socket(self):
+        self.daemon.socket_path = os.path.join(self.directory, "pybles.sock")
+        thread = threading.Thread(target = self.daemon.serve)
+        thread.start()
+        try:
+            for i in range(100):
+                if (self.daemon.compiles > 0):
+                    break
+                time.sleep(0.05)
+            status = daemon.request(self.daemon.socket_path, "status")
+            self.assertTrue(status["ok"])
+            self.assertEqual(3, len(status["status"]["files"]))
+            self.assertEqual([], daemon.request(self.daemon.socket_path, "compile")["commands"])
+            self.assertFalse(daemon.request(self.daemon.socket_path, "restart")["ok"])
+        finally:
+            self.daemon.stop()
+            thread.join()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+import pybles.builders.nftables as nftables
+from pybles.builders.iptables.rule import Rule
+from pybles.builders.iptables.dispatch import selector, dispatch_runs
+
+CHAINS = "ssh { accept tcp dst-port:22 from 10.0.0.1; drop tcp dst-port:22; } web { accept tcp dst-port:80; accept tcp dst-port:443; }"
+
+def dispatch(config):
+    b = iptables.Builder(output = "restore", dispatch = True)
+    pybles.PybleParser(b).parse_string("filter { input { %s } }" % config)
+    return (b.ruleset(), b.restore_payloads())
+
+class DispatchTest(unittest.TestCase):
+    def test_selector(self):
+        rules = [ Rule("v4", target = "ACCEPT", protocol = "tcp", dport = ("80", "443")), Rule("v4", target = "DROP", protocol = "tcp", dport = ("8080",), src = "10.0.0.1") ]
+        self.assertEqual(("dport", "tcp", ("80", "443", "8080")), selector(rules))
+        self.assertEqual(("src", None, ("10.0.0.1",)), selector([ Rule("v4", target = "DROP", src = "10.0.0.1") ]))
+        self.assertEqual(None, selector(rules + [ Rule("v4", target = "DROP") ]))
+        self.assertEqual(None, selector([ Rule("v4", target = "DROP", protocol = "tcp", dport = ("1000:2000",)) ]))
+        self.assertEqual(None, selector([ Rule("v4", target = "DROP", src = "10.0.0.0/8") ]))
+        self.assertEqual(None, selector(rules + [ Rule("v4", target = "DROP", protocol = "udp", dport = ("53",)) ]))
+        self.assertEqual(None, selector([]))
+
+    def test_runs(self):
+        selectors = { "a": ("dport", "tcp", ("22",)), "b": ("dport", "tcp", ("80",)), "c": ("dport", "tcp", ("80", "443")), "d": ("dport", "udp", ("53",)) }
+        self.assertEqual([ (0, 2) ], dispatch_runs([ "a", "b", None, "a" ], selectors))
+        self.assertEqual([ (0, 2), (2, 4) ], dispatch_runs([ "a", "b", "c", "a" ], selectors))
+        self.assertEqual([], dispatch_runs([ "a", "d", "b", "x" ], selectors))
+
+    def test_iptables(self):
+        (ruleset, payloads) = dispatch("log; %s drop;" % CHAINS)
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j LOG", "-j pybles-dispatch-1 -m tcp -p tcp -m set --match-set pybles-dispatch-1 dst", "-j DROP" ])
+        self.assertEqual(ruleset.specs("v4", "pybles-dispatch-1"), [ "-j ssh -m tcp -p tcp --dport 22", "-j web -m tcp -p tcp -m multiport --dports 80,443" ])
+        self.assertEqual(ruleset.specs("v6", "INPUT")[1], "-j pybles-dispatch-1 -m tcp -p tcp -m set --match-set pybles-dispatch-1-v6 dst")
+        self.assertEqual(ruleset.specs("v4", "ssh"), [ "-j ACCEPT -m tcp -p tcp --dport 22 -s 10.0.0.1", "-j DROP -m tcp -p tcp --dport 22" ])
+        self.assertEqual(payloads["ipset"].splitlines(), [
+            "create pybles-dispatch-1 bitmap:port range 0-65535 -exist",
+            "create pybles-dispatch-1-new bitmap:port range 0-65535 -exist",
+            "flush pybles-dispatch-1-new",
+            "add pybles-dispatch-1-new 22 -exist",
+            "add pybles-dispatch-1-new 80 -exist",
+            "add pybles-dispatch-1-new 443 -exist",
+            "swap pybles-dispatch-1-new pybles-dispatch-1",
+            "destroy pybles-dispatch-1-new",
+            "create pybles-dispatch-1-v6 bitmap:port range 0-65535 -exist",
+            "create pybles-dispatch-1-v6-new bitmap:port range 0-65535 -exist",
+            "flush pybles-dispatch-1-v6-new",
+            "add pybles-dispatch-1-v6-new 22 -exist",
+            "add pybles-dispatch-1-v6-new 80 -exist",
+            "add pybles-dispatch-1-v6-new 443 -exist",
+            "swap pybles-dispatch-1-v6-new pybles-dispatch-1-v6",
+            "destroy pybles-dispatch-1-v6-new",
+        ])
+
+    def test_addresses(self):
+        (ruleset, payloads) = dispatch("a { accept from 10.0.0.1; } b { drop from 10.0.0.2; drop from 10.0.0.3 tcp dst-port:22; }")
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j pybles-dispatch-1 -m set --match-set pybles-dispatch-1 src" ])
+        self.assertEqual(ruleset.specs("v4", "pybles-dispatch-1"), [ "-j a -s 10.0.0.1", "-j b -s 10.0.0.2", "-j b -s 10.0.0.3" ])
+        self.assertEqual(ruleset.specs("v6", "INPUT"), [ "-j a", "-j b" ])
+        self.assertEqual(payloads["ipset"].splitlines()[0], "create pybles-dispatch-1 hash:ip family inet -exist")
+
+    def test_overlapping_chains_kept(self):
+        (ruleset, payloads) = dispatch("a { accept tcp dst-port:22; } b { drop tcp dst-port:22; } c { accept udp dst-port:53; }")
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j a", "-j b", "-j c" ])
+        self.assertFalse("ipset" in payloads)
+
+    def test_requires_restore_output(self):
+        self.assertRaises(pybles.BuildException, iptables.Builder, dispatch = True)
+
+    def test_nftables(self):
+        b = nftables.Builder(dispatch = True)
+        pybles.PybleParser(b).parse_string("filter { input { log; %s drop; } }" % CHAINS)
+        self.assertTrue("\t\tlog\n\t\ttcp dport vmap { 22 : jump ssh, 80 : jump web, 443 : jump web }\n\t\tdrop\n" in b.script())
+
+        b = nftables.Builder()
+        pybles.PybleParser(b).parse_string("filter { input { %s } }" % CHAINS)
+        self.assertTrue("\t\tjump ssh\n\t\tjump web\n" in b.script())
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+import pybles.builders.nftables as nftables
+
+CONFIGS = [
+    "filter {}",
+    "filter {}nat {}mangle {}raw {}security {}",
+    "filter { input { baz {}}}",
+    "filter { input { target option_name option_value; bar { target option_name option_value; }}}",
+    "filter { input { foochain1 { foochain2 { accept; }} foochain3 { accept; }}}",
+    "filter { input { log rate-limit 1/sec prefix \"Inbound \\\"Traffic\\\" Dropped\"; drop; }}",
+    "filter { input { accept tcp dst-port:22; accept udp src-port:53; }}",
+    "filter {\n\tinput {\r\n  accept to self ;\n}\n}\n",
+    "filter { input { accept to self; } output { accept from self; }}",
+    "filter { input { accept to dst-int:eth0; } output { accept from src-int:eth0; }}",
+]
+
+ERRORS = [
+    "",
+    "   ",
+    "filter {",
+    "filter } ",
+    "filter { input { accept foo",
+    "filter {\n  input {\n    accept tcp dst-port:22\n  }\n}",
+    "filter {\n\tinput {\n\t\taccept tcp dst-port:22\n\t}\n}\n",
+    "filter { a b c }",
+    "filter {}\n x;",
+    "filter {} nat { input { accept foo; }}",
+    "filter {} nat { input { accept \"foo; }}",
+    "include\"q\"z {",
+    "include \"q\"\nfilter {}",
+]
+
+# configs the builders reject, with the exception both engines raise
+BUILDER_ERRORS = [
+    ("filter { accept; }", pybles.InvalidDirective),
+    ("filter { input { } accept; }", pybles.InvalidDirective),
+    ("filter { fowler {}}", pybles.InvalidBlock),
+    ("filter { input { accept prefix \"foobar\"; }}", pybles.InvalidOption),
+]
+
+class RecordingBuilder(pybles.DefaultBuilder):
+    def __init__(self):
+        self.events = []
+
+    def default_build_block(self, path):
+        self.events.append(("block", list(path)))
+        return self
+
+    def default_build_block_end(self, path):
+        self.events.append(("end", list(path)))
+
+    def default_build_directive(self, path, directive):
+        options = [ (option.name, option.value) for option in directive.options ]
+        self.events.append(("directive", list(path), directive.name, options))
+        return [ directive.name ]
+
+class FastParserTest(unittest.TestCase):
+    def parse(self, engine, config, builder):
+        p = pybles.PybleParser(builder, engine = engine)
+        return list(p.parse_string(config))
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, pybles.PybleParser, None, engine = "foo")
+
+    def test_callback_parity(self):
+        for config in CONFIGS:
+            slow = RecordingBuilder()
+            fast = RecordingBuilder()
+            self.assertEqual(self.parse("pyparsing", config, slow), self.parse("fast", config, fast))
+            self.assertEqual(slow.events, fast.events)
+
+    def test_iptables_parity(self):
+        for config in CONFIGS[4:]:
+            builder_args = { "ips": [ "192.168.1.1", "fe80::1" ], "interfaces": [ "eth0" ] }
+            slow = self.parse("pyparsing", config, iptables.Builder(**builder_args))
+            fast = self.parse("fast", config, iptables.Builder(**builder_args))
+            self.assertEqual(slow, fast)
+
+    def test_file_parity(self):
+        infile = "%s/test.conf" % os.path.dirname(__file__)
+        builder_args = { "ips": [ "192.168.1.1" ], "interfaces": [ "lo" ] }
+        slow = pybles.PybleParser(iptables.Builder(**builder_args))
+        fast = pybles.PybleParser(iptables.Builder(**builder_args), engine = "fast")
+        self.assertEqual(list(slow.parse_file(infile)), list(fast.parse_file(infile)))
+
+    def test_error_parity(self):
+        for config in ERRORS:
+            messages = []
+            for engine in pybles.ENGINES:
+                p = pybles.PybleParser(RecordingBuilder(), engine = engine)
+                try:
+                    p.parse_string(config)
+                    self.fail("%s engine parsed invalid config %r" % (engine, config))
+                except pybles.ParseError as pe:
+                    messages.append(str(pe))
+            self.assertEqual(messages[0], messages[1])
+
+    def test_builder_error_parity(self):
+        for (config, exception) in BUILDER_ERRORS:
+            for builder in (iptables.Builder, nftables.Builder):
+                for engine in pybles.ENGINES:
+                    p = pybles.PybleParser(builder(), engine = engine)
+                    self.assertRaises(exception, lambda: list(p.parse_string(config)))
+
+    def test_error_location(self):
+        p = pybles.PybleParser(RecordingBuilder(), engine = "fast")
+        try:
+            p.parse_string("filter {}\nfilter {\n  input {\n    accept foo;\n  }\n}")
+            self.fail("fast engine parsed an option without a value")
+        except pybles.ParseError as pe:
+            self.assertEqual(str(pe), "Expected end of text, found 'f'  (at char 10), (line:2, col:1)")
+
+    def test_builder_exceptions(self):
+        p = pybles.PybleParser(iptables.Builder(), engine = "fast")
+        self.assertRaises(pybles.InvalidBlock, p.parse_string, "filter { fowler {}}")
+        self.assertRaises(pybles.InvalidOption, p.parse_string, "filter { input { accept prefix \"foobar\"; }}")
@@ -0,0 +1,137 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+
+SERVICES = {
+    "ssh.conf": "accept tcp dst-port:22;\n",
+    "web.conf": "web { accept tcp dst-port:80; accept tcp dst-port:443; }\n",
+    "dns.conf": "accept udp dst-port:53;\ninclude \"extra/*.conf\";\n",
+    "extra/ntp.conf": "accept udp dst-port:123;\n",
+}
+
+MAIN = """
+filter {
+  input {
+    include "services/*.conf";
+    drop;
+  }
+}
+"""
+
+# what MAIN is once the includes are pasted in, in sorted order
+FLAT = """
+filter {
+  input {
+    accept udp dst-port:53;
+    accept udp dst-port:123;
+    accept tcp dst-port:22;
+    web { accept tcp dst-port:80; accept tcp dst-port:443; }
+    drop;
+  }
+}
+"""
+
+class IncludeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for (name, config) in SERVICES.items():
+            self.write(os.path.join("services", name), config)
+        self.main = self.write("main.conf", MAIN)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, config):
+        path = os.path.join(self.directory, name)
+        if (not os.path.isdir(os.path.dirname(path))):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as f:
+            f.write(config)
+        return path
+
+    def parse_file(self, path, engine = "pyparsing", processes = None):
+        return list(pybles.PybleParser(iptables.Builder(), engine = engine, processes = processes).parse_file(path))
+
+    def test_include(self):
+        expected = list(pybles.PybleParser(iptables.Builder()).parse_string(FLAT))
+        for engine in pybles.ENGINES:
+            for processes in [ None, 1, 3 ]:
+                self.assertEqual(expected, self.parse_file(self.main, engine, processes))
+
+    def test_stream(self):
+        expected = self.parse_file(self.main)
+        self.assertEqual(expected, list(pybles.PybleParser(iptables.Builder()).iter_file(self.main)))
+
+    def test_parse_string(self):
+        config = MAIN.replace("services/", os.path.join(self.directory, "services/"))
+        self.assertEqual(self.parse_file(self.main), list(pybles.PybleParser(iptables.Builder()).parse_string(config)))
+
+    def test_top_level(self):
+        self.write("output.conf", "filter { output { drop; } }\n")
+        path = self.write("top.conf", "filter { input { accept; } }\ninclude \"output.conf\";\n")
+        for engine in pybles.ENGINES:
+            self.assertEqual(self.parse_file(path, engine), [
+                "iptables -t filter -A INPUT -j ACCEPT",
+                "ip6tables -t filter -A INPUT -j ACCEPT",
+                "iptables -t filter -A OUTPUT -j DROP",
+                "ip6tables -t filter -A OUTPUT -j DROP",
+            ])
+
+    def test_include_without_blocks(self):
+        self.write("output.conf", "filter { output { drop; } }\n")
+        path = self.write("only.conf", "include \"output.conf\";\n")
+        messages = []
+        for engine in pybles.ENGINES:
+            try:
+                self.parse_file(path, engine)
+                self.fail("parsing a config without any blocks succeeded")
+            except pybles.ParseError as pe:
+                messages.append(str(pe))
+        self.assertEqual(messages[0], messages[1])
+
+    def test_missing_file(self):
+        path = self.write("missing.conf", "filter { input { include \"nothere.conf\"; } }\n")
+        for engine in pybles.ENGINES:
+            self.assertRaises(pybles.ParseError, self.parse_file, path, engine)
+
+    def test_empty_glob(self):
+        path = self.write("empty.conf", "filter { input { include \"nothere/*.conf\"; drop; } }\n")
+        self.assertEqual(2, len(self.parse_file(path)))
+
+    def test_cycle(self):
+        self.write("a.conf", "include \"b.conf\";\n")
+        self.write("b.conf", "include \"a.conf\";\n")
+        path = self.write("cycle.conf", "filter { input { include \"a.conf\"; } }\n")
+        for engine in pybles.ENGINES:
+            self.assertRaises(pybles.ParseError, self.parse_file, path, engine)
+
+    def test_error_names_file(self):
+        self.write("services/broken.conf", "accept tcp;\n")
+        for engine in pybles.ENGINES:
+            try:
+                self.parse_file(self.main, engine)
+                self.fail("parsing an include with a syntax error succeeded")
+            except pybles.ParseError as pe:
+                self.assertTrue(str(pe).startswith(os.path.join(self.directory, "services", "broken.conf")))
+
+if __name__ == '__main__':
+    unittest.main()
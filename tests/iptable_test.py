@@ -17,6 +17,7 @@
 import unittest
 import pybles
 import pybles.builders.iptables as iptables
+from pybles.builders.iptables.ipset import temporary_name
 
 class IPTableTest(unittest.TestCase):
     def test_chain_names(self):
@@ -236,3 +237,180 @@ class IPTableTest(unittest.TestCase):
         config = "filter { input { accept from src-int:eth0; }}"
         self.assertRaises(pybles.InvalidOption, p.parse_string, config)
 
+    def test_invalid_option_values(self):
+        for config in [ "accept tcp dst-port:22x;", "accept tcp 22;", "accept udp port:53;", "log rate-limit 1/week;", "log rate-limit many;", "accept state new;" ]:
+            p = pybles.PybleParser(iptables.Builder())
+            self.assertRaises(pybles.InvalidOption, p.parse_string, "filter { input { %s }}" % config)
+
+
+    def test_restore_output(self):
+        b = iptables.Builder(output = "restore")
+        p = pybles.PybleParser(b)
+        config = "filter { input { foochain { accept tcp dst-port:22; } drop; }}"
+        output = p.parse_string(config)
+        self.assertEqual(0, len(output))
+
+        payloads = b.restore_payloads()
+        self.assertEqual(payloads["iptables-restore"], "\n".join([
+            "*filter",
+            ":INPUT ACCEPT [0:0]",
+            ":FORWARD ACCEPT [0:0]",
+            ":OUTPUT ACCEPT [0:0]",
+            ":foochain - [0:0]",
+            "-A INPUT -j foochain",
+            "-A INPUT -j DROP",
+            "-A foochain -j ACCEPT -m tcp -p tcp --dport 22",
+            "COMMIT",
+            "",
+        ]))
+        self.assertEqual(payloads["ip6tables-restore"], payloads["iptables-restore"])
+
+    def test_restore_output_families(self):
+        b = iptables.Builder(ips = [ "192.168.1.1" ], output = "restore")
+        p = pybles.PybleParser(b)
+        config = "filter { input { accept to self; }}"
+        output = p.parse_string(config)
+
+        self.assertEqual(3, len(output))
+        self.assertEqual(output[0], "ipset create iptables-self hash:ip family inet")
+        self.assertEqual(output[1], "ipset create iptables-self-v6 hash:ip family inet6")
+        self.assertEqual(output[2], "ipset add iptables-self 192.168.1.1")
+
+        payloads = b.restore_payloads()
+        self.assertTrue("-A INPUT -j ACCEPT -m set --match-set iptables-self dst\n" in payloads["iptables-restore"])
+        self.assertTrue("-A INPUT -j ACCEPT -m set --match-set iptables-self-v6 dst\n" in payloads["ip6tables-restore"])
+
+    def test_restore_ipsets(self):
+        groups = { "web": [ "10.0.0.1", "10.0.0.2" ] }
+        b = iptables.Builder(ips = [ "192.168.1.1", "2001:db8::1" ], groups = groups, output = "restore", ipsets = "restore")
+        p = pybles.PybleParser(b)
+        config = "filter { input { accept to self; accept from group:web; }}"
+        self.assertEqual([], list(p.parse_string(config)))
+
+        payloads = b.restore_payloads()
+        self.assertEqual(payloads["ipset"].splitlines(), [
+            "create iptables-self hash:ip family inet -exist",
+            "create iptables-self-new hash:ip family inet -exist",
+            "flush iptables-self-new",
+            "add iptables-self-new 192.168.1.1 -exist",
+            "swap iptables-self-new iptables-self",
+            "destroy iptables-self-new",
+            "create iptables-self-v6 hash:ip family inet6 -exist",
+            "create iptables-self-v6-new hash:ip family inet6 -exist",
+            "flush iptables-self-v6-new",
+            "add iptables-self-v6-new 2001:db8::1 -exist",
+            "swap iptables-self-v6-new iptables-self-v6",
+            "destroy iptables-self-v6-new",
+            "create pybles-web hash:ip family inet -exist",
+            "create pybles-web-new hash:ip family inet -exist",
+            "flush pybles-web-new",
+            "add pybles-web-new 10.0.0.1 -exist",
+            "add pybles-web-new 10.0.0.2 -exist",
+            "swap pybles-web-new pybles-web",
+            "destroy pybles-web-new",
+        ])
+        self.assertTrue("-A INPUT -j ACCEPT -m set --match-set pybles-web src\n" in payloads["iptables-restore"])
+
+        self.assertRaises(pybles.BuildException, iptables.Builder, ipsets = "restore")
+        self.assertRaises(pybles.BuildException, iptables.Builder, output = "restore", ipsets = "foo")
+
+        # the temporary set of a set with a long name still fits
+        self.assertTrue(len(temporary_name("pybles-%s" % ("x" * 24))) <= 31)
+
+    def test_restore_requires_restore_output(self):
+        b = iptables.Builder()
+        self.assertRaises(pybles.BuildException, b.restore_payloads)
+        self.assertRaises(pybles.BuildException, iptables.Builder, output = "foo")
+
+    def test_from_ip(self):
+        p = pybles.PybleParser(iptables.Builder())
+
+        config = "filter { input { accept from 10.0.0.1; }}"
+        output = p.parse_string(config)
+        self.assertEqual(1, len(output))
+        self.assertEqual(output[0], "iptables -t filter -A INPUT -j ACCEPT -s 10.0.0.1")
+
+    def test_single_family_rules(self):
+        p = pybles.PybleParser(iptables.Builder())
+        config = "filter { input { accept from fe80::1; accept tcp dst-port:22; drop from 10.0.0.1,fe80::2; }}"
+        self.assertEqual(list(p.parse_string(config)), [
+            "ip6tables -t filter -A INPUT -j ACCEPT -s fe80::1",
+            "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22",
+            "ip6tables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22",
+            "iptables -t filter -A INPUT -j DROP -s 10.0.0.1",
+            "ip6tables -t filter -A INPUT -j DROP -s fe80::2",
+        ])
+
+        b = iptables.Builder(output = "restore")
+        pybles.PybleParser(b).parse_string("filter { input { accept from 10.0.0.1; foo { drop to 10.0.0.2; } }}")
+        ruleset = b.ruleset()
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j ACCEPT -s 10.0.0.1", "-j foo" ])
+        self.assertEqual(ruleset.specs("v6", "INPUT"), [ "-j foo" ])
+        self.assertEqual(ruleset.specs("v6", "foo"), [])
+
+    def test_mixed_family_addresses(self):
+        groups = { "web": [ "10.0.0.2", "10.0.0.3" ] }
+        p = pybles.PybleParser(iptables.Builder(ips = [ "10.0.0.5", "fe80::5" ], groups = groups))
+        self.assertEqual(list(p.parse_string("filter { input { accept from 10.0.0.1 to self tcp dst-port:22; }}"))[4:], [
+            "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22 -s 10.0.0.1 -m set --match-set iptables-self dst",
+        ])
+
+        p = pybles.PybleParser(iptables.Builder(groups = groups))
+        output = list(p.parse_string("filter { input { accept from fe80::1,fe80::2,10.0.0.1 to group:web; }}"))
+        self.assertEqual([ command for command in output if not command.startswith("ipset ") ], [
+            "iptables -t filter -A INPUT -j ACCEPT -s 10.0.0.1 -m set --match-set pybles-web dst",
+        ])
+
+        for config in [ "accept from 2001:db8::1 to 10.0.0.5;", "accept from fe80::1 to group:web;" ]:
+            p = pybles.PybleParser(iptables.Builder(groups = groups))
+            self.assertRaises(pybles.InvalidOption, p.parse_string, "filter { input { %s }}" % config)
+
+    def test_from_address_list(self):
+        p = pybles.PybleParser(iptables.Builder())
+
+        config = "filter { input { accept from 10.0.0.1,10.0.0.2,10.1.0.0/16,fe80::1; drop from 10.0.0.1,10.0.0.2,10.1.0.0/16; }}"
+        output = p.parse_string(config)
+
+        name = output[0].split()[2]
+        self.assertTrue(name.startswith("pybles-"))
+        self.assertEqual(7, len(output))
+        self.assertEqual(output[0], "ipset create %s hash:net family inet" % name)
+        self.assertEqual(output[1], "ipset add %s 10.0.0.1" % name)
+        self.assertEqual(output[2], "ipset add %s 10.0.0.2" % name)
+        self.assertEqual(output[3], "ipset add %s 10.1.0.0/16" % name)
+        self.assertEqual(output[4], "iptables -t filter -A INPUT -j ACCEPT -m set --match-set %s src" % name)
+        self.assertEqual(output[5], "ip6tables -t filter -A INPUT -j ACCEPT -s fe80::1")
+        self.assertEqual(output[6], "iptables -t filter -A INPUT -j DROP -m set --match-set %s src" % name)
+
+    def test_to_group(self):
+        groups = { "web": [ "10.0.0.1", "10.0.0.2", "fe80::1", "fe80::2" ], "one": [ "10.0.0.3" ] }
+        p = pybles.PybleParser(iptables.Builder(groups = groups))
+
+        config = "filter { input { accept tcp dst-port:80 to group:web; accept to group:one; }}"
+        output = p.parse_string(config)
+
+        self.assertEqual(9, len(output))
+        self.assertEqual(output[0], "ipset create pybles-web hash:ip family inet")
+        self.assertEqual(output[1], "ipset add pybles-web 10.0.0.1")
+        self.assertEqual(output[2], "ipset add pybles-web 10.0.0.2")
+        self.assertEqual(output[3], "ipset create pybles-web-v6 hash:ip family inet6")
+        self.assertEqual(output[4], "ipset add pybles-web-v6 fe80::1")
+        self.assertEqual(output[5], "ipset add pybles-web-v6 fe80::2")
+        self.assertEqual(output[6], "iptables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 80 -m set --match-set pybles-web dst")
+        self.assertEqual(output[7], "ip6tables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 80 -m set --match-set pybles-web-v6 dst")
+        self.assertEqual(output[8], "iptables -t filter -A INPUT -j ACCEPT -d 10.0.0.3")
+
+        p = pybles.PybleParser(iptables.Builder(groups = groups))
+        config = "filter { input { accept to group:nope; }}"
+        self.assertRaises(pybles.InvalidOption, p.parse_string, config)
+
+        p = pybles.PybleParser(iptables.Builder(groups = groups))
+        config = "filter { input { accept to 10.0.0.1,foo; }}"
+        self.assertRaises(pybles.InvalidOption, p.parse_string, config)
+
+    def test_group_in_restore_output(self):
+        b = iptables.Builder(groups = { "web": [ "10.0.0.1", "10.0.0.2" ] }, output = "restore")
+        p = pybles.PybleParser(b)
+        output = p.parse_string("filter { input { accept from group:web; }}")
+        self.assertEqual(output[0], "ipset create pybles-web hash:ip family inet")
+        self.assertTrue("-A INPUT -j ACCEPT -m set --match-set pybles-web src\n" in b.restore_payloads()["iptables-restore"])
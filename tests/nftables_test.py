@@ -0,0 +1,87 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import pybles
+import pybles.builders.nftables as nftables
+
+def chain(script, name):
+    lines = script.splitlines()
+    start = lines.index("\tchain %s {" % name) + 1
+    end = lines.index("\t}", start)
+    return [ line.strip() for line in lines[start:end] ]
+
+def compile(config, **kwargs):
+    b = nftables.Builder(**kwargs)
+    output = pybles.PybleParser(b).parse_string("filter { %s }" % config)
+    return (output, b.script())
+
+class NFTablesTest(unittest.TestCase):
+    def test_script(self):
+        (output, script) = compile("input { accept tcp dst-port:22; }")
+        self.assertEqual(0, len(output))
+        self.assertEqual(script.splitlines()[:3], [ "table inet pybles", "delete table inet pybles", "table inet pybles {" ])
+        self.assertEqual(chain(script, "input"), [ "type filter hook input priority 0; policy accept;", "tcp dport 22 accept" ])
+        self.assertEqual(chain(script, "output"), [ "type filter hook output priority 0; policy accept;" ])
+        self.assertTrue(script.endswith("}\n"))
+
+    def test_nested_chains(self):
+        (output, script) = compile("input { foo { bar { reject; } drop; } }")
+        self.assertEqual(chain(script, "input")[1:], [ "jump foo" ])
+        self.assertEqual(chain(script, "foo"), [ "jump bar", "drop" ])
+        self.assertEqual(chain(script, "bar"), [ "reject" ])
+
+    def test_ports(self):
+        (output, script) = compile("input { accept udp src-port:1000:; accept tcp dst-port::1024; accept tcp dst-port:10:20; }")
+        self.assertEqual(chain(script, "input")[1:], [ "udp sport 1000-65535 accept", "tcp dport 0-1024 accept", "tcp dport 10-20 accept" ])
+
+    def test_addresses(self):
+        (output, script) = compile("input { accept from 10.0.0.1,10.0.0.0/24,2001:db8::1; }")
+        self.assertEqual(chain(script, "input")[1:], [ "ip saddr { 10.0.0.1, 10.0.0.0/24 } accept", "ip6 saddr 2001:db8::1 accept" ])
+
+    def test_groups(self):
+        (output, script) = compile("output { accept to group:web; accept to group:web; }", groups = { "web": [ "10.0.0.1", "10.0.0.2" ] })
+        self.assertEqual(chain(script, "output")[1:], [ "ip daddr { 10.0.0.1, 10.0.0.2 } accept" ] * 2)
+
+    def test_self(self):
+        (output, script) = compile("input { accept to self; }", ips = [ "10.0.0.1", "10.0.0.2", "fe80::1" ])
+        self.assertTrue("\tset self_v4 {\n\t\ttype ipv4_addr\n\t\telements = { 10.0.0.1, 10.0.0.2 }\n\t}" in script)
+        self.assertTrue("\tset self_v6 {\n\t\ttype ipv6_addr\n\t\telements = { fe80::1 }\n\t}" in script)
+        self.assertEqual(chain(script, "input")[1:], [ "ip daddr @self_v4 accept", "ip6 daddr @self_v6 accept" ])
+
+    def test_mixed_family_addresses(self):
+        (output, script) = compile("input { accept from 10.0.0.1 to self tcp dst-port:22; }", ips = [ "10.0.0.5", "fe80::5" ])
+        self.assertEqual(chain(script, "input")[1:], [ "ip saddr 10.0.0.1 ip daddr @self_v4 tcp dport 22 accept" ])
+        self.assertRaises(pybles.InvalidOption, compile, "input { accept from 2001:db8::1 to 10.0.0.5; }")
+
+    def test_statements(self):
+        (output, script) = compile("input { log prefix \"in: \" rate-limit 5/min to int:eth0; accept rate-limit 10; }", interfaces = [ "eth0" ])
+        self.assertEqual(chain(script, "input")[1:], [ "iifname \"eth0\" limit rate 5/minute log prefix \"in: \"", "limit rate 10/second accept" ])
+
+    def test_options_checked(self):
+        self.assertRaises(pybles.InvalidOption, compile, "input { accept to self; }")
+        self.assertRaises(pybles.InvalidOption, compile, "input { accept tcp dst-port:ssh; }")
+        self.assertRaises(pybles.InvalidDirective, compile, "input { jump; }")
+
+    def test_test_conf(self):
+        b = nftables.Builder(ips = [ "10.0.0.1" ], interfaces = [ "lo", "eth0" ])
+        pybles.PybleParser(b).parse_file("%s/test.conf" % os.path.dirname(__file__))
+        script = b.script()
+        self.assertEqual(script.count("{"), script.count("}"))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,95 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+from pybles.builders.iptables.optimize import aggregate, parse_network
+
+def optimize(rules, **kwargs):
+    b = iptables.Builder(output = "restore", optimize = True, **kwargs)
+    pybles.PybleParser(b).parse_string("filter { input { %s }}" % rules)
+    return (b.ruleset(), b.optimize_report())
+
+class OptimizeTest(unittest.TestCase):
+    def test_requires_restore_output(self):
+        self.assertRaises(pybles.BuildException, iptables.Builder, optimize = True)
+
+    def test_duplicates(self):
+        (ruleset, report) = optimize("accept tcp dst-port:22; accept tcp dst-port:22; drop;")
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j ACCEPT -m tcp -p tcp --dport 22", "-j DROP" ])
+        self.assertEqual(report.duplicates, 2)
+        self.assertEqual(report.unreachable, 0)
+
+    def test_unreachable_after_catch_all(self):
+        (ruleset, report) = optimize("log; drop; accept tcp dst-port:22; foo { accept; }")
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j LOG", "-j DROP" ])
+        self.assertEqual(ruleset.specs("v4", "foo"), [ "-j ACCEPT" ])
+        self.assertEqual(report.unreachable, 4)
+
+    def test_shadowed(self):
+        (ruleset, report) = optimize("drop udp dst-port:111; accept udp dst-port:111 from 10.0.0.1; accept udp dst-port:112 from 10.0.0.1;")
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j DROP -m udp -p udp --dport 111", "-j ACCEPT -m udp -p udp --dport 112 -s 10.0.0.1" ])
+        self.assertEqual(report.unreachable, 1)
+        self.assertEqual(report.duplicates, 0)
+
+    def test_stateful_rules_kept(self):
+        (ruleset, report) = optimize("accept rate-limit 1/sec; accept rate-limit 1/sec; log; log;")
+        self.assertEqual(4, len(ruleset.specs("v4", "INPUT")))
+        self.assertEqual(0, report.saved())
+
+    def test_multiport(self):
+        (ruleset, report) = optimize("accept udp dst-port:53 to self; accept udp dst-port:67 to self; accept udp dst-port:1000:2000 to self; drop udp dst-port:69;", ips = [ "10.0.0.1" ])
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [
+            "-j ACCEPT -m udp -p udp -m multiport --dports 53,67,1000:2000 -m set --match-set iptables-self dst",
+            "-j DROP -m udp -p udp --dport 69",
+        ])
+        self.assertEqual(report.multiport, 4)
+
+    def test_multiport_limit(self):
+        (ruleset, report) = optimize(" ".join([ "accept tcp src-port:%d;" % port for port in range(20) ]))
+        rules = ruleset.specs("v4", "INPUT")
+        self.assertEqual(2, len(rules))
+        self.assertEqual(rules[0], "-j ACCEPT -m tcp -p tcp -m multiport --sports %s" % ",".join([ str(port) for port in range(15) ]))
+        self.assertEqual(rules[1], "-j ACCEPT -m tcp -p tcp -m multiport --sports 15,16,17,18,19")
+
+    def test_address_aggregation(self):
+        (ruleset, report) = optimize("accept from 10.0.0.0/25; accept from 10.0.0.128/25; accept from 10.0.1.0; accept from 10.0.1.1; accept from 10.0.3.0;")
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j ACCEPT -s 10.0.0.0/24", "-j ACCEPT -s 10.0.1.0/31", "-j ACCEPT -s 10.0.3.0" ])
+        self.assertEqual(report.aggregated, 2)
+        self.assertEqual(report.saved(), 2)
+
+    def test_aggregate(self):
+        networks = [ parse_network(address) for address in [ "10.0.0.3", "10.0.0.0", "10.0.0.2", "10.0.0.1/32", "10.0.0.0/31" ] ]
+        self.assertEqual(aggregate(networks), [ "10.0.0.0/30" ])
+
+        networks = [ parse_network(address) for address in [ "10.0.0.1", "10.0.0.2" ] ]
+        self.assertEqual(aggregate(networks), [ "10.0.0.1", "10.0.0.2" ])
+
+        networks = [ parse_network(address) for address in [ "fe80::/65", "fe80::8000:0:0:0/65", "fe80:0:0:1::/64" ] ]
+        self.assertEqual(aggregate(networks), [ "fe80::/63" ])
+
+        self.assertEqual(None, parse_network("10.0.0.300"))
+        self.assertEqual(None, parse_network("10.0.0.1/33"))
+
+    def test_report(self):
+        b = iptables.Builder(ips = [ "10.0.0.1" ], interfaces = [ "lo" ], output = "restore", optimize = True)
+        pybles.PybleParser(b).parse_file("%s/test.conf" % os.path.dirname(__file__))
+        b.restore_payloads()
+        report = b.optimize_report()
+        self.assertEqual(report.multiport, 12)
+        self.assertTrue(str(report).startswith("%d rules reduced to %d" % (report.rules, report.rules - report.saved())))
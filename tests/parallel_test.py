@@ -0,0 +1,94 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import unittest
+import multiprocessing
+import pybles
+import pybles.builders.iptables as iptables
+
+OPTIONS = { "ips": [ "10.0.0.1", "fe80::1" ], "interfaces": [ "eth0", "lo" ], "groups": { "web": [ "10.0.0.5", "10.0.0.6" ] } }
+
+with open(os.path.join(os.path.dirname(__file__), "test.conf")) as f:
+    CONFIG = f.read() + """
+filter {
+  input {
+    empty { }
+  }
+  output {
+    accept to group:web;
+    nested { accept udp dst-port:53; deeper { } }
+  }
+  forward {
+    accept from group:web;
+    tail { }
+  }
+}
+"""
+
+def compile_config(config, engine = "pyparsing", **kwargs):
+    options = dict(OPTIONS)
+    options.update(kwargs)
+    builder = iptables.Builder(**options)
+    return (list(pybles.PybleParser(builder, engine = engine).parse_string(config)), builder)
+
+class ParallelTest(unittest.TestCase):
+    def test_same_commands(self):
+        for engine in pybles.ENGINES:
+            (expected, builder) = compile_config(CONFIG, engine)
+            (commands, builder) = compile_config(CONFIG, engine, parallel = True, processes = 2)
+            self.assertEqual(expected, commands)
+
+    def test_same_restore_payloads(self):
+        (expected, sequential) = compile_config(CONFIG, output = "restore", optimize = True)
+        (commands, parallel) = compile_config(CONFIG, output = "restore", optimize = True, parallel = True, processes = 2)
+        self.assertEqual(expected, commands)
+        self.assertEqual(sequential.restore_payloads(), parallel.restore_payloads())
+
+    def test_pending_directives_carried(self):
+        # the declaration of the empty chain goes out with the first
+        # directive of the next top level chain
+        (commands, builder) = compile_config("filter { input { empty { } } output { drop; } }", parallel = True)
+        self.assertEqual([ command for command in commands if not command.startswith("ipset") ], [
+            "iptables -t filter -N empty",
+            "ip6tables -t filter -N empty",
+            "iptables -t filter -P empty RETURN",
+            "ip6tables -t filter -P empty RETURN",
+            "iptables -t filter -A INPUT -j empty",
+            "ip6tables -t filter -A INPUT -j empty",
+            "iptables -t filter -A OUTPUT -j DROP",
+            "ip6tables -t filter -A OUTPUT -j DROP",
+        ])
+
+    def test_shared_address_set(self):
+        (commands, builder) = compile_config("filter { input { accept from group:web; } output { accept to group:web; } }", parallel = True)
+        self.assertEqual(1, commands.count("ipset create pybles-web hash:ip family inet"))
+
+    def test_worker_errors(self):
+        self.assertRaises(pybles.InvalidOption, compile_config, "filter { input { accept to dst-int:eth9; } }", parallel = True)
+        self.assertRaises(pybles.InvalidBlock, compile_config, "filter { input { foo { output { } } } }", parallel = True)
+
+    def test_workers_stopped_on_error(self):
+        children = len(multiprocessing.active_children())
+        for engine in pybles.ENGINES:
+            for config in [ "filter { input { accept; } bogus { } }", "filter { input { accept; } output { accept" ]:
+                builder = iptables.Builder(parallel = True, processes = 2)
+                self.assertRaises((pybles.InvalidBlock, pybles.ParseError), pybles.PybleParser(builder, engine = engine).parse_string, config)
+                self.assertEqual(None, builder.filter_builder.worker_pool)
+        self.assertEqual(children, len(multiprocessing.active_children()))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,80 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+import pybles
+import pybles.system as system
+import pybles.builders.iptables as iptables
+from pybles.builders.iptables.profile import Counters, canonical
+
+SAVE = """*filter
+:INPUT ACCEPT [0:0]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [0:0]
+[5:300] -A INPUT -p tcp -m tcp --dport 22 -j ACCEPT
+[50:3000] -A INPUT -p tcp -m tcp --dport 80 -j ACCEPT
+[500:30000] -A INPUT -p tcp -m tcp --dport 443 -j ACCEPT
+[1:60] -A INPUT -j LOG
+[10:600] -A INPUT -p tcp -m tcp --dport 23 -j DROP
+[20:1200] -A INPUT -p tcp -m tcp --dport 25 -j DROP
+[900:54000] -A INPUT -s 10.0.0.1/32 -j DROP
+COMMIT
+"""
+
+CONFIG = "filter { input { accept tcp dst-port:22; accept tcp dst-port:80; accept tcp dst-port:443; log; drop tcp dst-port:23; drop tcp dst-port:25; drop from 10.0.0.1; }}"
+
+def compile_ruleset(config, counters):
+    b = iptables.Builder(output = "restore", counters = counters)
+    pybles.PybleParser(b).parse_string(config)
+    return b.ruleset()
+
+class ProfileTest(unittest.TestCase):
+    def test_canonical(self):
+        self.assertEqual(canonical("v4", "-j ACCEPT -m tcp -p tcp --dport 22"), canonical("v4", "-p tcp -m tcp --dport 22 -j ACCEPT"))
+        self.assertEqual(canonical("v4", "-j DROP -s 10.0.0.1"), canonical("v4", "-s 10.0.0.1/32 -j DROP"))
+        self.assertEqual(canonical("v6", "-j DROP -s fe80::1"), canonical("v6", "-s fe80::1/128 -j DROP"))
+        self.assertEqual(canonical("v4", "-j LOG --prefix \"a b\""), canonical("v4", "-j LOG --log-prefix \"a b\""))
+        self.assertNotEqual(canonical("v4", "-j DROP ! -s 10.0.0.1"), canonical("v4", "-j DROP -s 10.0.0.1"))
+
+    def test_requires_restore_output(self):
+        self.assertRaises(pybles.BuildException, iptables.Builder, counters = Counters())
+
+    def test_reorder(self):
+        counters = Counters.from_tables({ "v4": system.parse_save(SAVE) })
+        ruleset = compile_ruleset(CONFIG, counters)
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [
+            "-j ACCEPT -m tcp -p tcp --dport 443",
+            "-j ACCEPT -m tcp -p tcp --dport 80",
+            "-j ACCEPT -m tcp -p tcp --dport 22",
+            "-j LOG",
+            "-j DROP -s 10.0.0.1",
+            "-j DROP -m tcp -p tcp --dport 25",
+            "-j DROP -m tcp -p tcp --dport 23",
+        ])
+
+        # no v6 counters, so the source order is kept
+        self.assertEqual(ruleset.specs("v6", "INPUT"), compile_ruleset(CONFIG, Counters()).specs("v6", "INPUT"))
+
+    def test_stateful_rules_stay(self):
+        counters = Counters()
+        counters.add("v4", "INPUT", "-p tcp -m tcp --dport 80 -m limit --limit 1/sec -j ACCEPT", 1000)
+        counters.add("v4", "INPUT", "-p tcp -m tcp --dport 443 -j ACCEPT", 10)
+        ruleset = compile_ruleset("filter { input { accept tcp dst-port:22; accept tcp dst-port:80 rate-limit 1/sec; accept tcp dst-port:443; }}", counters)
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [
+            "-j ACCEPT -m tcp -p tcp --dport 22",
+            "-j ACCEPT -m tcp -p tcp --dport 80 -m limit --limit 1/sec",
+            "-j ACCEPT -m tcp -p tcp --dport 443",
+        ])
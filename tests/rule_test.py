@@ -0,0 +1,58 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+import pybles
+from pybles.builders.iptables.rule import Rule
+
+class RuleTest(unittest.TestCase):
+    def test_command(self):
+        rule = Rule("v6", "filter", "INPUT", target = "ACCEPT", protocol = "tcp", dport = ("22",), src = "fe80::1", in_interface = "eth0")
+        self.assertEqual(rule.command(), "ip6tables -t filter -A INPUT -j ACCEPT -m tcp -p tcp --dport 22 -s fe80::1 -i eth0")
+
+    def test_multiport(self):
+        rule = Rule("v4", "filter", "INPUT", target = "DROP", protocol = "udp", sport = ("53", "1000:2000"))
+        self.assertEqual(rule.spec(), "-j DROP -m udp -p udp -m multiport --sports 53,1000:2000")
+
+    def test_no_dict(self):
+        rule = Rule("v4", "filter", "INPUT", target = "DROP")
+        self.assertRaises(AttributeError, setattr, rule, "comment", "foo")
+
+    def test_equality(self):
+        rule = Rule("v4", "filter", "INPUT", target = "ACCEPT", dst = "10.0.0.1")
+        self.assertEqual(rule, rule.replace())
+        self.assertEqual(hash(rule), hash(rule.replace()))
+        self.assertNotEqual(rule, rule.replace(dst = "10.0.0.2"))
+        self.assertNotEqual(rule, Rule("v4", "filter", "OUTPUT", target = "ACCEPT", dst = "10.0.0.1"))
+
+    def test_matches(self):
+        rule = Rule("v4", "filter", "INPUT", target = "ACCEPT", protocol = "tcp", dport = ("22",))
+        self.assertEqual(rule.matches(), frozenset([ ("protocol", "tcp"), ("dport", ("22",)) ]))
+
+    def test_conflicting_field(self):
+        rule = Rule("v4", "filter", "INPUT", target = "ACCEPT")
+        rule.set("protocol", "tcp")
+        rule.set("protocol", "tcp")
+        self.assertRaises(pybles.InvalidOption, rule.set, "protocol", "udp")
+
+    def test_dict_round_trip(self):
+        rule = Rule("v4", "filter", "INPUT", target = "ACCEPT", protocol = "tcp", dport = ("22", "80"))
+        data = json.loads(json.dumps(rule.to_dict()))
+        self.assertEqual(rule, Rule.from_dict("v4", "filter", "INPUT", data))
+
+if __name__ == '__main__':
+    unittest.main()
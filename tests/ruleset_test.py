@@ -0,0 +1,132 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import random
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+from pybles.builders.iptables.ruleset import Ruleset, diff
+
+def compile_ruleset(config):
+    b = iptables.Builder(output = "restore")
+    pybles.PybleParser(b).parse_string(config)
+    return b.ruleset()
+
+def v4(commands):
+    return [ command for command in commands if command.startswith("iptables ") ]
+
+class RulesetTest(unittest.TestCase):
+    def test_builder_ruleset(self):
+        ruleset = compile_ruleset("filter { input { foochain { accept tcp dst-port:22; } drop; }}")
+        chains = ruleset.chains("v4")
+        self.assertEqual(list(chains.keys()), [ "INPUT", "FORWARD", "OUTPUT", "foochain" ])
+        self.assertEqual(ruleset.specs("v4", "INPUT"), [ "-j foochain", "-j DROP" ])
+        self.assertEqual(ruleset.specs("v4", "foochain"), [ "-j ACCEPT -m tcp -p tcp --dport 22" ])
+        self.assertEqual(ruleset.specs("v6", "foochain"), ruleset.specs("v4", "foochain"))
+        self.assertEqual(ruleset.chains("v4")["foochain"][0].dport, ("22",))
+
+    def test_save_load(self):
+        ruleset = compile_ruleset("filter { input { foochain { accept tcp dst-port:22; } drop; }}")
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "state.json")
+            ruleset.save(path)
+            self.assertEqual(ruleset, Ruleset.load(path))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_no_changes(self):
+        config = "filter { input { foochain { accept tcp dst-port:22; } drop; }}"
+        self.assertEqual([], diff(compile_ruleset(config), compile_ruleset(config)))
+
+    def test_initial_load(self):
+        new = compile_ruleset("filter { input { foochain { accept; } drop; }}")
+        self.assertEqual(v4(diff(Ruleset(), new)), [
+            "iptables -t filter -N foochain",
+            "iptables -t filter -A INPUT -j foochain",
+            "iptables -t filter -A INPUT -j DROP",
+            "iptables -t filter -A foochain -j ACCEPT",
+        ])
+
+    def test_single_rule_change(self):
+        rules = [ "accept tcp dst-port:%d;" % port for port in range(20, 30) ]
+        old = compile_ruleset("filter { input { %s drop; }}" % " ".join(rules))
+        rules[4] = "accept udp dst-port:24;"
+        new = compile_ruleset("filter { input { %s drop; }}" % " ".join(rules))
+        self.assertEqual(v4(diff(old, new)), [
+            "iptables -t filter -D INPUT 5",
+            "iptables -t filter -I INPUT 5 -j ACCEPT -m udp -p udp --dport 24",
+        ])
+
+    def test_insert_and_append(self):
+        old = compile_ruleset("filter { input { accept tcp dst-port:22; drop; }}")
+        new = compile_ruleset("filter { input { accept tcp dst-port:21; accept tcp dst-port:22; drop; log; }}")
+        self.assertEqual(v4(diff(old, new)), [
+            "iptables -t filter -I INPUT 1 -j ACCEPT -m tcp -p tcp --dport 21",
+            "iptables -t filter -A INPUT -j LOG",
+        ])
+
+    def test_chain_changes(self):
+        old = compile_ruleset("filter { input { oldchain { accept; } drop; }}")
+        new = compile_ruleset("filter { input { newchain { accept; } drop; }}")
+        self.assertEqual(v4(diff(old, new)), [
+            "iptables -t filter -N newchain",
+            "iptables -t filter -D INPUT 1",
+            "iptables -t filter -I INPUT 1 -j newchain",
+            "iptables -t filter -A newchain -j ACCEPT",
+            "iptables -t filter -F oldchain",
+            "iptables -t filter -X oldchain",
+        ])
+
+    def test_diff_applies(self):
+        old = compile_ruleset("filter { input { a { accept; drop; } log; accept; drop; log; reject; }}")
+        new = compile_ruleset("filter { input { log; drop; b { accept; } accept; reject; reject; } output { drop; }}")
+        self.assert_diff_applies(old, new)
+
+    def test_random_diffs_apply(self):
+        r = random.Random(42)
+        targets = [ "accept;", "drop;", "log;", "reject;" ]
+        for i in range(50):
+            configs = []
+            for j in range(2):
+                rules = [ r.choice(targets) for k in range(r.randint(0, 12)) ]
+                configs.append("filter { input { %s }}" % " ".join(rules))
+            self.assert_diff_applies(compile_ruleset(configs[0]), compile_ruleset(configs[1]))
+
+    def assert_diff_applies(self, old, new):
+        # replay the diff against the old chains and make sure
+        # the result is exactly the new chains
+        chains = dict([ (chain, old.specs("v4", chain)) for chain in old.chains("v4") ])
+        for command in v4(diff(old, new)):
+            args = command.split(" ", 5)
+            (op, chain) = (args[3], args[4])
+            if (op == "-N"):
+                chains[chain] = []
+            elif (op == "-X"):
+                del chains[chain]
+            elif (op == "-F"):
+                chains[chain] = []
+            elif (op == "-A"):
+                chains[chain].append(args[5])
+            elif (op == "-D"):
+                del chains[chain][int(args[5]) - 1]
+            elif (op == "-I"):
+                (position, spec) = args[5].split(" ", 1)
+                chains[chain].insert(int(position) - 1, spec)
+        self.assertEqual(chains, dict([ (chain, new.specs("v4", chain)) for chain in new.chains("v4") ]))
@@ -0,0 +1,114 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+
+CONFIG = """
+filter {
+  input {
+    foochain {
+      accept tcp dst-port:22;
+      accept tcp dst-port:80 rate-limit 1/sec;
+    }
+    log prefix "dropped";
+    drop;
+  }
+}
+"""
+
+class Clock():
+    # every reading is one second after the last one
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        self.now += 1
+        return float(self.now)
+
+def parse(engine = "pyparsing"):
+    stats = pybles.ParseStats(Clock())
+    builder = iptables.Builder()
+    commands = list(pybles.PybleParser(builder, engine = engine, stats = stats).parse_string(CONFIG))
+    return (stats, builder, commands)
+
+class StatsTest(unittest.TestCase):
+    def test_counts(self):
+        for engine in pybles.ENGINES:
+            (stats, builder, commands) = parse(engine)
+            self.assertEqual(1, stats.timing("phases", "parse").count)
+            self.assertEqual(3, stats.timing("blocks", "filter").count + stats.timing("blocks", "input").count + stats.timing("blocks", "foochain").count)
+            self.assertEqual(1, stats.timing("block_ends", "foochain").count)
+            self.assertEqual(2, stats.timing("directives", "accept").count)
+            self.assertEqual(1, stats.timing("directives", "drop").count)
+            self.assertEqual(2, stats.timing("options", "tcp").count)
+            self.assertEqual(1, stats.timing("options", "rate-limit").count)
+            self.assertEqual(1, stats.timing("options", "prefix").count)
+
+    def test_phases(self):
+        (stats, builder, commands) = parse("fast")
+        parse_time = stats.timing("phases", "parse").seconds
+        callbacks = stats.callback_seconds()
+        self.assertTrue(0 < callbacks < parse_time)
+        self.assertEqual(parse_time - callbacks, stats.tokenize_seconds())
+        self.assertEqual(callbacks, sum([ timing.seconds for category in [ "blocks", "block_ends", "directives" ] for timing in stats[category].values() ]))
+
+    def test_output_unchanged(self):
+        (stats, builder, commands) = parse()
+        self.assertEqual(commands, list(pybles.PybleParser(iptables.Builder()).parse_string(CONFIG)))
+
+    def test_not_attached(self):
+        builder = iptables.Builder()
+        parser = pybles.PybleParser(builder)
+        parser.parse_string(CONFIG)
+        self.assertEqual(None, builder.filter_builder.parse_stats)
+        self.assertFalse("start_block" in parser.__dict__)
+
+    def test_stream(self):
+        stats = pybles.ParseStats(Clock())
+        parser = pybles.PybleParser(iptables.Builder(), stats = stats)
+        for command in parser.iter_string(CONFIG):
+            pass
+        self.assertEqual(1, stats.timing("phases", "parse").count)
+        self.assertEqual(3, stats.timing("directives", "accept").count + stats.timing("directives", "drop").count)
+
+    def test_ruleset(self):
+        stats = pybles.ParseStats()
+        builder = iptables.Builder(output = "restore")
+        pybles.PybleParser(builder, stats = stats).parse_string(CONFIG)
+        builder.restore_payloads()
+        self.assertEqual(1, stats.timing("phases", "ruleset").count)
+
+    def test_dump(self):
+        (stats, builder, commands) = parse()
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "stats.json")
+            stats.dump(path)
+            with open(path) as f:
+                data = json.load(f)
+            self.assertEqual(2, data["directives"]["accept"]["count"])
+            self.assertEqual(stats.tokenize_seconds(), data["tokenize_seconds"])
+        finally:
+            shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,107 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.scanner
+import pybles.builders.iptables as iptables
+
+CONFIG = "filter {\n  input {\n    foochain { accept tcp dst-port:22; }\n    log rate-limit 1/sec prefix \"in dropped\";\n    drop;\n  }\n}\n"
+
+def chunked(string, size):
+    for i in range(0, len(string), size):
+        yield string[i:i + size]
+
+class StreamTest(unittest.TestCase):
+    def test_iter_string(self):
+        expected = list(pybles.PybleParser(iptables.Builder()).parse_string(CONFIG))
+        output = pybles.PybleParser(iptables.Builder()).iter_string(CONFIG)
+        self.assertFalse(isinstance(output, list))
+        self.assertEqual(expected, list(output))
+
+    def test_chunk_boundaries(self):
+        expected = list(pybles.PybleParser(iptables.Builder()).parse_string(CONFIG))
+        for size in range(1, 12):
+            p = pybles.PybleParser(iptables.Builder(), engine = "fast")
+            self.assertEqual(expected, list(p.iter_chunks(chunked(CONFIG, size))))
+
+    def test_yields_before_input_is_read(self):
+        read = []
+        def chunks():
+            for chunk in [ "filter { input { accept; ", "drop; ", "}}" ]:
+                read.append(chunk)
+                yield chunk
+
+        output = pybles.PybleParser(iptables.Builder()).iter_chunks(chunks())
+        self.assertEqual(next(output), "iptables -t filter -A INPUT -j ACCEPT")
+        self.assertEqual(1, len(read))
+        self.assertEqual(next(output), "ip6tables -t filter -A INPUT -j ACCEPT")
+        self.assertEqual(next(output), "iptables -t filter -A INPUT -j DROP")
+        self.assertEqual(2, len(read))
+
+    def test_error_across_chunks(self):
+        configs = [ "", "filter {} nat {\n", "filter {\n  input {\n    accept foo;\n  }\n}" ]
+        for config in configs:
+            try:
+                pybles.PybleParser().parse_string(config)
+                self.fail("parsed invalid config %r" % config)
+            except pybles.ParseError as pe:
+                expected = str(pe)
+
+            for size in range(1, 5):
+                p = pybles.PybleParser()
+                try:
+                    list(p.iter_chunks(chunked(config, size)))
+                    self.fail("streamed invalid config %r" % config)
+                except pybles.ParseError as pe:
+                    self.assertEqual(expected, str(pe))
+
+    def test_error_after_compaction(self):
+        compact_size = pybles.scanner.COMPACT_SIZE
+        pybles.scanner.COMPACT_SIZE = 8
+        try:
+            config = "filter {}\nfilter {\n  input {\n" + ("    accept;\n" * 20) + "    accept foo;\n  }\n}"
+            p = pybles.PybleParser(iptables.Builder())
+            try:
+                list(p.iter_chunks(chunked(config, 3)))
+                self.fail("streamed invalid config")
+            except pybles.ParseError as pe:
+                self.assertEqual("Expected end of text, found 'f'  (at char 10), (line:2, col:1)", str(pe))
+
+            config = "filter {\n  input {\n" + ("    accept;\n" * 20) + "  }\n}\nnat {\n  accept foo;\n}"
+            p = pybles.PybleParser()
+            try:
+                list(p.iter_chunks(chunked(config, 3)))
+                self.fail("streamed invalid config")
+            except pybles.ParseError as pe:
+                self.assertTrue(str(pe).endswith("(line:25, col:1)"))
+        finally:
+            pybles.scanner.COMPACT_SIZE = compact_size
+
+    def test_iter_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            infile = os.path.join(directory, "test.conf")
+            with open(infile, "w") as f:
+                f.write(CONFIG)
+            expected = list(pybles.PybleParser(iptables.Builder()).parse_string(CONFIG))
+            p = pybles.PybleParser(iptables.Builder())
+            self.assertEqual(expected, list(p.iter_file(infile, chunk_size = 5)))
+        finally:
+            shutil.rmtree(directory)
@@ -0,0 +1,109 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import shutil
+import socket
+import struct
+import tempfile
+import unittest
+import pybles.system as system
+
+SAVE = """# Generated by iptables-save v1.8.7 on Sat Oct 17 10:00:00 2026
+*filter
+:INPUT DROP [120:9600]
+:FORWARD ACCEPT [0:0]
+:OUTPUT ACCEPT [42:4200]
+:foochain - [0:0]
+[10:800] -A INPUT -j foochain
+[7:560] -A INPUT -p tcp -m tcp --dport 22 -j ACCEPT
+[3:240] -A foochain -s 10.0.0.0/8 -j ACCEPT
+COMMIT
+# Completed on Sat Oct 17 10:00:00 2026
+*nat
+:PREROUTING ACCEPT [0:0]
+:POSTROUTING ACCEPT [0:0]
+-A POSTROUTING -o eth0 -j MASQUERADE
+COMMIT
+"""
+
+IF_INET6 = """00000000000000000000000000000001 01 80 10 80       lo
+fe800000000000000000000000000001 04 40 20 80     eth0
+"""
+
+def netlink_message(kind, body):
+    return struct.pack("=IHHII", 16 + len(body), kind, 2, 1, 0) + body
+
+def address_message(family, index, prefix, attributes):
+    body = struct.pack("=BBBBI", family, prefix, 0, 0, index)
+    for (kind, value) in attributes:
+        attribute = struct.pack("=HH", 4 + len(value), kind) + value
+        body += attribute + b"\0" * (system.align(len(attribute)) - len(attribute))
+    return netlink_message(system.RTM_NEWADDR, body)
+
+class SystemTest(unittest.TestCase):
+    def test_parse_save(self):
+        tables = system.parse_save(SAVE)
+        self.assertEqual(list(tables.keys()), [ "filter", "nat" ])
+
+        table = tables["filter"]
+        self.assertEqual(table.builtin_chains(), [ "INPUT", "FORWARD", "OUTPUT" ])
+        self.assertEqual(table.custom_chains(), [ "foochain" ])
+        self.assertEqual(table.chains["INPUT"].policy, "DROP")
+        self.assertEqual(table.chains["INPUT"].packets, 120)
+
+        rules = table.chains["INPUT"].rules
+        self.assertEqual([ rule.spec for rule in rules ], [ "-j foochain", "-p tcp -m tcp --dport 22 -j ACCEPT" ])
+        self.assertEqual((rules[1].packets, rules[1].bytes), (7, 560))
+        self.assertEqual(table.chains["foochain"].rules[0].chain, "foochain")
+
+        rule = tables["nat"].chains["POSTROUTING"].rules[0]
+        self.assertEqual((rule.spec, rule.packets), ("-o eth0 -j MASQUERADE", 0))
+
+    def test_parse_save_errors(self):
+        self.assertRaises(system.StateError, system.parse_save, ":INPUT ACCEPT [0:0]")
+        self.assertRaises(system.StateError, system.parse_save, "*filter\n-A INPUT -j DROP\nCOMMIT")
+        self.assertRaises(system.StateError, system.parse_save, "*filter\n:INPUT ACCEPT [0:0]\n-I INPUT -j DROP\nCOMMIT")
+
+    def test_parse_addr_messages(self):
+        data = address_message(socket.AF_INET, 2, 24, [ (system.IFA_ADDRESS, socket.inet_aton("10.0.0.2")) ])
+        data += address_message(socket.AF_INET, 3, 32, [ (system.IFA_ADDRESS, socket.inet_aton("10.0.0.9")), (system.IFA_LOCAL, socket.inet_aton("10.0.0.3")) ])
+        data += address_message(socket.AF_INET6, 2, 64, [ (system.IFA_ADDRESS, socket.inet_pton(socket.AF_INET6, "fd00::2")) ])
+        (addresses, done) = system.parse_addr_messages(data)
+        self.assertFalse(done)
+        self.assertEqual(addresses, [ (2, "10.0.0.2", 24), (3, "10.0.0.3", 32), (2, "fd00::2", 64) ])
+
+        (addresses, done) = system.parse_addr_messages(netlink_message(system.NLMSG_DONE, struct.pack("=i", 0)))
+        self.assertTrue(done)
+
+        error = netlink_message(system.NLMSG_ERROR, struct.pack("=i", -1))
+        self.assertRaises(system.StateError, system.parse_addr_messages, error)
+
+    def test_parse_if_inet6(self):
+        self.assertEqual(system.parse_if_inet6(IF_INET6), [ (1, "::1", 128, "lo"), (4, "fe80::1", 64, "eth0") ])
+
+    def test_read_interfaces(self):
+        directory = tempfile.mkdtemp()
+        try:
+            for (name, index) in [ ("lo", 1), ("eth0", 4) ]:
+                os.mkdir(os.path.join(directory, name))
+                with open(os.path.join(directory, name, "ifindex"), "w") as f:
+                    f.write("%d\n" % index)
+            interfaces = system.read_interfaces(directory)
+            self.assertEqual(list(interfaces.keys()), [ "eth0", "lo" ])
+            self.assertEqual(interfaces["eth0"].index, 4)
+        finally:
+            shutil.rmtree(directory)
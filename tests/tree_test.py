@@ -0,0 +1,101 @@
+#
+# Copyright 2014 Andrew Bates
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import pybles
+import pybles.builders.iptables as iptables
+import pybles.builders.nftables as nftables
+from pybles import tree
+
+CONFIG = """filter {
+  input {
+    accept tcp dst-port:22 from 10.0.0.1;
+    include "services.conf";
+    foo { drop; }
+  }
+}
+"""
+
+class TreeTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "main.conf")
+        with open(self.path, "w") as f:
+            f.write(CONFIG)
+        with open(os.path.join(self.directory, "services.conf"), "w") as f:
+            f.write("accept udp dst-port:53;\n")
+        self.config = tree.parse_file(self.path)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_nodes(self):
+        self.assertEqual(self.config.path, self.path)
+        (filter_block,) = self.config.body
+        self.assertEqual(("filter", 1, 1), (filter_block.name, filter_block.line, filter_block.column))
+        (accept, included, foo) = filter_block.body[0].body
+        self.assertEqual(accept, tree.Directive("accept", (tree.Option("tcp", "dst-port:22"), tree.Option("from", "10.0.0.1")), 3, 5))
+        self.assertEqual(included.path, os.path.join(self.directory, "services.conf"))
+        self.assertEqual((4, 5), (included.line, included.column))
+        self.assertEqual(included.body, (tree.Directive("accept", (tree.Option("udp", "dst-port:53"),), 1, 1),))
+        self.assertEqual(foo, tree.Block("foo", (tree.Directive("drop", (), 5, 11),), 5, 5))
+        self.assertRaises(AttributeError, setattr, foo, "name", "bar")
+
+    def test_builders(self):
+        expected = list(pybles.PybleParser(iptables.Builder()).parse_file(self.path))
+        self.assertEqual(expected, pybles.PybleParser(iptables.Builder()).build_tree(self.config))
+
+        direct = nftables.Builder()
+        pybles.PybleParser(direct).parse_file(self.path)
+        built = nftables.Builder()
+        pybles.PybleParser(built).build_tree(self.config)
+        self.assertEqual(direct.script(), built.script())
+
+    def test_serialize(self):
+        outfile = os.path.join(self.directory, "tree.json")
+        tree.dump(self.config, outfile)
+        self.assertEqual(self.config, tree.load(outfile))
+        self.assertEqual(self.config, pickle.loads(pickle.dumps(self.config, pickle.HIGHEST_PROTOCOL)))
+
+    def test_parse_string(self):
+        self.assertEqual(self.config.body, tree.parse_string(CONFIG, self.path).body)
+        self.assertEqual(None, tree.parse_string("filter { }").path)
+
+    def message(self, parse, config):
+        try:
+            parse(config)
+        except pybles.ParseError as pe:
+            return str(pe)
+        self.fail("parsing %s succeeded" % config)
+
+    def test_errors(self):
+        for config in [ "filter { input { accept", "accept;" ]:
+            self.assertEqual(self.message(pybles.PybleParser(None).parse_string, config), self.message(tree.parse_string, config))
+
+        with open(os.path.join(self.directory, "services.conf"), "w") as f:
+            f.write("accept udp dst-port:53\n")
+        self.assertRaises(pybles.ParseError, tree.parse_file, self.path)
+
+        with open(os.path.join(self.directory, "services.conf"), "w") as f:
+            f.write("include \"main.conf\";\n")
+        self.assertRaises(pybles.ParseError, tree.parse_file, self.path)
+
+if __name__ == '__main__':
+    unittest.main()